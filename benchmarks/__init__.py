@@ -0,0 +1,8 @@
+# -*- coding:utf-8 -*-
+
+"""
+Benchmarks of staticjinja builds on synthetic sites
+
+Run them with ``python -m benchmarks run`` from the root of the repository,
+and compare two result files with ``python -m benchmarks compare``.
+"""
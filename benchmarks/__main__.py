@@ -0,0 +1,85 @@
+# -*- coding:utf-8 -*-
+
+"""staticjinja benchmarks, run with ``python -m benchmarks``.
+
+Usage:
+  benchmarks run [--output=<file> --repeat=<n> --jobs=<n>]
+                 [--pages=<n> --depth=<n> --fanout=<n>]
+                 [--sharing=<n> --static=<n> --data-files=<n>]
+                 [--data-size=<bytes> --seed=<n>]
+                 [--only=<a,b,c>]
+  benchmarks compare <old> <new>
+  benchmarks (-h | --help)
+
+Options:
+  -h --help            Show this screen.
+  --output=<file>      Write the results to this JSON file.
+  --repeat=<n>         Number of runs of each benchmark [default: 5].
+  --jobs=<n>           Number of processes used to render [default: 1].
+  --pages=<n>          Number of pages [default: 100].
+  --depth=<n>          Length of the chain of layouts [default: 3].
+  --fanout=<n>         Number of partials included by each page
+                       [default: 3].
+  --sharing=<n>        Average number of pages including each partial
+                       [default: 10].
+  --static=<n>         Number of static files [default: 20].
+  --data-files=<n>     Number of data files [default: 4].
+  --data-size=<bytes>  Size of each data file [default: 10000].
+  --seed=<n>           Seed of the generated site [default: 0].
+  --only=<a,b,c>       Only run these benchmarks.
+
+"""
+from __future__ import absolute_import, print_function
+
+import json
+import sys
+
+from docopt import docopt
+
+from .sitegen import SiteSpec
+from .suite import BenchmarkSuite, compare, run_suite
+
+_SPEC_OPTIONS = ('pages', 'depth', 'fanout', 'sharing', 'static',
+                 'data-files', 'data-size', 'seed')
+
+
+def main(argv=None):
+    args = docopt(__doc__, argv=argv)
+    if args['compare']:
+        with open(args['<old>']) as f:
+            old = json.load(f)
+        with open(args['<new>']) as f:
+            new = json.load(f)
+        for line in compare(old, new):
+            print(line)
+        return
+
+    try:
+        spec = SiteSpec(**dict(
+            (option.replace('-', '_'), int(args['--' + option]))
+            for option in _SPEC_OPTIONS))
+        repeat = int(args['--repeat'])
+        jobs = int(args['--jobs'])
+    except ValueError as e:
+        print("Invalid option: %s" % e)
+        sys.exit(1)
+    only = None
+    if args['--only']:
+        only = args['--only'].split(',')
+        unknown = set(only) - set(BenchmarkSuite.benchmarks)
+        if unknown:
+            print("Unknown benchmarks: %s" % ', '.join(sorted(unknown)))
+            sys.exit(1)
+
+    data = run_suite(spec, repeat=repeat, jobs=jobs, only=only)
+    for name, stats in sorted(data['results'].items()):
+        print("%-22s median %10.2fms  min %10.2fms" %
+              (name, stats['median'] * 1000, stats['min'] * 1000))
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            json.dump(data, f, sort_keys=True, indent=1)
+        print("Results written to %s." % args['--output'])
+
+
+if __name__ == '__main__':
+    main()
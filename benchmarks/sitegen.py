@@ -0,0 +1,190 @@
+# -*- coding:utf-8 -*-
+
+"""
+Generation of synthetic sites
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import random
+
+#: Directories of the generated sites, relative to their searchpath.
+LAYOUTS = '_layouts'
+PARTIALS = '_partials'
+PAGES = 'pages'
+STATIC = 'static'
+DATA = 'data'
+
+_LAYOUT_BASE = """<!doctype html>
+<html>
+<head><title>{% block title %}Benchmark{% endblock %}</title></head>
+<body>{% block body %}{% block content %}{% endblock %}{% endblock %}</body>
+</html>
+"""
+
+_LAYOUT = """{%% extends "%(parent)s" %%}
+{%% block body %%}
+<div class="level%(level)d">{{ super() }}</div>
+{%% endblock %%}
+"""
+
+_PARTIAL = """<section class="partial%(n)d">
+  <h2>Partial %(n)d</h2>
+  {%% for i in range(5) %%}<p>{{ i }} of partial %(n)d</p>{%% endfor %%}
+</section>
+"""
+
+_PAGE = """{%% extends "%(layout)s" %%}
+{%% block title %%}Page %(n)d{%% endblock %%}
+{%% block content %%}
+<h1>Page %(n)d</h1>
+%(includes)s
+<ul>
+{%% for item in items[:20] %%}<li>{{ item.name }}: {{ item.value }}</li>
+{%% endfor %%}
+</ul>
+{%% endblock %%}
+"""
+
+
+def layout_name(level):
+    """Return the name of the layout at *level* of the inheritance chain,
+    ``0`` being the base layout."""
+    return '%s/layout%d.html' % (LAYOUTS, level)
+
+
+def partial_name(n):
+    """Return the name of the *n*-th partial."""
+    return '%s/partial%d.html' % (PARTIALS, n)
+
+
+def data_name(n):
+    """Return the name of the *n*-th data file."""
+    return '%s/items%d.json' % (DATA, n)
+
+
+def page_name(n, data_files):
+    """Return the name of the *n*-th page. Pages are split into one
+    directory per data file."""
+    return '%s/d%d/page%05d.html' % (PAGES, n % data_files, n)
+
+
+class SiteSpec(object):
+    """
+    The shape of a synthetic site. Pages extend the deepest layout of an
+    inheritance chain, include partials picked at random, and list items of
+    a JSON data file.
+
+    :param pages:
+        Number of pages. Defaults to ``100``.
+
+    :param depth:
+        Length of the chain of layouts extending each other. Defaults to
+        ``3``.
+
+    :param fanout:
+        Number of partials included by each page. Defaults to ``3``.
+
+    :param sharing:
+        Average number of pages including each partial. Defaults to ``10``.
+
+    :param static:
+        Number of static files. Defaults to ``20``.
+
+    :param data_files:
+        Number of data files. Defaults to ``4``.
+
+    :param data_size:
+        Approximate size of each data file, in bytes. Defaults to
+        ``10000``.
+
+    :param seed:
+        Seed of the random choices, so that a spec always generates the same
+        site. Defaults to ``0``.
+
+    """
+    def __init__(self, pages=100, depth=3, fanout=3, sharing=10, static=20,
+                 data_files=4, data_size=10000, seed=0):
+        if pages < 1 or depth < 1 or data_files < 1:
+            raise ValueError("A site needs at least one page, layout and "
+                             "data file.")
+        self.pages = pages
+        self.depth = depth
+        self.fanout = fanout
+        self.sharing = sharing
+        self.static = static
+        self.data_files = data_files
+        self.data_size = data_size
+        self.seed = seed
+
+    @property
+    def partials(self):
+        """Number of partials."""
+        if not self.fanout:
+            return 0
+        return max(self.fanout,
+                   self.pages * self.fanout // max(self.sharing, 1))
+
+    def as_dict(self):
+        return {
+            'pages': self.pages,
+            'depth': self.depth,
+            'fanout': self.fanout,
+            'sharing': self.sharing,
+            'static': self.static,
+            'data_files': self.data_files,
+            'data_size': self.data_size,
+            'seed': self.seed,
+        }
+
+
+def _write(root, name, content):
+    path = os.path.join(root, *name.split('/'))
+    dirpath = os.path.dirname(path)
+    if not os.path.isdir(dirpath):
+        os.makedirs(dirpath)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def _items(n, size, rng):
+    """Return a list of items whose JSON dump is about *size* bytes."""
+    items = []
+    length = 2
+    while length < size:
+        item = {'name': 'item%d-%d' % (n, len(items)),
+                'value': rng.randint(0, 10 ** 6)}
+        items.append(item)
+        length += len(json.dumps(item)) + 2
+    return items
+
+
+def generate_site(path, spec):
+    """Write a synthetic site into *path*.
+
+    :param path: the directory of the site, used as its searchpath.
+
+    :param spec: a :class:`SiteSpec`.
+    """
+    rng = random.Random(spec.seed)
+    _write(path, layout_name(0), _LAYOUT_BASE)
+    for level in range(1, spec.depth):
+        _write(path, layout_name(level), _LAYOUT % {
+            'parent': layout_name(level - 1), 'level': level})
+    for n in range(spec.partials):
+        _write(path, partial_name(n), _PARTIAL % {'n': n})
+    layout = layout_name(spec.depth - 1)
+    for n in range(spec.pages):
+        partials = rng.sample(range(spec.partials), spec.fanout)
+        includes = '\n'.join('{%% include "%s" %%}' % partial_name(p)
+                             for p in sorted(partials))
+        _write(path, page_name(n, spec.data_files), _PAGE % {
+            'layout': layout, 'n': n, 'includes': includes})
+    for n in range(spec.data_files):
+        _write(path, data_name(n),
+               json.dumps(_items(n, spec.data_size, rng)))
+    for n in range(spec.static):
+        _write(path, '%s/file%d.css' % (STATIC, n),
+               '.rule%d { color: #%06x; }\n' % (n, rng.randint(0, 0xffffff)))
@@ -0,0 +1,306 @@
+# -*- coding:utf-8 -*-
+
+"""
+Benchmarks of the phases of a build
+"""
+
+from __future__ import absolute_import, division
+
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from staticjinja import CachedContext, DepGraph, Reloader, make_site
+
+from .sitegen import (DATA, PAGES, STATIC, data_name, generate_site,
+                      layout_name, partial_name)
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+#: Version of the format of the result files.
+FORMAT_VERSION = 1
+
+#: The root of the repository, from which ``staticjinja`` is imported by the
+#: startup benchmark.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _load_items(searchpath, name):
+    def items():
+        with open(os.path.join(searchpath, name)) as f:
+            return {'items': json.load(f)}
+    return items
+
+
+def make_benchmark_site(searchpath, outpath, spec, jobs=1):
+    """Create a :class:`Site <staticjinja.Site>` for a site generated by
+    :func:`generate_site <benchmarks.sitegen.generate_site>`.
+
+    :param searchpath: the directory of the generated site.
+
+    :param outpath: the output directory.
+
+    :param spec: the :class:`SiteSpec <benchmarks.sitegen.SiteSpec>` of the
+    site.
+
+    :param jobs: Optional. Number of processes used to render templates.
+    """
+    contexts = []
+    for n in range(spec.data_files):
+        name = data_name(n)
+        contexts.append((r'%s/d%d/.*' % (PAGES, n), CachedContext(
+            _load_items(searchpath, name), datafiles=[name])))
+    site = make_site(searchpath=searchpath, outpath=outpath,
+                     contexts=contexts, staticpaths=[STATIC],
+                     datapaths=[DATA], jobs=jobs)
+    site.logger.setLevel(logging.WARNING)
+    return site
+
+
+class _Quiet(object):
+    """Context manager discarding what is printed, such as the summary of
+    each batch of the reloader."""
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc_info):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def _stats(times):
+    times = sorted(times)
+    middle = len(times) // 2
+    if len(times) % 2:
+        median = times[middle]
+    else:
+        median = (times[middle - 1] + times[middle]) / 2
+    return {
+        'times': times,
+        'min': times[0],
+        'median': median,
+        'mean': sum(times) / len(times),
+    }
+
+
+class BenchmarkSuite(object):
+    """
+    Generates a synthetic site and times the phases of its builds. Each
+    benchmark runs on a fresh :class:`Site <staticjinja.Site>`, so that
+    nothing is memoized from a previous run.
+
+    :param spec:
+        A :class:`SiteSpec <benchmarks.sitegen.SiteSpec>`.
+
+    :param repeat:
+        Number of runs of each benchmark. Defaults to ``5``.
+
+    :param jobs:
+        Number of processes used to render templates. Defaults to ``1``.
+
+    :param workdir:
+        Optional. The directory in which the site is generated and built.
+        Defaults to a temporary directory, removed by :meth:`close`.
+
+    """
+    #: The benchmarks, in the order they run.
+    benchmarks = ('render', 'dep_graph', 'descendants', 'descendants_memoized',
+                  'reload_page', 'reload_partial', 'reload_data', 'startup')
+
+    def __init__(self, spec, repeat=5, jobs=1, workdir=None):
+        self.spec = spec
+        self.repeat = repeat
+        self.jobs = jobs
+        self._tmpdir = None
+        if workdir is None:
+            workdir = self._tmpdir = tempfile.mkdtemp(
+                prefix='staticjinja-bench-')
+        self.searchpath = os.path.join(workdir, 'site')
+        self.outpath = os.path.join(workdir, 'build')
+        generate_site(self.searchpath, spec)
+
+    def close(self):
+        """Remove the temporary directory, if any."""
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir)
+            self._tmpdir = None
+
+    def make_site(self, outpath=None):
+        return make_benchmark_site(self.searchpath, outpath or self.outpath,
+                                   self.spec, self.jobs)
+
+    def bench_render(self):
+        """Full build into an empty output directory."""
+        outpath = tempfile.mkdtemp(dir=os.path.dirname(self.outpath))
+        try:
+            site = self.make_site(outpath)
+            start = _clock()
+            site.render()
+            return _clock() - start
+        finally:
+            shutil.rmtree(outpath)
+
+    def bench_dep_graph(self):
+        """Construction of the dependency graph of the whole site."""
+        site = self.make_site()
+        site.sources.scan()
+        start = _clock()
+        DepGraph(site)
+        return _clock() - start
+
+    def bench_descendants(self):
+        """First query of the descendants of the base layout, which are all
+        the other templates."""
+        graph = DepGraph(self.make_site())
+        start = _clock()
+        graph.get_descendants(layout_name(0))
+        return _clock() - start
+
+    def bench_descendants_memoized(self):
+        """Second query of the descendants of the base layout."""
+        graph = DepGraph(self.make_site())
+        graph.get_descendants(layout_name(0))
+        start = _clock()
+        graph.get_descendants(layout_name(0))
+        return _clock() - start
+
+    def _reload(self, filename):
+        site = self.make_site()
+        reloader = Reloader(site)
+        path = os.path.join(self.searchpath, filename)
+        with _Quiet():
+            start = _clock()
+            reloader.event_handler('modified', path)
+            return _clock() - start
+
+    def _most_shared_partial(self):
+        graph = DepGraph(self.make_site())
+        partials = [partial_name(n) for n in range(self.spec.partials)]
+        return max(partials,
+                   key=lambda name: len(list(graph.get_descendants(name))))
+
+    def bench_reload_page(self):
+        """Reloader handling a modified page."""
+        site = self.make_site()
+        return self._reload(site.template_names[0])
+
+    def bench_reload_partial(self):
+        """Reloader handling a modified partial, included by the most
+        pages."""
+        return self._reload(self._shared_partial)
+
+    def bench_reload_data(self):
+        """Reloader handling a modified data file, used by a share of the
+        pages."""
+        return self._reload(data_name(0))
+
+    def bench_startup(self):
+        """``staticjinja build`` of a single page in a new process, which is
+        dominated by the startup of the interpreter and of staticjinja."""
+        workdir = os.path.dirname(self.outpath)
+        srcpath = os.path.join(workdir, 'tiny')
+        if not os.path.isdir(srcpath):
+            os.mkdir(srcpath)
+            with open(os.path.join(srcpath, 'index.html'), 'w') as f:
+                f.write('<p>{{ 1 + 1 }}</p>\n')
+        outpath = tempfile.mkdtemp(dir=workdir)
+        try:
+            with open(os.devnull, 'w') as devnull:
+                start = _clock()
+                subprocess.check_call(
+                    [sys.executable, '-m', 'staticjinja.cli', 'build',
+                     '--srcpath=%s' % srcpath, '--outpath=%s' % outpath],
+                    cwd=ROOT, stdout=devnull, stderr=devnull)
+                return _clock() - start
+        finally:
+            shutil.rmtree(outpath)
+
+    def run(self, only=None):
+        """Run the benchmarks and return their results.
+
+        :param only: Optional. The names of the benchmarks to run. Defaults
+        to all of them.
+        """
+        if self.spec.partials:
+            self._shared_partial = self._most_shared_partial()
+        # Reloader benchmarks need the outputs of a first build.
+        self.make_site().render()
+        results = {}
+        for name in only or self.benchmarks:
+            if name == 'reload_partial' and not self.spec.partials:
+                continue
+            bench = getattr(self, 'bench_' + name)
+            results[name] = _stats([bench() for _ in range(self.repeat)])
+        return results
+
+
+def _git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=ROOT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.decode('ascii').strip()
+
+
+def run_suite(spec, repeat=5, jobs=1, only=None):
+    """Generate a site, run the benchmarks on it and return a dictionary
+    which can be dumped to JSON.
+
+    :param spec: the :class:`SiteSpec <benchmarks.sitegen.SiteSpec>` of
+    the site.
+
+    :param repeat: Optional. Number of runs of each benchmark.
+
+    :param jobs: Optional. Number of processes used to render templates.
+
+    :param only: Optional. The names of the benchmarks to run.
+    """
+    suite = BenchmarkSuite(spec, repeat=repeat, jobs=jobs)
+    try:
+        results = suite.run(only)
+    finally:
+        suite.close()
+    return {
+        'version': FORMAT_VERSION,
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'spec': spec.as_dict(),
+        'repeat': repeat,
+        'jobs': jobs,
+        'results': results,
+    }
+
+
+def compare(old, new):
+    """Compare two results of :func:`run_suite` and return the lines of a
+    table of their median times.
+
+    :param old: the results of the reference run.
+
+    :param new: the results of the run to compare.
+    """
+    lines = []
+    if old['spec'] != new['spec'] or old['jobs'] != new['jobs']:
+        lines.append("Warning: the results are for different sites or "
+                     "number of jobs.")
+    lines.append("%-22s %12s %12s %8s" % ('benchmark', 'old', 'new', 'ratio'))
+    for name in sorted(set(old['results']) & set(new['results'])):
+        before = old['results'][name]['median']
+        after = new['results'][name]['median']
+        ratio = after / before if before else float('inf')
+        lines.append("%-22s %10.2fms %10.2fms %7.2fx" %
+                     (name, before * 1000, after * 1000, ratio))
+    return lines
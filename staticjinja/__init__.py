@@ -3,6 +3,19 @@
 
 from __future__ import absolute_import
 
-from .reloader import Reloader
-from .staticjinja import make_site, Site
+import sys
+
+from .staticjinja import make_site, CachedContext, Site
 from .dep_graph import DepGraph
+from .data import DataContext
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # The reloader is only needed to watch, import it on first use.
+        if name == 'Reloader':
+            from .reloader import Reloader
+            return Reloader
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
+else:
+    from .reloader import Reloader
@@ -0,0 +1,136 @@
+# -*- coding:utf-8 -*-
+
+"""
+Persistent compiled-template cache for staticjinja
+"""
+
+from __future__ import absolute_import
+
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+
+class TemplateCache(FileSystemBytecodeCache):
+    """
+    A :class:`jinja2.FileSystemBytecodeCache` storing compiled templates in
+    *directory*, with a size cap and least recently used eviction.
+
+    Jinja2 discards a compiled template whose own source changed. Templates
+    extending or including a changed template don't need to be compiled
+    again, since Jinja2 loads their parents when rendering them.
+    :meth:`invalidate` lets the :class:`Reloader <Reloader>` drop the entries
+    of deleted templates.
+
+    :param directory:
+        The directory to store compiled templates in. It is created if needed.
+
+    :param max_size:
+        Maximal size of the cache, in bytes. Defaults to ``None``, meaning no
+        limit.
+
+    """
+    def __init__(self, directory, max_size=None):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        super(TemplateCache, self).__init__(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Template name -> cache key, filled as templates are loaded.
+        self._keys = {}
+        # Running total size of the cache, so that it is only scanned when
+        # it goes over max_size.
+        self._size = None
+        if max_size is not None:
+            self._size = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        """Return a list of ``(mtime, size, path)`` for cached templates."""
+        entries = []
+        prefix, suffix = self.pattern.split('%s')
+        for name in os.listdir(self.directory):
+            if not (name.startswith(prefix) and name.endswith(suffix)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def get_bucket(self, environment, name, filename, source):
+        bucket = super(TemplateCache, self).get_bucket(
+            environment, name, filename, source)
+        self._keys[name] = bucket.key
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            # Mark the entry as recently used.
+            try:
+                os.utime(self._get_cache_filename(bucket), None)
+            except OSError:
+                pass
+        return bucket
+
+    def _file_size(self, path):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return 0
+
+    def dump_bytecode(self, bucket):
+        if self.max_size is None:
+            super(TemplateCache, self).dump_bytecode(bucket)
+            return
+        path = self._get_cache_filename(bucket)
+        old_size = self._file_size(path)
+        super(TemplateCache, self).dump_bytecode(bucket)
+        self._size += self._file_size(path) - old_size
+        if self._size > self.max_size:
+            # Leave some room below the cap, so that the next templates
+            # don't each trigger a scan of the cache.
+            self.evict(self.max_size * 9 // 10)
+
+    def evict(self, max_size):
+        """Remove the least recently used entries until the cache is no
+        bigger than *max_size* bytes.
+
+        :param max_size: the size to shrink the cache to, in bytes.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+
+    def invalidate(self, template_names):
+        """Drop the compiled version of some templates.
+
+        :param template_names: names of the templates to drop.
+        """
+        for name in template_names:
+            key = self._keys.pop(name, None)
+            if key is None:
+                continue
+            path = os.path.join(self.directory, self.pattern % key)
+            size = self._file_size(path)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            if self._size is not None:
+                self._size -= size
+
+    def reset_stats(self):
+        """Reset the hit and miss counters."""
+        self.hits = 0
+        self.misses = 0
@@ -5,17 +5,46 @@
 
 Usage:
   staticjinja build [--srcpath=<srcpath> --outpath=<outpath> --static=<a,b,c>]
+                    [--jobs=<n> --incremental --force --prune]
+                    [--profile --cprofile]
+                    [--trace=<file>]
   staticjinja watch [--srcpath=<srcpath> --outpath=<outpath> --static=<a,b,c>]
+                    [--watcher=<name> --trace=<file>]
+                    [--poll-interval=<s> --full-scan-interval=<s>]
+  staticjinja serve [--srcpath=<srcpath> --outpath=<outpath> --static=<a,b,c>]
+                    [--watcher=<name> --host=<host> --port=<port>]
+                    [--poll-interval=<s> --full-scan-interval=<s>]
   staticjinja (-h | --help)
   staticjinja --version
 
 Options:
   -h --help     Show this screen.
   --version     Show version.
+  --jobs=<n>    Number of processes used to render templates [default: 1].
+  --incremental  Only render the templates which changed since the last
+                build, using a manifest kept in the output directory.
+  --force       With --incremental, render every template, even the ones
+                which did not change since the last build.
+  --prune       Remove the outputs of templates and static files deleted
+                since the last build. Implies --incremental.
+  --profile     Log the slowest templates and context generators, and write
+                the time spent on each template to
+                staticjinja-profile.json.
+  --cprofile    Like --profile, and also run the build under cProfile.
+  --trace=<file>  Write a timeline of the build (and of the reloads) in the
+                Chrome trace event format, viewable in chrome://tracing or
+                Perfetto.
+  --host=<host>  Address the server listens on [default: 127.0.0.1].
+  --port=<port>  Port the server listens on [default: 8000].
+  --watcher=<name>  Filesystem watcher: inotify, easywatch or poll (for
+                network filesystems). Defaults to the best one available.
+  --poll-interval=<s>  Seconds between two checks of the poll watcher
+                (1 by default). Implies --watcher=poll.
+  --full-scan-interval=<s>  Only check files in unchanged directories every
+                <s> seconds with the poll watcher. Implies --watcher=poll.
 
 """
 from __future__ import print_function
-from docopt import docopt
 import os
 import staticjinja
 import sys
@@ -29,12 +58,25 @@ def render(args):
         A map from command-line options to their values. For example:
 
             {
+                '--force': False,
+                '--full-scan-interval': None,
                 '--help': False,
+                '--host': '127.0.0.1',
+                '--incremental': False,
+                '--jobs': '1',
                 '--outpath': None,
+                '--poll-interval': None,
+                '--port': '8000',
+                '--profile': False,
+                '--cprofile': False,
+                '--prune': False,
                 '--srcpath': None,
                 '--static': None,
+                '--trace': None,
                 '--version': False,
+                '--watcher': None,
                 'build': True,
+                'serve': False,
                 'watch': False
             }
     """
@@ -73,15 +115,78 @@ def render(args):
     site = staticjinja.make_site(
         searchpath=srcpath,
         outpath=outpath,
-        staticpaths=staticpaths
+        staticpaths=staticpaths,
+        incremental=bool(args.get('--incremental') or args.get('--prune'))
     )
 
+    try:
+        jobs = int(args.get('--jobs') or 1)
+    except ValueError:
+        print("The number of jobs '%s' is invalid." % args['--jobs'])
+        sys.exit(1)
+
+    watcher = args.get('--watcher')
+    if watcher is not None:
+        from staticjinja.watchers import get_watcher
+        try:
+            get_watcher(watcher)
+        except ValueError:
+            print("The watcher '%s' is invalid." % watcher)
+            sys.exit(1)
+
+    intervals = {}
+    for option, name in [('--poll-interval', 'interval'),
+                         ('--full-scan-interval', 'full_scan_interval')]:
+        if args.get(option) is None:
+            continue
+        try:
+            intervals[name] = float(args[option])
+        except ValueError:
+            print("The %s '%s' is invalid." % (option[2:].replace('-', ' '),
+                                               args[option]))
+            sys.exit(1)
+    if intervals:
+        if watcher not in (None, 'poll'):
+            print("--poll-interval and --full-scan-interval need the poll "
+                  "watcher.")
+            sys.exit(1)
+        from functools import partial
+        from staticjinja.watchers import PollingWatcher
+        watcher = partial(PollingWatcher, **intervals)
+
+    if args.get('serve'):
+        try:
+            port = int(args.get('--port') or 8000)
+        except ValueError:
+            print("The port '%s' is invalid." % args['--port'])
+            sys.exit(1)
+        from staticjinja.server import DevServer
+        DevServer(site, host=args.get('--host') or '127.0.0.1', port=port,
+                  watcher=watcher).serve_forever()
+        return
+
+    # Optional features are imported on demand, to keep the startup of small
+    # builds fast.
+    profile = None
+    if args.get('--profile') or args.get('--cprofile'):
+        from staticjinja.profiling import BuildProfile
+        profile = BuildProfile('staticjinja-profile.json',
+                               cprofile=bool(args.get('--cprofile')))
+
+    trace = None
+    if args.get('--trace'):
+        from staticjinja.tracing import TraceRecorder
+        trace = TraceRecorder(args['--trace'])
+
     use_reloader = args['watch']
 
-    site.render(use_reloader=use_reloader)
+    site.render(use_reloader=use_reloader, jobs=jobs,
+                force=bool(args.get('--force')), watcher=watcher,
+                prune=bool(args.get('--prune')), profile=profile, trace=trace)
 
 
 def main():
+    from docopt import docopt
     render(docopt(__doc__, version='staticjinja 0.3.0'))
 
 
@@ -0,0 +1,263 @@
+# -*- coding:utf-8 -*-
+
+"""
+Parsing and caching of data files
+"""
+
+from __future__ import absolute_import
+
+import csv
+import io
+import json
+import os
+import threading
+
+from collections import OrderedDict
+
+
+def load_json(path, encoding):
+    """Parse a JSON file."""
+    with io.open(path, encoding=encoding) as f:
+        return json.load(f)
+
+
+def load_json_lines(path, encoding):
+    """Parse a JSON Lines file into a list, skipping blank lines."""
+    with io.open(path, encoding=encoding) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_csv(path, encoding):
+    """Parse a CSV file with a header row into a list of dictionaries."""
+    with io.open(path, encoding=encoding, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def load_yaml(path, encoding):
+    """Parse a YAML file. Needs PyYAML."""
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError("Loading %s needs PyYAML." % path)
+    with io.open(path, encoding=encoding) as f:
+        return yaml.safe_load(f)
+
+
+def load_toml(path, encoding):
+    """Parse a TOML file. Needs Python 3.11, tomli or toml."""
+    for name in ('tomllib', 'tomli'):
+        try:
+            module = __import__(name)
+        except ImportError:
+            continue
+        with open(path, 'rb') as f:
+            return module.load(f)
+    try:
+        import toml
+    except ImportError:
+        raise ImportError("Loading %s needs Python 3.11, tomli or toml." %
+                          path)
+    with io.open(path, encoding=encoding) as f:
+        return toml.load(f)
+
+
+#: The default loaders, by file extension.
+LOADERS = {
+    '.json': load_json,
+    '.jsonl': load_json_lines,
+    '.csv': load_csv,
+    '.yaml': load_yaml,
+    '.yml': load_yaml,
+    '.toml': load_toml,
+}
+
+
+def _stamp(st):
+    return (getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size)
+
+
+class DataCache(object):
+    """
+    Parses data files with a loader chosen by their extension, and keeps the
+    parsed objects until the file changes. Entries are keyed by name and
+    checked against the modification time and size of the file on each
+    access.
+
+    The cached objects are shared by every template using them, so they
+    should not be modified.
+
+    :param searchpath:
+        The directory the names of the data files are relative to.
+
+    :param loaders:
+        Optional. A dictionary mapping file extensions (such as ``'.json'``)
+        to functions taking the path of a file and an encoding and returning
+        the parsed data. They extend and override :data:`LOADERS`.
+
+    :param max_size:
+        Optional. Maximal total size, in bytes, of the data files whose
+        parsed objects are kept. The least recently used ones are dropped
+        first. The size of a file is an estimate of the memory used by its
+        parsed data. Defaults to ``None``, meaning no limit.
+
+    :param encoding:
+        The encoding of the text files. Defaults to ``'utf8'``.
+
+    :param indexpath:
+        Optional. The directory in which the :class:`RecordIndex
+        <staticjinja.records.RecordIndex>` objects built by :meth:`index` are
+        saved between builds.
+
+    """
+    def __init__(self, searchpath, loaders=None, max_size=None,
+                 encoding='utf8', indexpath=None):
+        self.searchpath = searchpath
+        self.loaders = dict(LOADERS)
+        if loaders:
+            self.loaders.update(loaders)
+        self.max_size = max_size
+        self.encoding = encoding
+        self.indexpath = indexpath
+        # (name, key) -> RecordIndex
+        self._indexes = {}
+        # Name -> (stamp, data), least recently used first.
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_loader(self, filename):
+        """Return the loader of a data file.
+
+        :param filename: the name of the file.
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        try:
+            return self.loaders[ext]
+        except KeyError:
+            raise ValueError("No loader for data file %s." % filename)
+
+    def load(self, filename):
+        """Return the parsed content of a data file, parsing it only if it
+        changed since it was cached.
+
+        :param filename: the name of the file, relative to the searchpath.
+        """
+        loader = self.get_loader(filename)
+        path = os.path.join(self.searchpath, filename)
+        stamp = _stamp(os.stat(path))
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and entry[0] == stamp:
+                self._entries.pop(filename)
+                self._entries[filename] = entry
+                self.hits += 1
+                return entry[1]
+        data = loader(path, self.encoding)
+        with self._lock:
+            self.misses += 1
+            self._pop(filename)
+            if self.max_size is None or stamp[1] <= self.max_size:
+                self._entries[filename] = (stamp, data)
+                self.size += stamp[1]
+                while self.max_size is not None and self.size > self.max_size:
+                    self._pop(next(iter(self._entries)))
+        return data
+
+    def index(self, filename, key=None):
+        """Return a :class:`RecordIndex <staticjinja.records.RecordIndex>`
+        over the records of a JSON Lines or CSV file, building it again only
+        if the file changed. The records are read on demand instead of
+        parsing the whole file.
+
+        :param filename: the name of the file, relative to the searchpath.
+
+        :param key: Optional. The field identifying each record.
+        """
+        from .records import RecordIndex
+        path = os.path.join(self.searchpath, filename)
+        stamp = _stamp(os.stat(path))
+        with self._lock:
+            index = self._indexes.get((filename, key))
+            if index is not None and index.stamp == stamp:
+                return index
+        index = RecordIndex(path, key, self.encoding, self.indexpath)
+        with self._lock:
+            old = self._indexes.get((filename, key))
+            if old is not None:
+                old.close()
+            self._indexes[(filename, key)] = index
+        return index
+
+    def _pop(self, filename):
+        entry = self._entries.pop(filename, None)
+        if entry is None:
+            return False
+        self.size -= entry[0][1]
+        return True
+
+    def invalidate(self, filename):
+        """Forget the parsed content and the record indexes of a data file.
+
+        Returns ``True`` if it was cached.
+
+        :param filename: the name of the file, relative to the searchpath.
+        """
+        with self._lock:
+            found = self._pop(filename)
+            for name, key in list(self._indexes):
+                if name == filename:
+                    self._indexes.pop((name, key)).close()
+                    found = True
+            return found
+
+    def clear(self):
+        """Forget every parsed data file and record index."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            for index in self._indexes.values():
+                index.close()
+            self._indexes.clear()
+
+    def __contains__(self, filename):
+        return filename in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DataContext(object):
+    """A context made of parsed data files.
+
+    The files are loaded through the data cache of the site, and templates
+    using this context depend on them::
+
+        contexts = [('products/.*', DataContext(products='data/products.csv',
+                                                 config='data/site.toml'))]
+
+    :param datafiles:
+        Keyword arguments mapping names of context variables to the data
+        files, relative to searchpath, to load into them.
+    """
+
+    def __init__(self, **datafiles):
+        self.variables = datafiles
+
+    @property
+    def datafiles(self):
+        return sorted(self.variables.values())
+
+    def load(self, site):
+        """Return the context, loading the data files with *site*.
+
+        :param site: the :class:`Site <staticjinja.Site>` rendering the
+        template.
+        """
+        return dict((name, site.load_data(filename))
+                    for name, filename in self.variables.items())
+
+    def __repr__(self):
+        return "DataContext(%s)" % ", ".join(
+            "%s=%r" % item for item in sorted(self.variables.items()))
@@ -4,7 +4,110 @@
 Dependency graph for staticjina
 """
 
-from copy import deepcopy
+import json
+import os
+import threading
+
+from array import array
+from itertools import chain
+
+try:
+    from sys import intern
+except ImportError:
+    pass  # Python 2, where intern is a builtin
+
+from .manifest import file_hash
+
+
+class DepCache(object):
+    """
+    The templates referenced by each (maybe partial) template, persisted
+    between runs so that only modified templates have to be parsed again.
+
+    An entry is valid if the size and modification time of its file did not
+    change, or failing that, if its content hash did not change.
+
+    :param path:
+        The path of the JSON file storing the cache.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+    @classmethod
+    def load(cls, path):
+        """Load the cache stored at *path*, or an empty cache.
+
+        :param path: the path of the JSON file storing the cache.
+        """
+        cache = cls(path)
+        try:
+            with open(path) as f:
+                cache.entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+        return cache
+
+    def save(self):
+        """Write the cache to disk."""
+        head = os.path.dirname(self.path)
+        if head and not os.path.exists(head):
+            os.makedirs(head)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def get(self, filename, path):
+        """Return the cached dependencies of *filename*, or ``None`` if they
+        are unknown or outdated.
+
+        :param filename: the name of the template.
+
+        :param path: the absolute path of the template.
+        """
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+            return entry['deps']
+        if entry['hash'] == file_hash(path):
+            entry['mtime'] = st.st_mtime
+            entry['size'] = st.st_size
+            return entry['deps']
+        return None
+
+    def set(self, filename, path, deps):
+        """Record the dependencies of *filename*.
+
+        :param filename: the name of the template.
+
+        :param path: the absolute path of the template.
+
+        :param deps: a list of names of templates referenced by *filename*.
+        """
+        st = os.stat(path)
+        self.entries[filename] = {
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'hash': file_hash(path),
+            'deps': list(deps),
+        }
+
+    def prune(self, filenames):
+        """Forget the templates which are not in *filenames*.
+
+        :param filenames: the names of the existing templates.
+        """
+        filenames = set(filenames)
+        for filename in list(self.entries):
+            if filename not in filenames:
+                del self.entries[filename]
 
 
 class DepGraph(object):
@@ -12,23 +115,158 @@ class DepGraph(object):
     A directed graph which will handle dependencies between templates and data
     files in a site.
 
+    Each file is interned and given an integer id, and the edges are stored
+    as arrays of ids. The descendants of a file are memoized until an update
+    of the graph changes them.
+
     :param site:
         A :class:`Site <Site>` object.
 
     """
     def __init__(self, site):
-        self.parents = dict(
-                (s, set()) for s in site.jinja_names + site.data_names
-                )
-        self.children = deepcopy(self.parents)
+        self._reset()
+        for filename in chain(site.jinja_names, site.data_names):
+            self._id(filename)
 
+        jinja_deps = site.find_all_jinja_deps(site.jinja_names)
         for filename in site.jinja_names:
-            self.parents[filename] = site.get_file_dep(filename)
-            for d in self.parents[filename]:
-                self.children[d].add(filename)
+            self._set_parents(self._id(filename), site.get_file_dep(
+                filename, jinja_deps[filename]))
 
         self.site = site
 
+    @classmethod
+    def from_parents(cls, parents, site=None):
+        """Build a graph from a dictionary mapping each file to the set of
+        files it depends on.
+
+        :param parents: the dictionary of dependencies.
+
+        :param site: Optional. A :class:`Site <Site>` object, needed to
+        :meth:`update` the graph.
+        """
+        graph = cls.__new__(cls)
+        graph._reset()
+        graph.parents = parents
+        graph.site = site
+        return graph
+
+    def _reset(self):
+        # Name -> id, and id -> interned name.
+        self._ids = {}
+        self._names = []
+        # Id -> array of ids of its parents/children.
+        self._parents = []
+        self._children = []
+        # Id -> tuple of names of its descendants.
+        self._descendants = {}
+        # The graph may be updated by the reloader while a background worker
+        # records dependencies.
+        self._lock = threading.RLock()
+
+    def _id(self, filename):
+        """Return the id of a file, adding it to the graph if needed."""
+        try:
+            return self._ids[filename]
+        except KeyError:
+            pass
+        filename = intern(filename)
+        node = self._ids[filename] = len(self._names)
+        self._names.append(filename)
+        self._parents.append(array('i'))
+        self._children.append(array('i'))
+        return node
+
+    def _set_parents(self, node, parents):
+        """Replace the parents of *node*, keeping children consistent.
+
+        :param node: the id of a file.
+
+        :param parents: an iterable of names of files.
+        """
+        new = set(self._id(p) for p in parents if p is not None)
+        old = set(self._parents[node])
+        if new == old:
+            return
+        self._invalidate(node, old | new)
+        for lost in old - new:
+            self._children[lost].remove(node)
+        for gained in sorted(new - old):
+            self._children[gained].append(node)
+        self._parents[node] = array('i', sorted(new))
+
+    def _invalidate(self, node, parents):
+        """Forget the memoized descendants which depend on edges going into
+        *node*, that is the descendants of its (old and new) ancestors."""
+        if not self._descendants:
+            return
+        for ancestor in self._closure(self._parents, parents):
+            self._descendants.pop(ancestor, None)
+
+    def _closure(self, adjacency, start):
+        """Return the set of ids reachable from the ids in *start*, including
+        them, following *adjacency*.
+        """
+        seen = set(start)
+        stack = list(seen)
+        while stack:
+            for other in adjacency[stack.pop()]:
+                if other not in seen:
+                    seen.add(other)
+                    stack.append(other)
+        return seen
+
+    def _as_dict(self, adjacency):
+        names = self._names
+        return dict((names[node], set(names[other] for other in adj))
+                    for node, adj in enumerate(adjacency)
+                    if names[node] is not None)
+
+    def _from_dict(self, adjacency, mapping):
+        for filename, others in mapping.items():
+            self._id(filename)
+            for other in others:
+                self._id(other)
+        for filename, others in mapping.items():
+            adjacency[self._ids[filename]] = array(
+                'i', sorted(self._ids[other] for other in others))
+        self._descendants = {}
+
+    @property
+    def parents(self):
+        """Dictionary mapping each file to the set of files it depends on."""
+        return self._as_dict(self._parents)
+
+    @parents.setter
+    def parents(self, parents):
+        if not hasattr(self, '_ids'):
+            self._reset()
+        self._from_dict(self._parents, parents)
+        if not any(self._children):
+            # Derive the children if they were not given.
+            for node, adj in enumerate(self._parents):
+                for parent in adj:
+                    self._children[parent].append(node)
+
+    @property
+    def children(self):
+        """Dictionary mapping each file to the set of files depending on
+        it."""
+        return self._as_dict(self._children)
+
+    @children.setter
+    def children(self, children):
+        if not hasattr(self, '_ids'):
+            self._reset()
+        self._children = [array('i') for _ in self._names]
+        self._from_dict(self._children, children)
+
+    def __contains__(self, filename):
+        return filename in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
     def connected_components(self, adjacency, start):
         """Returns the (directed) connected component of start in the graph with
         given adjacency dict.
@@ -58,9 +296,67 @@ class DepGraph(object):
     def get_descendants(self, filename):
         """Returns all descendant of the given template or data file.
 
+        The result is memoized until :meth:`update` changes it.
+
         :param filename: the template or data file whose descendant we seek.
         """
-        return self.connected_components(self.children, filename)
+        with self._lock:
+            node = self._ids[filename]
+            try:
+                return self._descendants[node]
+            except KeyError:
+                pass
+            reachable = self._closure(self._children, self._children[node])
+            reachable.discard(node)
+            names = self._names
+            descendants = tuple(sorted(names[other] for other in reachable))
+            self._descendants[node] = descendants
+            return descendants
+
+    def get_ancestors(self, filename):
+        """Returns all files the given template or data file depends on,
+        directly or not.
+
+        :param filename: the template or data file whose ancestors we seek.
+        """
+        with self._lock:
+            node = self._ids[filename]
+            reachable = self._closure(self._parents, self._parents[node])
+            reachable.discard(node)
+            return sorted(self._names[other] for other in reachable)
+
+    def add_parents(self, filename, parents):
+        """Add dependencies of a file, for instance the ones recorded while
+        rendering it. Existing dependencies are kept.
+
+        :param filename: the template or data file depending on *parents*.
+
+        :param parents: an iterable of names of files.
+        """
+        with self._lock:
+            node = self._id(filename)
+            current = [self._names[parent] for parent in self._parents[node]]
+            self._set_parents(node, chain(current, parents))
+
+    def remove(self, filename):
+        """Remove a deleted file from the graph.
+
+        The file no longer depends on anything. If other files still depend
+        on it, it is kept so that these dependencies are found again if it
+        is created again.
+
+        :param filename: the name of the deleted template or data file.
+        """
+        with self._lock:
+            node = self._ids.get(filename)
+            if node is None:
+                return
+            self._set_parents(node, ())
+            self._descendants.pop(node, None)
+            if not self._children[node]:
+                # Its id is not reused, only its name is forgotten.
+                del self._ids[filename]
+                self._names[node] = None
 
     def update(self, filename):
         """
@@ -70,11 +366,6 @@ class DepGraph(object):
         :param filename: A string giving the relative path of the template or
         data file.
         """
-        old_parents = self.parents.get(filename, set())
-        new_parents = self.site.get_file_dep(filename)
-        if new_parents != old_parents:
-            for lost_parent in old_parents.difference(new_parents):
-                self.children[lost_parent].remove(filename)
-            for new_parent in new_parents.difference(old_parents):
-                self.children[new_parent].add(filename)
-            self.parents[filename] = new_parents
+        parents = self.site.get_file_dep(filename)
+        with self._lock:
+            self._set_parents(self._id(filename), parents)
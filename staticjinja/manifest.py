@@ -0,0 +1,126 @@
+# -*- coding:utf-8 -*-
+
+"""
+Build manifest for incremental builds
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+
+
+def file_hash(path):
+    """Return the hex digest of the content of the file at *path*.
+
+    :param path: the absolute path of the file to hash.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def context_hash(context, memo=None):
+    """Return a fingerprint of a rendering context.
+
+    Values which cannot be serialized to JSON are fingerprinted using their
+    ``repr``. When this ``repr`` is not stable between runs (e.g. it contains
+    an object address), the template is simply re-rendered every time.
+
+    :param context: the dictionary used to render a template.
+
+    :param memo: Optional. A dictionary caching the fingerprint of each value
+    by identity, so that a value shared by the contexts of many templates is
+    only serialized once. It must not outlive the values, which must not be
+    modified while it is used.
+    """
+    digest = hashlib.sha1()
+    for key in sorted(context):
+        value = context[key]
+        cached = memo.get(id(value)) if memo is not None else None
+        if cached is None:
+            dump = json.dumps(value, sort_keys=True, default=repr)
+            cached = (value, hashlib.sha1(dump.encode('utf8')).hexdigest())
+            if memo is not None:
+                # The value is kept so that its id isn't reused.
+                memo[id(value)] = cached
+        digest.update(('%s\0%s\0' % (json.dumps(key), cached[1])).encode(
+            'utf8'))
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """
+    Records, for each rendered template, the fingerprints of everything used
+    to render it: the template source, the (transitive) dependencies found in
+    the :class:`DepGraph <DepGraph>` and the context. It also lists the
+    static files copied, so that outputs of deleted files can be pruned.
+
+    :param path:
+        The path of the JSON file storing the manifest.
+
+    """
+    filename = '.staticjinja-manifest.json'
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.static = []
+
+    @classmethod
+    def load(cls, path):
+        """Load the manifest stored at *path*.
+
+        A missing or unreadable manifest gives an empty manifest, which
+        means everything will be rendered.
+
+        :param path: the path of the JSON file storing the manifest.
+        """
+        manifest = cls(path)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            manifest.entries = data.get('templates', {})
+            manifest.static = data.get('static', [])
+        except (IOError, OSError, ValueError):
+            pass
+        return manifest
+
+    def save(self):
+        """Write the manifest to disk."""
+        head = os.path.dirname(self.path)
+        if head and not os.path.exists(head):
+            os.makedirs(head)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'templates': self.entries, 'static': self.static}, f,
+                      sort_keys=True, indent=1)
+        os.rename(tmp_path, self.path)
+
+    def recorded_deps(self):
+        """Return a dictionary mapping each template to the templates it
+        used during its last rendering."""
+        return dict((name, entry.get('recorded', []))
+                    for name, entry in self.entries.items())
+
+    def outdated_reason(self, template_name, entry):
+        """Return why *template_name* must be rendered again, or ``None`` if
+        the recorded entry matches *entry*.
+
+        :param template_name: the name of the template.
+
+        :param entry: the fingerprints of the template for this build.
+        """
+        old = self.entries.get(template_name)
+        if old is None:
+            return "new"
+        if old.get('source') != entry['source']:
+            return "template changed"
+        if old.get('deps') != entry['deps']:
+            return "dependency changed"
+        if old.get('context') != entry['context']:
+            return "context changed"
+        return None
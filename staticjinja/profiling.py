@@ -0,0 +1,263 @@
+# -*- coding:utf-8 -*-
+
+"""
+Timing of the phases of a build
+"""
+
+from __future__ import absolute_import
+
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+#: Phases timed for each template, in the order they happen.
+TEMPLATE_PHASES = ('load', 'context', 'render', 'write', 'rule')
+
+
+def generator_name(generator):
+    """Return a readable name for a context generator.
+
+    :param generator: a function, or a
+    :class:`CachedContext <staticjinja.CachedContext>`.
+    """
+    generator = getattr(generator, 'generator', generator)
+    name = getattr(generator, '__qualname__', None)
+    if name is None:
+        name = getattr(generator, '__name__', None)
+    if name is None:
+        return repr(generator)
+    if name.endswith('<lambda>'):
+        code = getattr(generator, '__code__', None)
+        if code is not None:
+            name += ':%d' % code.co_firstlineno
+    module = getattr(generator, '__module__', None)
+    return '%s.%s' % (module, name) if module else name
+
+
+class BuildProfile(object):
+    """
+    Records the time spent in each phase of a build: for each template, the
+    time spent loading (and compiling) it, generating its context, rendering
+    it, writing its output or running its rule; for each context generator,
+    its number of calls and total time; and the time of the phases of the
+    whole build.
+
+    Pass it to :meth:`Site.render <staticjinja.Site.render>`.
+
+    :param path:
+        Optional. The path of the JSON report written at the end of the
+        build.
+
+    :param top:
+        Number of templates and context generators listed in the log.
+        Defaults to ``10``.
+
+    :param cprofile:
+        A boolean value. If set to ``True``, the build is also run under
+        :mod:`cProfile`, the functions taking the most time are added to the
+        report and the raw statistics are saved next to it, with a ``.prof``
+        extension. Only the main process is profiled this way, worker
+        processes only report their timings. Defaults to ``False``.
+
+    """
+    def __init__(self, path=None, top=10, cprofile=False):
+        self.path = path
+        self.top = top
+        self.cprofile = cprofile
+        self.clear()
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._start = None
+        self.total = 0.0
+        self.functions = []
+
+    def clear(self):
+        """Forget the recorded timings."""
+        # Template name -> phase -> seconds
+        self.templates = {}
+        # Generator name -> [calls, seconds]
+        self.contexts = {}
+        # Build phase -> seconds
+        self.build = {}
+
+    def add(self, phase, seconds, template_name=None, generator=None):
+        """Record the duration of a phase.
+
+        :param phase: the name of the phase.
+
+        :param seconds: its duration.
+
+        :param template_name: Optional. The template it was spent on. If not
+        given, the phase is a phase of the whole build.
+
+        :param generator: Optional. The name of the context generator it was
+        spent in.
+        """
+        with self._lock:
+            if template_name is not None:
+                phases = self.templates.setdefault(template_name, {})
+                phases[phase] = phases.get(phase, 0.0) + seconds
+            else:
+                self.build[phase] = self.build.get(phase, 0.0) + seconds
+            if generator is not None:
+                stats = self.contexts.setdefault(generator, [0, 0.0])
+                stats[0] += 1
+                stats[1] += seconds
+
+    @contextmanager
+    def timed(self, phase, template_name=None, generator=None):
+        """Context manager recording the time spent in its block, see
+        :meth:`add`."""
+        start = _clock()
+        try:
+            yield
+        finally:
+            self.add(phase, _clock() - start, template_name, generator)
+
+    def merge(self, data):
+        """Add the timings recorded by another profile, for instance in a
+        worker process.
+
+        :param data: the result of :meth:`timings` of the other profile.
+        """
+        templates, contexts, build = data
+        with self._lock:
+            for name, phases in templates.items():
+                mine = self.templates.setdefault(name, {})
+                for phase, seconds in phases.items():
+                    mine[phase] = mine.get(phase, 0.0) + seconds
+            for name, (calls, seconds) in contexts.items():
+                stats = self.contexts.setdefault(name, [0, 0.0])
+                stats[0] += calls
+                stats[1] += seconds
+            for phase, seconds in build.items():
+                self.build[phase] = self.build.get(phase, 0.0) + seconds
+
+    def timings(self):
+        """Return the recorded timings, in a form :meth:`merge` accepts."""
+        with self._lock:
+            return (dict((name, dict(phases))
+                         for name, phases in self.templates.items()),
+                    dict((name, list(stats))
+                         for name, stats in self.contexts.items()),
+                    dict(self.build))
+
+    def start(self):
+        """Start timing the build."""
+        self.clear()
+        self.functions = []
+        if self.cprofile:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._start = _clock()
+
+    def stop(self):
+        """Stop timing the build, and write the report if :attr:`path` is
+        set."""
+        self.total = _clock() - self._start
+        if self._profiler is not None:
+            self._profiler.disable()
+            self.functions = self._top_functions(self._profiler)
+            if self.path:
+                self._profiler.dump_stats(self._prof_path())
+            self._profiler = None
+        if self.path:
+            self.save(self.path)
+
+    def _prof_path(self):
+        root = self.path
+        if root.endswith('.json'):
+            root = root[:-len('.json')]
+        return root + '.prof'
+
+    def _top_functions(self, profiler, limit=30):
+        import pstats
+        stats = pstats.Stats(profiler, stream=StringIO())
+        rows = []
+        for (filename, line, function), (_, calls, total, cumulative, _) in (
+                stats.stats.items()):
+            rows.append({
+                'function': '%s:%d(%s)' % (filename, line, function),
+                'calls': calls,
+                'total': total,
+                'cumulative': cumulative,
+            })
+        rows.sort(key=lambda row: row['cumulative'], reverse=True)
+        return rows[:limit]
+
+    def slowest_templates(self, n=None):
+        """Return ``(name, seconds)`` for the *n* slowest templates, slowest
+        first."""
+        totals = [(name, sum(phases.values()))
+                  for name, phases in self.templates.items()]
+        totals.sort(key=lambda item: (-item[1], item[0]))
+        return totals[:n]
+
+    def slowest_contexts(self, n=None):
+        """Return ``(name, calls, seconds)`` for the *n* slowest context
+        generators, slowest first."""
+        totals = [(name, calls, seconds)
+                  for name, (calls, seconds) in self.contexts.items()]
+        totals.sort(key=lambda item: (-item[2], item[0]))
+        return totals[:n]
+
+    def as_dict(self):
+        """Return the report as a dictionary which can be dumped to JSON."""
+        templates = {}
+        for name, phases in self.templates.items():
+            entry = dict(phases)
+            entry['total'] = sum(phases.values())
+            templates[name] = entry
+        return {
+            'total': self.total,
+            'build': dict(self.build),
+            'templates': templates,
+            'contexts': dict((name, {'calls': calls, 'total': seconds})
+                             for name, (calls, seconds)
+                             in self.contexts.items()),
+            'functions': self.functions,
+        }
+
+    def save(self, path):
+        """Write the report to a JSON file.
+
+        :param path: the path of the file.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, sort_keys=True, indent=1)
+
+    def report(self):
+        """Return the summary of the build as a list of lines."""
+        lines = ["Build took %.3fs (%s)." % (self.total, ", ".join(
+            "%s %.3fs" % (phase, seconds)
+            for phase, seconds in sorted(self.build.items())))]
+        slowest = self.slowest_templates(self.top)
+        if slowest:
+            lines.append("Slowest templates:")
+            for name, seconds in slowest:
+                phases = self.templates[name]
+                lines.append("  %8.3fs  %s (%s)" % (seconds, name, ", ".join(
+                    "%s %.3fs" % (phase, phases[phase])
+                    for phase in TEMPLATE_PHASES if phase in phases)))
+        slowest = self.slowest_contexts(self.top)
+        if slowest:
+            lines.append("Slowest context generators:")
+            for name, calls, seconds in slowest:
+                lines.append("  %8.3fs  %s (%d calls)" %
+                             (seconds, name, calls))
+        if self.functions:
+            lines.append("Functions with the most cumulative time:")
+            for row in self.functions[:self.top]:
+                lines.append("  %8.3fs  %s" %
+                             (row['cumulative'], row['function']))
+        return lines
@@ -0,0 +1,282 @@
+# -*- coding:utf-8 -*-
+
+"""
+Indexed access to the records of line-oriented data files
+"""
+
+from __future__ import absolute_import
+
+import csv
+import hashlib
+import io
+import json
+import mmap
+import os
+import tempfile
+
+from array import array
+
+from .data import _stamp
+
+#: Record formats, by file extension.
+FORMATS = {
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.csv': 'csv',
+}
+
+_VERSION = 2
+
+
+def _ends_quoted(line, quoted):
+    """Return whether a line of a CSV file ends inside a quoted field.
+
+    Only a quote starting a field opens a quoted field: other quotes are
+    part of the value of their field.
+
+    :param line: the line, as bytes.
+    :param quoted: whether the line starts inside a quoted field.
+    """
+    # 'latin-1' maps each byte to one character, and the encodings of CSV
+    # files keep ASCII quotes and commas as single bytes.
+    at_start = not quoted
+    closing = False
+    for char in line.decode('latin-1'):
+        if closing:
+            # A quote in a quoted field is either doubled, standing for a
+            # quote, or closes the field.
+            closing = False
+            if char == '"':
+                continue
+            quoted = False
+            at_start = char == ','
+        elif quoted:
+            closing = char == '"'
+        elif char == ',':
+            at_start = True
+        else:
+            quoted = at_start and char == '"'
+            at_start = False
+    return quoted and not closing
+
+
+class RecordIndex(object):
+    """
+    A byte-offset index over the records of a JSON Lines or CSV file (with a
+    header row), giving any record without reading the others.
+
+    The file is memory-mapped, so that its pages are read on demand and
+    shared by the processes rendering the site instead of being copied into
+    each of them. Only the offsets of the records, and their keys, are kept
+    in memory.
+
+    Records of a CSV file are dictionaries mapping the fields of the header
+    to strings. Quoted fields may span several lines.
+
+    :param path:
+        The path of the data file.
+
+    :param key:
+        Optional. The field identifying each record, to look records up by
+        key. If several records have the same key, the last one wins.
+        Defaults to ``None``, meaning records are only accessed by position.
+
+    :param encoding:
+        The encoding of the file. Defaults to ``'utf8'``.
+
+    :param indexpath:
+        Optional. A directory in which the index is saved, and from which it
+        is loaded again as long as the file keeps the same modification time
+        and size.
+
+    """
+    def __init__(self, path, key=None, encoding='utf8', indexpath=None):
+        ext = os.path.splitext(path)[1].lower()
+        try:
+            self.format = FORMATS[ext]
+        except KeyError:
+            raise ValueError("Records of %s can't be indexed." % path)
+        self.path = path
+        self.key = key
+        self.encoding = encoding
+        self.indexpath = indexpath
+        self.stamp = _stamp(os.stat(path))
+        self.fields = None
+        self.offsets = array('Q')
+        self._keys = None
+        self._file = None
+        self._mmap = None
+        if not self._load():
+            self._build()
+            self._save()
+
+    def _index_file(self):
+        name = '%s\0%s' % (os.path.abspath(self.path), self.key)
+        return os.path.join(self.indexpath, '%s.idx' % hashlib.sha1(
+            name.encode('utf8')).hexdigest())
+
+    def _load(self):
+        """Load the saved index, if it is up to date."""
+        if self.indexpath is None:
+            return False
+        try:
+            with open(self._index_file(), 'rb') as f:
+                header = json.loads(f.readline().decode('utf8'))
+                if (header['version'] != _VERSION or
+                        tuple(header['stamp']) != tuple(self.stamp) or
+                        header['key'] != self.key):
+                    return False
+                offsets = array('Q')
+                offsets.frombytes(f.read(header['count'] *
+                                         offsets.itemsize))
+                keys = json.loads(f.read().decode('utf8'))
+                if keys is not None:
+                    keys = dict((key, i) for key, i in keys)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return False
+        self.fields = header['fields']
+        self.offsets = offsets
+        self._keys = keys
+        return True
+
+    def _save(self):
+        """Save the index in :attr:`indexpath`, if set."""
+        if self.indexpath is None:
+            return
+        if not os.path.isdir(self.indexpath):
+            try:
+                os.makedirs(self.indexpath)
+            except OSError:
+                if not os.path.isdir(self.indexpath):
+                    raise
+        header = {
+            'version': _VERSION,
+            'stamp': list(self.stamp),
+            'key': self.key,
+            'fields': self.fields,
+            'count': len(self.offsets),
+        }
+        # Positions are saved along with the keys, as they don't follow the
+        # order of the keys when some records share a key.
+        keys = list(self._keys.items()) if self._keys is not None else None
+        # Workers may build the same index at the same time: each writes its
+        # own file and the last rename wins.
+        fd, tmp_path = tempfile.mkstemp(dir=self.indexpath, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(header).encode('utf8') + b'\n')
+            f.write(self.offsets.tobytes())
+            f.write(json.dumps(keys).encode('utf8'))
+        os.rename(tmp_path, self._index_file())
+
+    def _open(self):
+        """Return the memory map of the file, mapping it on first use."""
+        if self._mmap is None and self.stamp[1]:
+            self._file = open(self.path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _record_end(self, mm, start):
+        """Return the offset following the record starting at *start*."""
+        size = len(mm)
+        end = start
+        quoted = False
+        while True:
+            i = mm.find(b'\n', end)
+            stop = size if i < 0 else i + 1
+            if self.format != 'csv':
+                return stop
+            # A newline inside a quoted field doesn't end the record.
+            line = mm[end:stop]
+            if b'"' in line:
+                quoted = _ends_quoted(line, quoted)
+            end = stop
+            if not quoted or end == size:
+                return end
+
+    def _parse(self, data):
+        text = data.decode(self.encoding)
+        if self.format == 'jsonl':
+            return json.loads(text)
+        row = next(csv.reader(io.StringIO(text, newline='')))
+        if self.fields is None:
+            return row
+        return dict(zip(self.fields, row))
+
+    def _build(self):
+        """Scan the file for the offsets (and keys) of its records."""
+        mm = self._open()
+        keys = {} if self.key is not None else None
+        offsets = array('Q')
+        size = len(mm) if mm is not None else 0
+        pos = 0
+        if self.format == 'csv' and size:
+            end = self._record_end(mm, pos)
+            self.fields = self._parse(mm[pos:end])
+            pos = end
+        while pos < size:
+            end = self._record_end(mm, pos)
+            data = mm[pos:end]
+            if data.strip():
+                offsets.append(pos)
+                if keys is not None:
+                    keys[self._key_of(mm, pos, data)] = len(offsets) - 1
+            pos = end
+        self.offsets = offsets
+        self._keys = keys
+
+    def _key_of(self, mm, pos, data):
+        """Return the key of the record *data*, found at offset *pos*."""
+        try:
+            return self._parse(data)[self.key]
+        except (KeyError, TypeError):
+            raise ValueError("%s, line %d: the record has no field %r." % (
+                self.path, mm[:pos].count(b'\n') + 1, self.key))
+
+    def at(self, i):
+        """Return the *i*-th record of the file.
+
+        :param i: the position of the record.
+        """
+        mm = self._open()
+        start = self.offsets[i]
+        return self._parse(mm[start:self._record_end(mm, start)])
+
+    def __getitem__(self, key):
+        """Return the record with a key.
+
+        :param key: the value of the key field of the record.
+        """
+        if self._keys is None:
+            raise TypeError("%r has no key, use at()." % self)
+        return self.at(self._keys[key])
+
+    def get(self, key, default=None):
+        """Return the record with a key, or *default* if there is none.
+
+        :param key: the value of the key field of the record.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """Return the keys of the records, in no particular order."""
+        return list(self._keys or ())
+
+    def __contains__(self, key):
+        return self._keys is not None and key in self._keys
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        """Unmap the file."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+    def __repr__(self):
+        return "RecordIndex(%r, key=%r)" % (self.path, self.key)
@@ -1,8 +1,105 @@
 import os
+import threading
+import time
+
+from collections import OrderedDict
 
 from .dep_graph import DepGraph
 
 
+class RenderWorker(threading.Thread):
+    """
+    A thread rendering templates in the background, one at a time.
+
+    Templates are rendered in the order they were submitted, but a new
+    submission goes first: templates still waiting from older submissions are
+    only rendered after it, and only once.
+
+    :param site:
+        A :class:`Site <Site>` object.
+
+    :param render:
+        Optional. The function called with a list of template names to render
+        them. Defaults to ``site.render_templates``.
+
+    """
+    def __init__(self, site, render=None):
+        super(RenderWorker, self).__init__()
+        self.daemon = True
+        self.site = site
+        self.render = render
+        self._queue = OrderedDict()
+        self._busy = False
+        self._stopped = False
+        self._cond = threading.Condition()
+
+    def submit(self, template_names):
+        """Schedule some templates to be rendered before the ones already
+        waiting.
+
+        :param template_names: the names of the templates, most urgent first.
+        """
+        with self._cond:
+            queue = OrderedDict((name, None) for name in template_names)
+            for name in self._queue:
+                queue.setdefault(name, None)
+            self._queue = queue
+            self._cond.notify_all()
+
+    @property
+    def pending(self):
+        """List of the templates waiting to be rendered."""
+        with self._cond:
+            return list(self._queue)
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                name, _ = self._queue.popitem(last=False)
+                self._busy = True
+            try:
+                if self.render is not None:
+                    self.render([name])
+                else:
+                    self.site.render_templates([name])
+            except Exception:
+                self.site.logger.exception("Error while rendering %s." % name)
+
+    def wait(self, timeout=None):
+        """Wait until every submitted template is rendered.
+
+        Returns ``False`` if *timeout* (in seconds) expired first.
+
+        :param timeout: Optional. Maximum number of seconds to wait.
+        """
+        with self._cond:
+            if timeout is None:
+                while self._queue or self._busy:
+                    self._cond.wait()
+                return True
+            end = time.time() + timeout
+            while self._queue or self._busy:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stop(self):
+        """Stop the worker once the current template is rendered. Waiting
+        templates are dropped."""
+        with self._cond:
+            self._stopped = True
+            self._queue.clear()
+            self._cond.notify_all()
+
+
 class Reloader(object):
     """
     Watches ``site.searchpath`` for changes and re-renders any changed
@@ -11,12 +108,57 @@ class Reloader(object):
     :param site:
         A :class:`Site <Site>` object.
 
+    :param debounce:
+        Number of seconds to wait for other events before handling the
+        changes. Defaults to ``0``, meaning events are handled one at a time,
+        immediately.
+
+    :param background:
+        A boolean value. If set to ``True``, templates are rendered by a
+        :class:`RenderWorker` thread, modified templates first, and newer
+        changes are rendered before the remaining older ones. Defaults to
+        ``False``, meaning templates are rendered in the event handler.
+
+    :param watcher:
+        The name of the :class:`Watcher <staticjinja.watchers.Watcher>` used
+        to receive filesystem events (``'inotify'``, ``'easywatch'`` or
+        ``'poll'``), or a callable creating a watcher from a path and a
+        callback. Defaults to the first one available on this platform.
+
+    :param trace:
+        Optional. A :class:`TraceRecorder
+        <staticjinja.tracing.TraceRecorder>` recording a span for each batch
+        of changes and the work it causes. Its file is written after each
+        batch and when watching stops.
+
     """
-    def __init__(self, site):
+    def __init__(self, site, debounce=0, background=False, watcher=None,
+                 trace=None):
         self.site = site
+        self.trace = trace
+        if trace is not None:
+            site.trace = trace
+        self.debounce = debounce
+        if watcher is None or isinstance(watcher, str):
+            # The watchers load ctypes, which is only worth it in watch mode.
+            from .watchers import get_watcher
+            watcher = get_watcher(watcher)
+        self.watcher_class = watcher
+        self.watcher = None
+        self.worker = None
+        if background:
+            self.worker = RenderWorker(site, self.render_templates)
+            self.worker.start()
+        self._pending = OrderedDict()
+        self._moves = {}
+        self._timer = None
+        self._lock = threading.Lock()
+        self._batch_lock = threading.Lock()
         # The following could be part of the Site.__init__ but it would waste
-        # time if the reloader is not used
-        self.site.dep_graph = DepGraph(site)
+        # time if the reloader is not used. An incremental build may already
+        # have built it.
+        if self.site.dep_graph is None:
+            self.site.dep_graph = DepGraph(site)
 
     @property
     def searchpath(self):
@@ -25,46 +167,225 @@ class Reloader(object):
     def should_handle(self, event_type, filename):
         """Check if an event should be handled.
 
-        An event should be handled if a file in the searchpath was modified.
+        An event should be handled if a file in the searchpath was modified,
+        created or deleted.
 
         :param event_type: a string, representing the type of event
 
         :param filename: the path to the file that triggered the event.
         """
+        if not filename.startswith(self.searchpath):
+            return False
+        if event_type == "deleted":
+            return not os.path.isdir(filename)
         return (event_type in ("modified", "created") and
-                filename.startswith(self.searchpath) and
                 os.path.isfile(filename))
 
-    def event_handler(self, event_type, src_path):
+    def event_handler(self, event_type, src_path, dest_path=None):
         """Re-render templates if they are modified.
 
+        Events are collected for ``self.debounce`` seconds, then handled
+        together by :meth:`flush`. If ``self.debounce`` is ``0``, each event
+        is handled immediately.
+
         :param event_type: a string, representing the type of event
 
         :param src_path: the path to the file that triggered the event.
 
+        :param dest_path: Optional. The new path of the file for ``'moved'``
+        events, which are handled as the deletion of *src_path* followed by
+        the creation of *dest_path*, except that the output is moved instead
+        of being removed.
+
+        """
+        if event_type == "moved":
+            # Queue both events at once, so that the output of the file can
+            # be moved instead of being removed and rendered again.
+            queued = self._queue("deleted", src_path)
+            if dest_path is not None:
+                queued = self._queue("created", dest_path,
+                                     moved_from=src_path) or queued
+        else:
+            queued = self._queue(event_type, src_path)
+        if not queued:
+            return
+        with self._lock:
+            if self.debounce:
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = threading.Timer(self.debounce, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if not self.debounce:
+            self.flush()
+
+    def _queue(self, event_type, src_path, moved_from=None):
+        """Add an event to the pending ones.
+
+        Returns ``False`` if the event is ignored.
         """
         filename = os.path.relpath(src_path, self.searchpath)
-        if self.should_handle(event_type, src_path):
-            print("%s %s" % (event_type, filename))
-            if self.site.is_static(filename):
-                self.site.copy_static([filename])
-            elif self.site.is_ignored(filename):
-                return
+        if src_path.startswith(self.searchpath):
+            if event_type == "created" and os.path.isfile(src_path):
+                self.site.sources.add(filename)
+            elif event_type == "deleted":
+                self.site.sources.remove(filename)
+        if (not self.should_handle(event_type, src_path) or
+                self.site.is_ignored(filename)):
+            return False
+        with self._lock:
+            # Keep the first event type but the latest position.
+            event_type = self._pending.pop(filename, event_type)
+            self._pending[filename] = event_type
+            if moved_from is not None:
+                self._moves[filename] = os.path.relpath(moved_from,
+                                                        self.searchpath)
+        return True
+
+    def flush(self):
+        """Handle all the pending events as a single batch."""
+        with self._lock:
+            events = self._pending
+            moves = self._moves
+            self._pending = OrderedDict()
+            self._moves = {}
+            self._timer = None
+        if events:
+            with self._batch_lock:
+                with self.site._span('batch', 'reload'):
+                    self.handle_batch(events, moves)
+                self._save_trace()
+
+    def _save_trace(self):
+        if self.trace is not None and self.trace.path:
+            self.trace.save(self.trace.path)
+
+    def handle_batch(self, events, moves=None):
+        """Re-render the templates affected by a batch of events.
+
+        The templates depending on several changed files are only rendered
+        once. The outputs of deleted templates and static files are removed,
+        and the templates depending on deleted files are rendered again.
+
+        :param events: an ordered dictionary mapping changed file names
+        (relative to the searchpath) to the type of their event.
+
+        :param moves: Optional. A dictionary mapping the new name of each
+        moved file to its old name.
+        """
+        renamed = dict((src, dest) for dest, src in (moves or {}).items())
+        static_names = []
+        modified = set()
+        needs_rendering = set()
+        deleted = set()
+        for filename in events:
+            if not os.path.exists(os.path.join(self.searchpath, filename)):
+                deleted.add(filename)
+                needs_rendering.update(
+                    self._handle_deleted(filename, renamed.get(filename)))
+            elif self.site.is_static(filename):
+                static_names.append(filename)
             else:
                 # Here the changed file is a (maybe partial) template or a data
                 # file
                 self.site.dep_graph.update(filename)
+                if self.site.is_data(filename):
+                    self.site.data.invalidate(filename)
+                    self.site.invalidate_contexts(filename)
 
                 if self.site.is_template(filename):
-                    needs_rendering = [filename]
+                    modified.add(filename)
+                    needs_rendering.add(filename)
                 else:
-                    needs_rendering = filter(
-                        self.site.is_template,
-                        self.site.get_dependencies(filename)
-                        )
-                self.site.render_templates(needs_rendering)
+                    dependencies = list(self.site.get_dependencies(filename))
+                    needs_rendering.update(
+                        filter(self.site.is_template, dependencies))
+        needs_rendering -= deleted
+
+        print(self._summary(events, len(needs_rendering), len(static_names)))
+        if static_names:
+            self.copy_static(static_names)
+        if not needs_rendering:
+            return
+        if self.worker is not None:
+            self.worker.submit(sorted(modified) +
+                               sorted(needs_rendering - modified))
+        else:
+            self.render_templates(sorted(needs_rendering))
+
+    def render_templates(self, template_names):
+        """Render the templates affected by changes. Subclasses may
+        override it to render them elsewhere than in ``site.outpath``.
+
+        :param template_names: the names of the templates to render.
+        """
+        self.site.render_templates(template_names)
+
+    def copy_static(self, static_names):
+        """Copy the changed static files.
+
+        :param static_names: the names of the static files.
+        """
+        self.site.copy_static(static_names)
+
+    def remove_output(self, filename, moved_to=None):
+        """Remove (or move) the output of a deleted template or static file.
+        Subclasses may override it when outputs are not written to
+        ``site.outpath``.
+
+        :param filename: the name of the deleted file.
+
+        :param moved_to: Optional. The new name of the file, if it was moved.
+        """
+        site = self.site
+        if moved_to is None or not site.rename_output(filename, moved_to):
+            site.remove_output(filename)
+
+    def _handle_deleted(self, filename, moved_to=None):
+        """Forget a deleted file and remove (or move) its output.
+
+        Returns the templates which depended on it.
+
+        :param filename: the name of the deleted file.
+
+        :param moved_to: Optional. The new name of the file, if it was moved.
+        """
+        site = self.site
+        dependencies = []
+        if filename in site.dep_graph:
+            dependencies = list(site.dep_graph.get_descendants(filename))
+            site.dep_graph.remove(filename)
+        site.recorded_deps.pop(filename, None)
+        if site.is_data(filename):
+            site.data.invalidate(filename)
+            site.invalidate_contexts(filename)
+        cache = site.template_cache
+        if cache is not None:
+            cache.invalidate([filename])
+        if site.is_template(filename) or site.is_static(filename):
+            self.remove_output(filename, moved_to)
+        return filter(site.is_template, dependencies)
+
+    def _summary(self, events, n_templates, n_static):
+        """Describe a batch of events in one line."""
+        changes = ["%s %s" % (event_type, filename)
+                   for filename, event_type in events.items()]
+        if len(changes) > 3:
+            changes[3:] = ["%d more" % (len(changes) - 3)]
+        return "%s: rendering %d templates, copying %d static files." % (
+            ", ".join(changes), n_templates, n_static)
 
     def watch(self):
         """Watch and reload modified templates."""
-        import easywatch
-        easywatch.watch(self.searchpath, self.event_handler)
+        self.watcher = self.watcher_class(self.searchpath, self.event_handler)
+        try:
+            self.watcher.run()
+        finally:
+            if self.worker is not None:
+                self.worker.stop()
+            self._save_trace()
+
+    def stop(self):
+        """Stop watching. :meth:`watch` returns once the watcher notices."""
+        if self.watcher is not None:
+            self.watcher.stop()
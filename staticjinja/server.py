@@ -0,0 +1,388 @@
+# -*- coding:utf-8 -*-
+
+"""
+Development server rendering templates in memory
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+import traceback
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import urlsplit
+
+from .reloader import Reloader, RenderWorker
+
+#: URL of the server-sent events stream notifying pages to reload.
+EVENTS_URL = '/__staticjinja__/events'
+
+LIVE_RELOAD_SCRIPT = (
+    '<script>new EventSource("%s").onmessage = function () '
+    '{ location.reload(); };</script>' % EVENTS_URL
+).encode('ascii')
+
+_BODY_END = re.compile(br'</body\s*>', re.IGNORECASE)
+
+
+def _etag(data):
+    return '"%s"' % hashlib.sha1(data).hexdigest()[:20]
+
+
+class ServerReloader(Reloader):
+    """
+    A :class:`Reloader <Reloader>` which renders changed templates into the
+    memory of a :class:`DevServer` instead of ``site.outpath``, and tells
+    browsers to reload once the changes are handled.
+
+    :param server:
+        The :class:`DevServer`.
+
+    """
+    def __init__(self, server, debounce=0.1, watcher=None):
+        super(ServerReloader, self).__init__(server.site, debounce=debounce,
+                                             watcher=watcher)
+        self.server = server
+
+    def handle_batch(self, events, moves=None):
+        self.server.invalidate(events)
+        super(ServerReloader, self).handle_batch(events, moves)
+        self.server.notify()
+
+    def render_templates(self, template_names):
+        # Pages are rendered again in the background, unless a browser asks
+        # for one of them first.
+        self.server.invalidate(template_names)
+        self.server.worker.submit(template_names)
+
+    def copy_static(self, static_names):
+        # Static files are served from the searchpath.
+        pass
+
+    def remove_output(self, filename, moved_to=None):
+        # Pages are only kept in memory: the files of site.outpath are left
+        # alone.
+        self.server.invalidate([filename])
+
+
+class DevServer(object):
+    """
+    An HTTP server for developing a site. Templates are rendered in memory
+    on first request and kept in a cache. Changed templates are rendered
+    again in the background, and a template requested before its turn is
+    rendered immediately. Static files are served from the searchpath, and
+    other files (for instance outputs of rules) from ``site.outpath``.
+
+    Responses have an ``ETag`` so that browsers can revalidate them with a
+    ``304 Not Modified`` answer. With *live_reload*, a script is added to
+    HTML pages to reload them when the site changes, using server-sent
+    events.
+
+    :param site:
+        A :class:`Site <Site>` object.
+
+    :param host:
+        The address to listen on. Defaults to ``'127.0.0.1'``.
+
+    :param port:
+        The port to listen on. Defaults to ``8000``.
+
+    :param live_reload:
+        A boolean value. If set to ``True`` (the default), browsers reload
+        pages when the site changes.
+
+    :param debounce:
+        Number of seconds the reloader waits for other changes before
+        handling them. Defaults to ``0.1``.
+
+    :param watcher:
+        The filesystem watcher used by the reloader, see
+        :class:`Reloader <Reloader>`.
+
+    """
+    def __init__(self, site, host='127.0.0.1', port=8000, live_reload=True,
+                 debounce=0.1, watcher=None):
+        self.site = site
+        self.host = host
+        self.port = port
+        self.live_reload = live_reload
+        # Template name -> (body, etag)
+        self.pages = {}
+        # Template name -> number of invalidations, so that a rendering
+        # started before an invalidation is not cached.
+        self._generations = {}
+        # Path -> (mtime, size, body, etag) for files served from disk.
+        self._files = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self.generation = 0
+        self._stopped = False
+        self.worker = RenderWorker(site, self.prerender)
+        self.reloader = ServerReloader(self, debounce=debounce,
+                                       watcher=watcher)
+        self.httpd = None
+
+    def invalidate(self, template_names):
+        """Forget the rendered pages of some templates.
+
+        :param template_names: the names of the templates.
+        """
+        with self._lock:
+            for name in template_names:
+                self.pages.pop(name, None)
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+    def render(self, template_name):
+        """Render a template, cache and return ``(body, etag)``.
+
+        :param template_name: the name of the template.
+        """
+        with self._lock:
+            generation = self._generations.get(template_name, 0)
+        self.site.logger.info("Rendering %s..." % template_name)
+        body = self.site.render_to_bytes(template_name)
+        if self.live_reload and self._is_html(template_name):
+            body = self._inject_script(body)
+        page = (body, _etag(body))
+        with self._lock:
+            if self._generations.get(template_name, 0) == generation:
+                self.pages[template_name] = page
+        return page
+
+    def prerender(self, template_names):
+        """Render the templates which are not cached yet.
+
+        :param template_names: the names of the templates.
+        """
+        for name in template_names:
+            if name not in self.pages and name in self.site.sources:
+                self.render(name)
+
+    def get_page(self, template_name):
+        """Return ``(body, etag)`` for a template, rendering it if needed.
+
+        :param template_name: the name of the template.
+        """
+        page = self.pages.get(template_name)
+        if page is None:
+            page = self.render(template_name)
+        return page
+
+    def get_file(self, path):
+        """Return ``(body, etag)`` for a file on disk, reading it again only
+        if its modification time or size changed.
+
+        :param path: the absolute path of the file.
+        """
+        st = os.stat(path)
+        cached = self._files.get(path)
+        if cached is not None and cached[:2] == (st.st_mtime, st.st_size):
+            return cached[2:]
+        with open(path, 'rb') as f:
+            body = f.read()
+        if self.live_reload and self._is_html(path):
+            body = self._inject_script(body)
+        etag = _etag(body)
+        self._files[path] = (st.st_mtime, st.st_size, body, etag)
+        return body, etag
+
+    def _is_html(self, name):
+        return mimetypes.guess_type(name)[0] == 'text/html'
+
+    def _inject_script(self, body):
+        matches = list(_BODY_END.finditer(body))
+        if not matches:
+            return body + LIVE_RELOAD_SCRIPT
+        i = matches[-1].start()
+        return body[:i] + LIVE_RELOAD_SCRIPT + body[i:]
+
+    def resolve(self, url_path):
+        """Find what to serve for a URL path.
+
+        Returns a pair ``(kind, name)`` where *kind* is ``'template'`` (and
+        *name* a template name), ``'file'`` (and *name* an absolute path) or
+        ``'redirect'`` (and *name* the URL of a directory), or ``None`` if
+        nothing should be served.
+
+        :param url_path: the path part of the requested URL.
+        """
+        # Relative to '/', '..' can't go outside the site.
+        path = posixpath.normpath('/' + unquote(url_path))
+        if url_path.endswith('/'):
+            path = posixpath.join(path, 'index.html')
+        name = path.lstrip('/').replace('/', os.sep)
+        site = self.site
+        if (name not in site.sources and
+                os.path.join(name, 'index.html') in site.sources):
+            return 'redirect', path.rstrip('/') + '/'
+        if name in site.sources:
+            if site.is_static(name):
+                return 'file', os.path.join(site.searchpath, name)
+            if site.is_template(name):
+                try:
+                    site.get_rule(name)
+                except ValueError:
+                    return 'template', name
+        elif site.is_ignored(name) or site.is_partial(name):
+            return None
+        output = os.path.join(site.outpath, name)
+        if os.path.isfile(output):
+            return 'file', output
+        return None
+
+    def notify(self):
+        """Tell the connected browsers to reload."""
+        with self._changed:
+            self.generation += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, generation, timeout):
+        """Wait until the site changes after *generation*.
+
+        Returns the new generation, or ``None`` if *timeout* expired or the
+        server is stopping.
+        """
+        with self._changed:
+            if self.generation == generation and not self._stopped:
+                self._changed.wait(timeout)
+            if self.generation == generation or self._stopped:
+                return None
+            return self.generation
+
+    def make_httpd(self):
+        """Create the HTTP server, bound to ``self.host`` and
+        ``self.port``."""
+        self.httpd = _HTTPServer((self.host, self.port), _RequestHandler)
+        self.httpd.devserver = self
+        self.port = self.httpd.server_address[1]
+        return self.httpd
+
+    def serve_forever(self):
+        """Serve the site and watch ``site.searchpath`` until the user
+        presses Ctrl+C."""
+        self.site.sources.scan()
+        if self.httpd is None:
+            self.make_httpd()
+        self.worker.start()
+        watch = threading.Thread(target=self.reloader.watch)
+        watch.daemon = True
+        watch.start()
+        self.site.logger.info("Serving '%s' on http://%s:%d/" %
+                              (self.site.searchpath, self.host, self.port))
+        self.site.logger.info("Press Ctrl+C to stop.")
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop watching and close the connections to browsers."""
+        with self._changed:
+            self._stopped = True
+            self._changed.notify_all()
+        self.reloader.stop()
+        self.worker.stop()
+        if self.httpd is not None:
+            self.httpd.server_close()
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'staticjinja'
+    # Seconds between two comments keeping event streams open.
+    keepalive = 15
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        devserver = self.server.devserver
+        url_path = urlsplit(self.path).path
+        if url_path == EVENTS_URL:
+            return self._events(devserver)
+        target = devserver.resolve(url_path)
+        if target is None:
+            return self._error(404, b"Not found.\n")
+        kind, name = target
+        if kind == 'redirect':
+            self.send_response(301)
+            self.send_header('Location', name)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            if kind == 'template':
+                body, etag = devserver.get_page(name)
+            else:
+                body, etag = devserver.get_file(name)
+        except Exception:
+            devserver.site.logger.exception("Error while serving %s." % name)
+            return self._error(500, traceback.format_exc().encode('utf8'))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        content_type = mimetypes.guess_type(name)[0]
+        if content_type is None:
+            content_type = 'application/octet-stream'
+        elif content_type.startswith('text/'):
+            content_type += '; charset=%s' % devserver.site.encoding
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _error(self, code, message):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(message)))
+        self.end_headers()
+        self.wfile.write(message)
+
+    def _events(self, devserver):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        generation = devserver.generation
+        try:
+            while not devserver._stopped:
+                changed = devserver.wait_for_change(generation, self.keepalive)
+                if changed is not None:
+                    generation = changed
+                    self.wfile.write(b'data: reload\n\n')
+                else:
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (IOError, OSError):
+            # The browser went away.
+            pass
+
+    def log_message(self, format, *args):
+        self.server.devserver.site.logger.debug(format % args)
@@ -0,0 +1,362 @@
+# -*- coding:utf-8 -*-
+
+"""
+Destinations for the rendered site
+"""
+
+from __future__ import absolute_import
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from .manifest import file_hash
+
+_UMASK = None
+
+
+def _umask():
+    """Return the process umask without changing it for long."""
+    global _UMASK
+    if _UMASK is None:
+        _UMASK = os.umask(0)
+        os.umask(_UMASK)
+    return _UMASK
+
+
+def _join(data):
+    """Return *data*, bytes or an iterable of bytes, as bytes."""
+    if isinstance(data, bytes):
+        return data
+    return b''.join(data)
+
+
+def write_if_changed(filepath, data):
+    """Atomically replace the file at *filepath* with *data*, unless it
+    already has this content.
+
+    Returns ``True`` if the file was written.
+
+    :param filepath: the path of the output file.
+
+    :param data: the bytes to write.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            if f.read() == data:
+                return False
+    except (IOError, OSError):
+        pass
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.',
+                                    prefix='.staticjinja-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if os.path.exists(filepath):
+            shutil.copymode(filepath, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o666 & ~_umask())
+        os.rename(tmp_path, filepath)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return True
+
+
+class Sink(object):
+    """
+    Base class for the destinations of the outputs of a
+    :class:`Site <Site>`. Outputs are named by their path relative to the
+    output root, using ``os.sep``.
+
+    A sink whose :attr:`shared` attribute is ``False`` can't be written by
+    worker processes: parallel builds send the outputs to the main process,
+    which writes them.
+    """
+    #: Whether worker processes can write to this sink directly.
+    shared = False
+
+    def write(self, name, data):
+        """Write an output.
+
+        Returns ``False`` if the output already had this content and was
+        left untouched, ``True`` otherwise.
+
+        :param name: the name of the output.
+
+        :param data: the content, as bytes or an iterable of bytes.
+        """
+        raise NotImplementedError
+
+    def copy(self, name, path, compare='mtime'):
+        """Copy a file to an output.
+
+        Returns ``False`` if the copy was skipped because it is unchanged.
+
+        :param name: the name of the output.
+
+        :param path: the path of the file to copy.
+
+        :param compare: how to detect an unchanged copy, see
+        :meth:`Site.copy_static`. Sinks which can't compare copy anyway.
+        """
+        with open(path, 'rb') as f:
+            self.write(name, f.read())
+        return True
+
+    def exists(self, name):
+        """Check whether an output exists.
+
+        :param name: the name of the output.
+        """
+        return False
+
+    def remove(self, name):
+        """Remove an output. Returns ``True`` if it was removed.
+
+        :param name: the name of the output.
+        """
+        return False
+
+    def rename(self, src, dest):
+        """Rename an output. Returns ``True`` if it was renamed.
+
+        :param src: the current name of the output.
+
+        :param dest: its new name.
+        """
+        return False
+
+    def close(self):
+        """Finish writing the outputs."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DirectorySink(Sink):
+    """
+    Writes the outputs into a directory.
+
+    :param path:
+        The output directory.
+
+    :param write_if_changed:
+        A boolean value. If set to ``True``, outputs are atomically replaced,
+        and only when their content changed. Defaults to ``False``.
+
+    """
+    shared = True
+
+    def __init__(self, path, write_if_changed=False):
+        self.path = path
+        self.write_if_changed = write_if_changed
+
+    def _path(self, name):
+        return os.path.join(self.path, name)
+
+    def _ensure_dir(self, name):
+        """Ensure the directory of an output exists."""
+        head = os.path.dirname(name)
+        if head:
+            dirpath = os.path.join(self.path, head)
+            if not os.path.exists(dirpath):
+                try:
+                    os.makedirs(dirpath)
+                except OSError:
+                    # Another thread may have created it in the meantime.
+                    if not os.path.isdir(dirpath):
+                        raise
+
+    def _remove_empty_dirs(self, dirpath):
+        """Remove *dirpath* and its parents inside the output directory while
+        they are empty."""
+        root = os.path.abspath(self.path)
+        dirpath = os.path.abspath(dirpath)
+        while dirpath.startswith(root + os.sep):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                return
+            dirpath = os.path.dirname(dirpath)
+
+    def write(self, name, data):
+        self._ensure_dir(name)
+        path = self._path(name)
+        if self.write_if_changed:
+            return write_if_changed(path, _join(data))
+        if isinstance(data, bytes):
+            data = [data]
+        with open(path, 'wb') as f:
+            for chunk in data:
+                f.write(chunk)
+        return True
+
+    def _unchanged(self, name, path, compare):
+        """Check whether a file was already copied to an output."""
+        try:
+            dst = os.stat(self._path(name))
+        except OSError:
+            return False
+        src = os.stat(path)
+        if src.st_size != dst.st_size:
+            return False
+        if compare == 'hash':
+            return file_hash(path) == file_hash(self._path(name))
+        return src.st_mtime == dst.st_mtime
+
+    def copy(self, name, path, compare='mtime'):
+        if compare and self._unchanged(name, path, compare):
+            return False
+        self._ensure_dir(name)
+        shutil.copy2(path, self._path(name))
+        return True
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def remove(self, name):
+        path = self._path(name)
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        self._remove_empty_dirs(os.path.dirname(path))
+        return True
+
+    def rename(self, src, dest):
+        src_path = self._path(src)
+        if not os.path.exists(src_path):
+            return False
+        self._ensure_dir(dest)
+        os.rename(src_path, self._path(dest))
+        self._remove_empty_dirs(os.path.dirname(src_path))
+        return True
+
+    def __repr__(self):
+        return "DirectorySink('%s')" % self.path
+
+
+class MemorySink(Sink):
+    """
+    Keeps the outputs in the :attr:`files` dictionary, mapping their names to
+    their content. Useful in tests.
+    """
+    def __init__(self):
+        self.files = {}
+
+    def write(self, name, data):
+        data = _join(data)
+        changed = self.files.get(name) != data
+        self.files[name] = data
+        return changed
+
+    def exists(self, name):
+        return name in self.files
+
+    def remove(self, name):
+        return self.files.pop(name, None) is not None
+
+    def rename(self, src, dest):
+        if src not in self.files:
+            return False
+        self.files[dest] = self.files.pop(src)
+        return True
+
+
+class _ArchiveSink(Sink):
+    """Base class of the sinks writing an archive in a single pass."""
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _arcname(name):
+        return name.replace(os.sep, '/')
+
+
+class TarSink(_ArchiveSink):
+    """
+    Streams the outputs into a tar archive, which is never read back or
+    seeked, so it can be written to a pipe or a socket. The archive is
+    complete once the sink is closed.
+
+    :param fileobj:
+        A path, or a file object open for writing in binary mode.
+
+    :param compression:
+        Optional. ``'gz'``, ``'bz2'`` or ``'xz'``. Defaults to no
+        compression.
+
+    """
+    def __init__(self, fileobj, compression=''):
+        super(TarSink, self).__init__()
+        import tarfile
+        self._tarfile = tarfile
+        mode = 'w|' + compression
+        if isinstance(fileobj, str):
+            self.tar = tarfile.open(fileobj, mode)
+        else:
+            self.tar = tarfile.open(fileobj=fileobj, mode=mode)
+
+    def write(self, name, data):
+        data = _join(data)
+        info = self._tarfile.TarInfo(self._arcname(name))
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0o666 & ~_umask()
+        with self._lock:
+            self.tar.addfile(info, io.BytesIO(data))
+        return True
+
+    def copy(self, name, path, compare='mtime'):
+        with self._lock:
+            self.tar.add(path, arcname=self._arcname(name), recursive=False)
+        return True
+
+    def close(self):
+        self.tar.close()
+
+
+class ZipSink(_ArchiveSink):
+    """
+    Writes the outputs into a zip archive, compressed with deflate. The
+    archive is complete once the sink is closed.
+
+    :param fileobj:
+        A path, or a file object open for writing in binary mode.
+
+    """
+    def __init__(self, fileobj):
+        super(ZipSink, self).__init__()
+        import zipfile
+        self._zipfile = zipfile
+        self.zip = zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, name, data):
+        zipfile = self._zipfile
+        info = zipfile.ZipInfo(self._arcname(name),
+                               time.localtime(time.time())[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = (0o666 & ~_umask()) << 16
+        with self._lock:
+            if isinstance(data, bytes):
+                self.zip.writestr(info, data)
+            else:
+                with self.zip.open(info, 'w') as f:
+                    for chunk in data:
+                        f.write(chunk)
+        return True
+
+    def copy(self, name, path, compare='mtime'):
+        with self._lock:
+            self.zip.write(path, self._arcname(name))
+        return True
+
+    def close(self):
+        self.zip.close()
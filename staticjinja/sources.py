@@ -0,0 +1,163 @@
+# -*- coding:utf-8 -*-
+
+"""
+Cached scan of the source tree of a site
+"""
+
+from __future__ import absolute_import
+
+import os
+
+from bisect import bisect_left, insort
+
+from jinja2 import FileSystemLoader
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+
+def _walk(top, prefix=''):
+    """Yield the names of all files under *top*, relative to *top* and using
+    ``/`` as separator, like :meth:`jinja2.FileSystemLoader.list_templates`.
+
+    Symbolic links to directories are not followed.
+    """
+    if scandir is None:
+        for dirpath, _, filenames in os.walk(top):
+            head = os.path.relpath(dirpath, top).replace(os.path.sep, '/')
+            for filename in filenames:
+                yield filename if head == '.' else head + '/' + filename
+        return
+
+    try:
+        entries = list(scandir(top))
+    except OSError:
+        return
+    for entry in entries:
+        name = prefix + entry.name
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if not is_dir:
+            yield name
+        elif not entry.is_symlink():
+            for child in _walk(entry.path, name + '/'):
+                yield child
+
+
+class SourceTree(object):
+    """
+    The files of ``site.searchpath``, scanned once and classified using the
+    predicates of the site (:meth:`Site.is_template`, :meth:`Site.is_static`,
+    etc.).
+
+    The tree is scanned lazily and can then be kept up to date from
+    filesystem events with :meth:`add` and :meth:`remove`. The directories of
+    a :class:`jinja2.FileSystemLoader` are walked directly; other loaders are
+    asked for the list of their templates.
+
+    :param site:
+        A :class:`Site <Site>` object.
+
+    """
+    kinds = ('template', 'partial', 'static', 'data', 'jinja')
+
+    def __init__(self, site):
+        self.site = site
+        self._names = None
+        self._classified = None
+
+    def scan(self):
+        """Walk the searchpath again."""
+        loader = self.site._env.loader
+        if isinstance(loader, FileSystemLoader):
+            names = set()
+            for path in loader.searchpath:
+                names.update(_walk(path))
+        else:
+            names = set(self.site._env.list_templates())
+        self._names = names
+        self._classified = None
+
+    def reclassify(self):
+        """Forget the classification of files, e.g. because the static or
+        data paths of the site changed."""
+        self._classified = None
+
+    @property
+    def names(self):
+        """Sorted list of all file names, relative to the searchpath."""
+        return list(self.classified['all'])
+
+    @property
+    def classified(self):
+        """Dictionary mapping each kind of file to the sorted list of file
+        names of that kind. The ``'all'`` key lists every file."""
+        if self._names is None:
+            self.scan()
+        if self._classified is None:
+            self._classified = self._classify(sorted(self._names))
+        return self._classified
+
+    def _kinds_of(self, filename):
+        """Return the kinds of a file."""
+        site = self.site
+        predicates = (
+            ('template', site.is_template),
+            ('partial', site.is_partial),
+            ('static', site.is_static),
+            ('data', site.is_data),
+            ('jinja', site.is_jinja),
+        )
+        return [kind for kind, predicate in predicates if predicate(filename)]
+
+    def _classify(self, names):
+        classified = dict((kind, []) for kind in self.kinds)
+        classified['all'] = names
+        for name in names:
+            for kind in self._kinds_of(name):
+                classified[kind].append(name)
+        return classified
+
+    def get(self, kind):
+        """Return a new sorted list of the file names of some kind.
+
+        :param kind: one of ``'template'``, ``'partial'``, ``'static'``,
+        ``'data'`` and ``'jinja'``.
+        """
+        return list(self.classified[kind])
+
+    def add(self, filename):
+        """Record a new file.
+
+        :param filename: the name of the file, relative to the searchpath.
+        """
+        if self._names is None or filename in self._names:
+            return
+        self._names.add(filename)
+        if self._classified is not None:
+            insort(self._classified['all'], filename)
+            for kind in self._kinds_of(filename):
+                insort(self._classified[kind], filename)
+
+    def remove(self, filename):
+        """Forget a deleted file.
+
+        :param filename: the name of the file, relative to the searchpath.
+        """
+        if self._names is None or filename not in self._names:
+            return
+        self._names.discard(filename)
+        if self._classified is not None:
+            for names in self._classified.values():
+                i = bisect_left(names, filename)
+                if i < len(names) and names[i] == filename:
+                    del names[i]
+
+    def __contains__(self, filename):
+        if self._names is None:
+            self.scan()
+        return filename in self._names
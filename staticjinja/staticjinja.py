@@ -9,18 +9,28 @@ Uses Jinja2 to compile templates.
 from __future__ import absolute_import, print_function
 
 import inspect
+import io
 import logging
 import os
 import re
-import shutil
+import sys
+import threading
+import types
 import warnings
 
+from contextlib import contextmanager
 from itertools import chain
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import FileSystemLoader, TemplateSyntaxError
 from jinja2.meta import find_referenced_templates
 
-from .reloader import Reloader
+from .cache import TemplateCache
+from .data import DataCache, DataContext
+from .dep_graph import DepCache, DepGraph
+from .manifest import Manifest, context_hash, file_hash
+from .sinks import DirectorySink, MemorySink, write_if_changed
+from .sources import SourceTree
+from .tracking import TrackingEnvironment
 
 
 def _has_argument(func):
@@ -38,6 +48,177 @@ def _has_argument(func):
         return bool(inspect.getargspec(func).args)
 
 
+class CachedContext(object):
+    """A context generator whose result is memoized.
+
+    The generator runs once (or once per template if it takes the template
+    as argument) and its result is reused until one of *datafiles* changes.
+
+    :param generator:
+        A function taking either no argument or the current template and
+        returning a dictionary.
+
+    :param datafiles:
+        List of data file paths (relative to searchpath) used by
+        *generator*. Templates using this context depend on them, and
+        modifying one of them clears the cache. Defaults to ``None``.
+    """
+
+    def __init__(self, generator, datafiles=None):
+        self.generator = generator
+        self.datafiles = list(datafiles or [])
+        self.takes_template = _has_argument(generator)
+        self._cache = {}
+        # Number of invalidations, so that a result generated from data
+        # which changed in the meantime is not cached.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, template):
+        key = template.name if self.takes_template else None
+        env = template.environment
+        tracking = isinstance(env, TrackingEnvironment)
+        try:
+            context, used = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            # Files read by the generator are used by this template as well.
+            if tracking:
+                for name in used:
+                    env.record(name)
+            return context
+        with self._lock:
+            generation = self._generation
+        if tracking:
+            with env.track() as used:
+                context = self._generate(template)
+        else:
+            context, used = self._generate(template), set()
+        with self._lock:
+            if self._generation == generation:
+                self._cache[key] = (context, used)
+        return context
+
+    def _generate(self, template):
+        if self.takes_template:
+            return self.generator(template)
+        return self.generator()
+
+    def invalidate(self, filename):
+        """Clear the cache if *filename* is one of the data files.
+
+        Returns ``True`` if the cache was cleared.
+
+        :param filename: the path of the changed file, relative to
+        searchpath.
+        """
+        if filename in self.datafiles:
+            with self._lock:
+                self._cache.clear()
+                self._generation += 1
+            return True
+        return False
+
+    def __repr__(self):
+        return "CachedContext(%r, %r)" % (self.generator, self.datafiles)
+
+
+# The site used by the current rendering worker process. Workers are forked
+# from the main process, so they inherit the site (including its contexts,
+# rules and environment) without having to pickle it.
+_worker_site = None
+
+
+def _init_worker(site):
+    """Prepare a worker process of the rendering pool.
+
+    Since the worker is forked, it owns a private copy of the site's
+    :class:`jinja2.Environment`, so compiled templates are cached per process.
+
+    :param site: the :class:`Site <Site>` to render templates from.
+    """
+    global _worker_site
+    _worker_site = site
+
+
+def _render_in_worker(template_name):
+    """Render a single template in a worker process.
+
+    Returns the output statistics of this rendering, the templates it used,
+    the hits and misses of the template cache and the timings recorded by the
+    profile and trace of the build, if any, so that the main process can
+    aggregate them. Outputs for a sink which is
+    not shared between processes are returned as well, to be written by the
+    main process.
+
+    :param template_name: the name of the template to render.
+    """
+    _worker_site.reset_output_stats()
+    cache = _worker_site.template_cache
+    if cache is not None:
+        cache.reset_stats()
+    instruments = _worker_site._instruments()
+    for _, instrument in instruments:
+        instrument.clear()
+    outputs = None
+    if not _worker_site.sink.shared:
+        outputs = MemorySink()
+        _worker_site._sink = outputs
+    _worker_site.render_templates([template_name])
+    return (template_name, _worker_site.output_stats,
+            _worker_site.recorded_deps.get(template_name),
+            outputs.files if outputs is not None else None,
+            (cache.hits, cache.misses) if cache is not None else None,
+            [(attr, instrument.timings()) for attr, instrument in instruments])
+
+
+class _NullTimer(object):
+    """Context manager doing nothing, used when the build isn't profiled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+null_timer = _NullTimer()
+
+
+@contextmanager
+def _nested(managers):
+    """Enter a list of context managers, in order."""
+    if not managers:
+        yield
+        return
+    with managers[0]:
+        with _nested(managers[1:]):
+            yield
+
+
+def _find_deps_in_worker(filename):
+    """Parse a single (maybe partial) template in a worker process.
+
+    :param filename: the name of the template to parse.
+    """
+    return _worker_site._parse_jinja_deps(filename)
+
+
+def _fork_context():
+    """Return a multiprocessing context forking workers, or ``None`` if
+    this platform can't fork."""
+    import multiprocessing
+    try:
+        return multiprocessing.get_context('fork')
+    except (AttributeError, ValueError):
+        return None
+
+
+class _DefaultSink(DirectorySink):
+    """The sink of a site writing into its ``outpath``. It is replaced when
+    ``outpath`` or ``write_if_changed`` change."""
+
+
 class Site(object):
     """The Site object.
 
@@ -51,8 +232,11 @@ class Site(object):
     :param contexts:
         A list of `regex, context` pairs. Each context is either a dictionary
         or a function that takes either no argument or or the current template
-        as its sole argument and returns a dictionary. The regex, if matched
-        against a filename, will cause the context to be used.
+        as its sole argument and returns a dictionary. The function can be
+        wrapped in a :class:`CachedContext` to memoize its result. A
+        :class:`DataContext <staticjinja.data.DataContext>` loads data files
+        into the context. The regex, if matched against a filename, will cause
+        the context to be used.
 
     :param rules:
         A list of `regex, function` pairs used to override template
@@ -88,6 +272,42 @@ class Site(object):
         contexts list will be merged (in order) to get the final context.
         Otherwise, only the first matching regex is used. Defaults to
         ``False``.
+
+    :param jobs:
+        Number of processes used to render templates. Defaults to ``1``,
+        which renders everything in the current process.
+
+    :param incremental:
+        A boolean value. If set to ``True``, a build manifest is kept in
+        ``outpath`` and :meth:`render` only renders templates whose source,
+        dependencies or context changed since the previous build. Defaults to
+        ``False``.
+
+    :param write_if_changed:
+        A boolean value. If set to ``True``, templates are rendered in memory
+        and their output file is atomically replaced only if its content
+        changed. Defaults to ``False``, which streams templates to their
+        output file.
+
+    :param cachepath:
+        A string representing a directory where data reused between runs,
+        such as template dependencies, is stored. Defaults to ``None``,
+        meaning nothing is stored.
+
+    :param sink:
+        A :class:`Sink <staticjinja.sinks.Sink>` receiving the rendered
+        templates and static files. Defaults to ``None``, meaning a
+        :class:`DirectorySink <staticjinja.sinks.DirectorySink>` writing into
+        ``outpath``.
+
+    :param data_loaders:
+        A dictionary mapping file extensions to functions parsing data files,
+        see :class:`DataCache <staticjinja.data.DataCache>`. Defaults to
+        ``None``, meaning the JSON, JSON Lines, CSV, YAML and TOML loaders.
+
+    :param data_cache_size:
+        Maximal total size in bytes of the data files whose parsed content is
+        kept by :meth:`load_data`. Defaults to ``None``, meaning no limit.
     """
 
     def __init__(self,
@@ -102,28 +322,97 @@ class Site(object):
                  datapaths=None,
                  extra_deps=None,
                  mergecontexts=False,
+                 jobs=1,
+                 incremental=False,
+                 write_if_changed=False,
+                 cachepath=None,
+                 sink=None,
+                 data_loaders=None,
+                 data_cache_size=None,
                  ):
         self._env = environment
         self.searchpath = searchpath
         self.outpath = outpath
         self.encoding = encoding
         self.logger = logger
-        self.contexts = contexts or []
-        self.rules = rules or []
+        self._contexts = contexts or []
+        self._rules = rules or []
+        self._dispatch_index = None
+        self.sources = SourceTree(self)
         self.staticpaths = staticpaths
         self.datapaths = datapaths
         self.extra_deps = extra_deps or {}
         # We don't generate the dep graph until we are sure it will be used
         self.dep_graph = None
         self.mergecontexts = mergecontexts
+        self.jobs = jobs
+        self.incremental = incremental
+        self.write_if_changed = write_if_changed
+        self.cachepath = cachepath
+        self._sink = sink
+        # Parsed data files, also available to templates as load_data().
+        self.data = DataCache(
+            searchpath, data_loaders, data_cache_size, encoding,
+            os.path.join(cachepath, 'records') if cachepath else None)
+        environment.globals.setdefault('load_data', self.load_data)
+        environment.globals.setdefault('record_index', self.record_index)
+        # The BuildProfile and TraceRecorder of the current build, if it is
+        # profiled or traced.
+        self.profile = None
+        self.trace = None
+        # Templates used by each template during its last rendering, when
+        # the environment is a TrackingEnvironment.
+        self.recorded_deps = {}
+        # Templates which failed to parse when building the dependency
+        # graph: they and their descendants are always rendered again.
+        self.unparsed_templates = set()
+        # Contexts computed while looking for outdated templates, kept to
+        # render these templates, along with the files their generators
+        # used.
+        self._pending_contexts = {}
+        self.reset_output_stats()
+
+    @property
+    def sink(self):
+        """The :class:`Sink <staticjinja.sinks.Sink>` receiving the
+        outputs."""
+        sink = self._sink
+        if sink is None or isinstance(sink, _DefaultSink):
+            if (sink is None or sink.path != self.outpath or
+                    sink.write_if_changed != self.write_if_changed):
+                sink = self._sink = _DefaultSink(self.outpath,
+                                                 self.write_if_changed)
+        return sink
+
+    @sink.setter
+    def sink(self, sink):
+        self._sink = sink
+
+    @property
+    def staticpaths(self):
+        return self._staticpaths
+
+    @staticpaths.setter
+    def staticpaths(self, staticpaths):
+        self._staticpaths = staticpaths
+        self.sources.reclassify()
+
+    @property
+    def datapaths(self):
+        return self._datapaths
+
+    @datapaths.setter
+    def datapaths(self, datapaths):
+        self._datapaths = datapaths
+        self.sources.reclassify()
 
     @property
     def template_names(self):
-        return self._env.list_templates(filter_func=self.is_template)
+        return self.sources.get('template')
 
     @property
     def jinja_names(self):
-        return self._env.list_templates(filter_func=self.is_jinja)
+        return self.sources.get('jinja')
 
     @property
     def templates(self):
@@ -133,11 +422,11 @@ class Site(object):
 
     @property
     def static_names(self):
-        return self._env.list_templates(filter_func=self.is_static)
+        return self.sources.get('static')
 
     @property
     def data_names(self):
-        return self._env.list_templates(filter_func=self.is_data)
+        return self.sources.get('data')
 
     def get_template(self, template_name):
         """Get a :class:`jinja2.Template` from the environment.
@@ -146,6 +435,76 @@ class Site(object):
         """
         return self._env.get_template(template_name)
 
+    @property
+    def contexts(self):
+        return self._contexts
+
+    @contexts.setter
+    def contexts(self, contexts):
+        self._contexts = contexts
+        self._dispatch_index = None
+
+    @property
+    def rules(self):
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules):
+        self._rules = rules
+        self._dispatch_index = None
+
+    def _build_dispatch_index(self, key):
+        """Compile the regexes of contexts and rules once.
+
+        Each context generator is stored along with the way it must be
+        called, so that its signature is only inspected once.
+
+        :param key: a snapshot of the contexts and rules the index is built
+            from
+        """
+        contexts, rules = key
+        patterns = []
+        for regex, context_generator in contexts:
+            if isinstance(context_generator, CachedContext):
+                kind = 'template'
+            elif isinstance(context_generator, DataContext):
+                kind = 'data'
+            elif not isinstance(context_generator, types.FunctionType):
+                kind = 'dict'
+            elif _has_argument(context_generator):
+                kind = 'template'
+            else:
+                kind = 'call'
+            patterns.append((re.compile(regex).match, 'context',
+                             (kind, context_generator)))
+        for regex, render_func in rules:
+            patterns.append((re.compile(regex).match, 'rule', render_func))
+        self._dispatch_index = (key, patterns, {})
+
+    def _dispatch(self, template_name):
+        """Return the matching contexts and rules for a template name.
+
+        The result is a pair of lists, in registration order, and is
+        memoized per name. The index is rebuilt when :attr:`contexts` or
+        :attr:`rules` are reassigned or modified in place.
+
+        :param template_name: the name of the template
+        """
+        key = (tuple(self._contexts), tuple(self._rules))
+        if self._dispatch_index is None or self._dispatch_index[0] != key:
+            self._build_dispatch_index(key)
+        _, patterns, memo = self._dispatch_index
+        try:
+            return memo[template_name]
+        except KeyError:
+            pass
+        matches = {'context': [], 'rule': []}
+        for match, category, value in patterns:
+            if match(template_name):
+                matches[category].append(value)
+        result = memo[template_name] = (matches['context'], matches['rule'])
+        return result
+
     def get_context(self, template):
         """Get the context for a template.
 
@@ -161,20 +520,49 @@ class Site(object):
         :param template: the template to get the context for
         """
         context = {}
-        for regex, context_generator in self.contexts:
-            if re.match(regex, template.name):
-                if inspect.isfunction(context_generator):
-                    if _has_argument(context_generator):
-                        context.update(context_generator(template))
-                    else:
-                        context.update(context_generator())
-                else:
-                    context.update(context_generator)
-
-                if not self.mergecontexts:
-                    break
+        for kind, context_generator in self._dispatch(template.name)[0]:
+            if kind == 'template':
+                with self._timed('context', template.name, context_generator):
+                    context.update(context_generator(template))
+            elif kind == 'call':
+                with self._timed('context', template.name, context_generator):
+                    context.update(context_generator())
+            elif kind == 'data':
+                with self._timed('context', template.name, context_generator):
+                    context.update(context_generator.load(self))
+            else:
+                context.update(context_generator)
+
+            if not self.mergecontexts:
+                break
         return context
 
+    def _instruments(self):
+        """Return ``(attribute, instrument)`` for the profile and the trace
+        of the current build, if any."""
+        return [(attr, getattr(self, attr)) for attr in ('profile', 'trace')
+                if getattr(self, attr) is not None]
+
+    def _timed(self, phase, template_name=None, generator=None):
+        """Return a context manager timing a phase of the build if it is
+        profiled or traced, see :meth:`BuildProfile.timed
+        <staticjinja.profiling.BuildProfile.timed>`."""
+        instruments = self._instruments()
+        if not instruments:
+            return null_timer
+        if generator is not None:
+            from .profiling import generator_name
+            generator = generator_name(generator)
+        return _nested([instrument.timed(phase, template_name, generator)
+                        for _, instrument in instruments])
+
+    def _span(self, name, category):
+        """Return a context manager recording a span in the trace of the
+        current build, if any."""
+        if self.trace is None:
+            return null_timer
+        return self.trace.span(name, category)
+
     def get_rule(self, template_name):
         """Find a matching compilation rule for a function.
 
@@ -182,9 +570,9 @@ class Site(object):
 
         :param template_name: the name of the template
         """
-        for regex, render_func in self.rules:
-            if re.match(regex, template_name):
-                return render_func
+        rules = self._dispatch(template_name)[1]
+        if rules:
+            return rules[0]
         raise ValueError("no matching rule")
 
     def is_static(self, filename):
@@ -272,13 +660,9 @@ class Site(object):
 
         return True
 
-    def _ensure_dir(self, template_name):
-        """Ensure the output directory for a template exists."""
-        head = os.path.dirname(template_name)
-        if head:
-            file_dirpath = os.path.join(self.outpath, head)
-            if not os.path.exists(file_dirpath):
-                os.makedirs(file_dirpath)
+    def reset_output_stats(self):
+        """Reset the counts of changed and unchanged outputs."""
+        self.output_stats = {'changed': 0, 'unchanged': 0}
 
     def render_template(self, template, context=None, filepath=None):
         """Render a single :class:`jinja2.Template` object.
@@ -296,25 +680,78 @@ class Site(object):
 
         :param filepath:
             Optional. A file or file-like object to dump the complete template
-            stream into. Defaults to to ``os.path.join(self.outpath,
-            template.name)``.
+            stream into. Defaults to writing an output named
+            ``template.name`` into :attr:`sink`.
 
         """
         self.logger.info("Rendering %s..." % template.name)
 
+        context_used = None
+        if context is None:
+            context, context_used = self._pending_contexts.pop(
+                template.name, (None, None))
+        if isinstance(self._env, TrackingEnvironment):
+            with self._env.track() as used:
+                self._render_template(template, context, filepath)
+            if context_used:
+                used.update(context_used)
+            self.record_deps(template.name, used)
+        else:
+            self._render_template(template, context, filepath)
+
+    def _render_template(self, template, context, filepath):
         if context is None:
             context = self.get_context(template)
         try:
             rule = self.get_rule(template.name)
         except ValueError:
-            self._ensure_dir(template.name)
             if filepath is None:
-                filepath = os.path.join(self.outpath, template.name)
-            template.stream(**context).dump(filepath, self.encoding)
+                if not self._instruments():
+                    chunks = (chunk.encode(self.encoding)
+                              for chunk in template.generate(**context))
+                else:
+                    # Render first, so that rendering and writing are timed
+                    # separately.
+                    with self._timed('render', template.name):
+                        chunks = template.render(**context).encode(
+                            self.encoding)
+                with self._timed('write', template.name):
+                    changed = self.sink.write(template.name, chunks)
+                if changed:
+                    self.output_stats['changed'] += 1
+                else:
+                    self.output_stats['unchanged'] += 1
+            elif self.write_if_changed and isinstance(filepath, str):
+                data = template.render(**context).encode(self.encoding)
+                if write_if_changed(filepath, data):
+                    self.output_stats['changed'] += 1
+                else:
+                    self.output_stats['unchanged'] += 1
+            else:
+                template.stream(**context).dump(filepath, self.encoding)
         else:
-            rule(self, template, **context)
+            with self._timed('rule', template.name):
+                rule(self, template, **context)
+
+    def render_to_bytes(self, template_name):
+        """Render a template in memory and return the encoded output.
+
+        Rules are not applied. The templates and data files used are recorded
+        as for :meth:`render_template`.
 
-    def render_templates(self, filenames, outpath=None):
+        :param template_name: the name of the template.
+        """
+        template = self.get_template(template_name)
+        if not isinstance(self._env, TrackingEnvironment):
+            context = self.get_context(template)
+            return template.render(**context).encode(self.encoding)
+        with self._env.track() as used:
+            context = self.get_context(template)
+            data = template.render(**context).encode(self.encoding)
+        self.record_deps(template_name, used)
+        return data
+
+    def render_templates(self, filenames, outpath=None, jobs=1):
         """Render a collection of templates names.
 
         :param filenames:
@@ -325,17 +762,131 @@ class Site(object):
             stream into. Defaults to to ``os.path.join(self.outpath,
             template.name)``.
 
+        :param jobs:
+            Optional. Number of processes used to render the templates.
+            Defaults to ``1``.
+
         """
+        if jobs > 1 and outpath is None:
+            self._render_templates_parallel(filenames, jobs)
+            return
         for filename in filenames:
-            self.render_template(self._env.get_template(filename), outpath)
+            with self._timed('load', filename):
+                template = self._env.get_template(filename)
+            self.render_template(template, outpath)
+
+    def _imap_in_workers(self, context, func, items, jobs):
+        """Yield the results of *func* over *items*, in any order, computed
+        by a pool of *jobs* worker processes.
+
+        Workers are forked from the current process so that the site, whose
+        contexts and rules are often lambdas, does not need to be pickled.
+        Errors raised by *func* are re-raised here.
+
+        :param context: the forking multiprocessing context.
+
+        :param func: a module-level function taking an item.
+
+        :param items: a list of items.
+
+        :param jobs: Number of worker processes.
+        """
+        chunksize = max(1, len(items) // (jobs * 4))
+        pool = context.Pool(jobs, _init_worker, (self,))
+        try:
+            for result in pool.imap_unordered(func, items, chunksize):
+                yield result
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _render_templates_parallel(self, filenames, jobs):
+        """Render a collection of template names using a process pool.
+
+        :param filenames: A collection of path to templates to render.
+
+        :param jobs: Number of worker processes.
+        """
+        filenames = [getattr(f, 'name', f) for f in filenames]
+        context = _fork_context()
+        if context is None:
+            self.logger.warning("Parallel rendering needs fork(), "
+                                "falling back to a single process.")
+            self.render_templates(filenames)
+            return
+        sink = self.sink
+        cache = self.template_cache
+        for (name, stats, used, outputs, cache_stats,
+             timings) in self._imap_in_workers(context, _render_in_worker,
+                                               filenames, jobs):
+            for key, count in stats.items():
+                self.output_stats[key] += count
+            if cache_stats is not None:
+                cache.hits += cache_stats[0]
+                cache.misses += cache_stats[1]
+            for attr, data in timings:
+                getattr(self, attr).merge(data)
+            for output_name, data in (outputs or {}).items():
+                sink.write(output_name, data)
+            if used is not None:
+                self.record_deps(name, used)
+
+    def _copy_static_file(self, f, compare):
+        """Copy a single static file unless it is unchanged.
+
+        Returns a pair ``(copied, size)``.
+        """
+        input_location = os.path.join(self.searchpath, f)
+        size = os.path.getsize(input_location)
+        self.logger.debug("Copying %s to %r." % (f, self.sink))
+        with self._span('copy %s' % f, 'static'):
+            return self.sink.copy(f, input_location, compare), size
+
+    def copy_static(self, files, threads=None, compare='mtime'):
+        """Copy static files to :attr:`sink`.
+
+        Files whose copy is identical are skipped. Copying is mostly waiting
+        for the disk, so files are copied by a pool of threads, whatever the
+        number of processes rendering templates.
+
+        :param files: A collection of path to static files to copy.
 
-    def copy_static(self, files):
-        for f in files:
-            input_location = os.path.join(self.searchpath, f)
-            output_location = os.path.join(self.outpath, f)
-            print("Copying %s to %s." % (f, output_location))
-            self._ensure_dir(f)
-            shutil.copy2(input_location, output_location)
+        :param threads: Optional. Number of threads used to copy files.
+        Defaults to the number of CPUs plus 4, at most 32.
+
+        :param compare: Optional. How to detect identical copies: ``'mtime'``
+        compares sizes and modification times, ``'hash'`` compares sizes and
+        contents and ``None`` copies every file. Defaults to ``'mtime'``.
+        """
+        def copy(f):
+            return self._copy_static_file(f, compare)
+
+        files = list(files)
+        if threads is None:
+            threads = min(32, (getattr(os, 'cpu_count', lambda: None)() or
+                               1) + 4)
+        threads = min(threads, len(files))
+        if threads > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(threads)
+            try:
+                results = pool.map(copy, files)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [copy(f) for f in files]
+
+        copied = [size for done, size in results if done]
+        skipped = [size for done, size in results if not done]
+        if results:
+            self.logger.info(
+                "Copied %d static files (%d bytes), skipped %d unchanged "
+                "files (%d bytes)." %
+                (len(copied), sum(copied), len(skipped), sum(skipped)))
 
     def get_dependencies(self, filename):
         """Get a list of file paths that depends on the file named *filename*
@@ -352,19 +903,301 @@ class Site(object):
         else:
             return []
 
-    def render(self, use_reloader=False):
+    @property
+    def template_cache(self):
+        """The :class:`TemplateCache` of the environment, if any."""
+        cache = self._env.bytecode_cache
+        return cache if isinstance(cache, TemplateCache) else None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.outpath, Manifest.filename)
+
+    def _output_name(self, filename):
+        """Return the name of the output of a template or static file, or
+        ``None`` for a template rendered by a rule."""
+        if not self.is_static(filename):
+            try:
+                self.get_rule(filename)
+            except ValueError:
+                pass
+            else:
+                return None
+        return filename
+
+    def remove_output(self, filename):
+        """Remove the output of a deleted template or static file. A
+        :class:`DirectorySink <staticjinja.sinks.DirectorySink>` also removes
+        the directories left empty.
+
+        Returns ``True`` if an output was removed. Outputs of templates
+        rendered by a rule are unknown and kept.
+
+        :param filename: the name of the template or static file, relative to
+        the searchpath.
+        """
+        name = self._output_name(filename)
+        if name is None or not self.sink.remove(name):
+            return False
+        self.logger.info("Removed %s." % name)
+        return True
+
+    def rename_output(self, src, dest):
+        """Move the output of a renamed template or static file.
+
+        Returns ``True`` if an output was moved. Nothing is moved if the file
+        is no longer a template or static file under its new name.
+
+        :param src: the old name of the file, relative to the searchpath.
+
+        :param dest: the new name of the file, relative to the searchpath.
+        """
+        if not (self.is_template(dest) or self.is_static(dest)):
+            return False
+        src_name = self._output_name(src)
+        dest_name = self._output_name(dest)
+        if (src_name is None or dest_name is None or
+                not self.sink.rename(src_name, dest_name)):
+            return False
+        self.logger.info("Moved %s to %s." % (src_name, dest_name))
+        return True
+
+    def prune_outputs(self, manifest):
+        """Remove the outputs of the templates and static files recorded in
+        *manifest* which no longer exist.
+
+        Returns the number of outputs removed.
+
+        :param manifest: the :class:`Manifest` of the previous build.
+        """
+        orphans = [name for name in chain(manifest.entries, manifest.static)
+                   if name not in self.sources]
+        removed = len([name for name in sorted(orphans)
+                       if self.remove_output(name)])
+        self.logger.info("Pruned %d orphaned outputs." % removed)
+        return removed
+
+    def _has_output(self, template_name):
+        """Check whether the default output of a template exists.
+
+        Templates rendered by a rule have an output we don't know about, so
+        they are assumed to exist.
+        """
+        try:
+            self.get_rule(template_name)
+        except ValueError:
+            return self.sink.exists(template_name)
+        return True
+
+    def _manifest_entry(self, template_name, hashes, contexts, memo):
+        """Compute the fingerprints of everything used to render a template.
+
+        :param template_name: the name of the template.
+
+        :param hashes: a dictionary caching file hashes during a build.
+
+        :param contexts: a dictionary receiving the context of the template,
+        and the files used by its context generators.
+
+        :param memo: a dictionary caching the fingerprints of context values
+        during a build, see :func:`context_hash
+        <staticjinja.manifest.context_hash>`.
+        """
+        def hash_of(filename):
+            if filename not in hashes:
+                try:
+                    hashes[filename] = file_hash(
+                        os.path.join(self.searchpath, filename))
+                except (IOError, OSError):
+                    hashes[filename] = None
+            return hashes[filename]
+
+        deps = dict((dep, hash_of(dep))
+                    for dep in self.dep_graph.get_ancestors(template_name))
+        template = self.get_template(template_name)
+        used = None
+        if isinstance(self._env, TrackingEnvironment):
+            # The data files read by context generators are dependencies of
+            # the template, as when the context is generated while rendering.
+            with self._env.track() as used:
+                context = self.get_context(template)
+        else:
+            context = self.get_context(template)
+        contexts[template_name] = (context, used)
+        return {
+            'source': hash_of(template_name),
+            'deps': deps,
+            'context': context_hash(context, memo),
+            'recorded': sorted(self.recorded_deps.get(template_name, ())),
+        }
+
+    def outdated_templates(self, template_names, manifest, force=False):
+        """Filter the templates which need to be rendered again.
+
+        The entries of *manifest* are replaced by the fingerprints of this
+        build. The contexts of the outdated templates are kept to render
+        them, so that context generators run once per template.
+
+        :param template_names: the names of the candidate templates.
+
+        :param manifest: the :class:`Manifest` of the previous build.
+
+        :param force: if ``True``, every template is considered outdated.
+        """
+        if self.dep_graph is None:
+            self.dep_graph = DepGraph(self)
+        outdated = []
+        reasons = {}
+        hashes = {}
+        entries = {}
+        contexts = {}
+        memo = {}
+        for template_name in template_names:
+            entry = self._manifest_entry(template_name, hashes, contexts,
+                                         memo)
+            entries[template_name] = entry
+            if force:
+                reason = "forced"
+            elif (template_name in self.unparsed_templates or
+                  self.unparsed_templates.intersection(entry['deps'])):
+                reason = "not parsed"
+            else:
+                reason = manifest.outdated_reason(template_name, entry)
+            if reason is None and not self._has_output(template_name):
+                reason = "output missing"
+            if reason is None:
+                continue
+            self.logger.debug("%s: %s" % (template_name, reason))
+            reasons[reason] = reasons.get(reason, 0) + 1
+            outdated.append(template_name)
+        manifest.entries = entries
+        self._pending_contexts = dict((name, contexts[name])
+                                      for name in outdated)
+
+        skipped = len(template_names) - len(outdated)
+        details = ", ".join("%d %s" % (n, reason)
+                            for reason, n in sorted(reasons.items()))
+        self.logger.info("%d of %d templates outdated%s, %d unchanged "
+                         "templates skipped." %
+                         (len(outdated), len(template_names),
+                          " (%s)" % details if details else "", skipped))
+        return outdated
+
+    def render(self, use_reloader=False, jobs=None, force=False,
+               debounce=0.1, watcher=None, prune=False, profile=None,
+               trace=None):
         """Generate the site.
 
         :param use_reloader: if given, reload templates on modification
+
+        :param jobs: number of processes used to render templates. Defaults
+        to ``self.jobs``.
+
+        :param force: if given, render every template even if the build
+        manifest says it is up to date. Only used when ``self.incremental``
+        is ``True``.
+
+        :param debounce: number of seconds the reloader waits for other
+        changes before rendering. Defaults to ``0.1``.
+
+        :param watcher: the filesystem watcher used by the reloader, see
+        :class:`Reloader <Reloader>`. Defaults to the best one available on
+        this platform.
+
+        :param prune: if given, remove the outputs of the templates and
+        static files which were deleted since the previous build, according
+        to the build manifest. Only used when ``self.incremental`` is
+        ``True``.
+
+        :param profile: a :class:`BuildProfile
+        <staticjinja.profiling.BuildProfile>` recording the time spent in
+        each phase of the build. Its summary is logged at the end of the
+        build.
+
+        :param trace: a :class:`TraceRecorder
+        <staticjinja.tracing.TraceRecorder>` recording a timeline of the
+        build. In watch mode, the reloader keeps recording in it.
         """
-        self.render_templates(list(self.template_names))
-        self.copy_static(self.static_names)
+        if jobs is None:
+            jobs = self.jobs
+        self.profile = profile
+        self.trace = trace
+        for _, instrument in self._instruments():
+            instrument.start()
+        try:
+            self._build(jobs, force, prune)
+        finally:
+            for _, instrument in self._instruments():
+                instrument.stop()
+            self.profile = None
+            self.trace = None
+        if trace is not None and trace.path:
+            self.logger.info("Trace written to %s." % trace.path)
+        if profile is not None:
+            for line in profile.report():
+                self.logger.info(line)
+            if profile.path:
+                self.logger.info("Profile written to %s." % profile.path)
 
         if use_reloader:
             self.logger.info("Watching '%s' for changes..." %
                              self.searchpath)
             self.logger.info("Press Ctrl+C to stop.")
-            Reloader(self).watch()
+            from .reloader import Reloader
+            Reloader(self, debounce=debounce, background=True,
+                     watcher=watcher, trace=trace).watch()
+
+    def _build(self, jobs, force, prune):
+        """Render the templates and copy the static files, see
+        :meth:`render`."""
+        with self._timed('scan'):
+            self.sources.scan()
+        template_names = list(self.template_names)
+        if self.incremental:
+            manifest = Manifest.load(self.manifest_path)
+            # Deleted files stay in the manifest until they are pruned.
+            orphans = {}
+            orphan_static = []
+            if prune:
+                self.prune_outputs(manifest)
+            else:
+                orphans = dict((name, entry)
+                               for name, entry in manifest.entries.items()
+                               if name not in self.sources)
+                orphan_static = [name for name in manifest.static
+                                 if name not in self.sources]
+            for name, used in manifest.recorded_deps().items():
+                self.recorded_deps.setdefault(name, set(used))
+            with self._timed('dependencies'):
+                self.dep_graph = DepGraph(self)
+            with self._timed('outdated'):
+                template_names = self.outdated_templates(template_names,
+                                                         manifest, force)
+        cache = self.template_cache
+        if cache is not None:
+            cache.reset_stats()
+        self.reset_output_stats()
+        with self._timed('render'):
+            try:
+                self.render_templates(template_names, jobs=jobs)
+            finally:
+                # Workers render from their own copy of the contexts.
+                self._pending_contexts = {}
+        if self.write_if_changed:
+            self.logger.info("%(changed)d outputs changed, %(unchanged)d "
+                             "outputs unchanged." % self.output_stats)
+        if cache is not None:
+            self.logger.info("Template cache: %d hits, %d misses." %
+                             (cache.hits, cache.misses))
+        if self.incremental:
+            for name in template_names:
+                manifest.entries[name]['recorded'] = sorted(
+                    self.recorded_deps.get(name, ()))
+            manifest.entries.update(orphans)
+            manifest.static = sorted(chain(self.static_names, orphan_static))
+            manifest.save()
+        with self._timed('static'):
+            self.copy_static(self.static_names)
 
     def is_jinja(self, filename):
         """Check if a file is a data file (which will not be compiled using
@@ -389,15 +1222,197 @@ class Site(object):
         ast = self._env.parse(source)
         return find_referenced_templates(ast)
 
-    def get_file_dep(self, filename):
-        """Return a list of path of files which filename depends on."""
-        jinja_deps = self.find_jinja_deps(filename)
+    def _parse_jinja_deps(self, filename):
+        """Return ``(filename, deps)``, with *deps* the list of templates
+        referenced by *filename*, or ``None`` if it can't be parsed."""
+        try:
+            return filename, list(self.find_jinja_deps(filename))
+        except TemplateSyntaxError:
+            return filename, None
+
+    def find_all_jinja_deps(self, filenames, jobs=None):
+        """Return a dictionary mapping each of *filenames* to the list of
+        (maybe partial) templates it extends, imports or includes.
+
+        If ``self.cachepath`` is set, the result of previous runs is reused
+        for unmodified files. The other files are parsed using *jobs* worker
+        processes.
+
+        :param filenames: the names of the (maybe partial) templates.
+
+        :param jobs: number of processes used to parse templates. Defaults
+        to ``self.jobs``.
+        """
+        if jobs is None:
+            jobs = self.jobs
+        cache = None
+        if self.cachepath is not None:
+            cache = DepCache.load(os.path.join(self.cachepath, 'deps.json'))
+
+        deps = {}
+        missing = []
+        self.unparsed_templates.difference_update(filenames)
+        for filename in filenames:
+            cached = None
+            if cache is not None:
+                cached = cache.get(filename,
+                                   os.path.join(self.searchpath, filename))
+            if cached is None:
+                missing.append(filename)
+            else:
+                deps[filename] = cached
+
+        context = _fork_context() if jobs > 1 and len(missing) > 1 else None
+        if context is None:
+            results = (self._parse_jinja_deps(f) for f in missing)
+        else:
+            results = self._imap_in_workers(context, _find_deps_in_worker,
+                                            missing, jobs)
+        for filename, filename_deps in results:
+            if filename_deps is None:
+                # The error is raised if the template is rendered.
+                self.logger.warning("Could not parse %s, it will be "
+                                    "rendered again at every build."
+                                    % filename)
+                self.unparsed_templates.add(filename)
+                deps[filename] = []
+                continue
+            deps[filename] = filename_deps
+            if cache is not None:
+                cache.set(filename, os.path.join(self.searchpath, filename),
+                          filename_deps)
+
+        if cache is not None:
+            cache.prune(filenames)
+            cache.save()
+            self.logger.info("Parsed %d templates, reused %d cached "
+                             "dependencies." %
+                             (len(missing), len(filenames) - len(missing)))
+        return deps
+
+    def cached_contexts(self, template_name):
+        """Return the :class:`CachedContext` objects used to render a
+        template.
+
+        :param template_name: the name of the template
+        """
+        return [context_generator for kind, context_generator
+                in self._dispatch(template_name)[0]
+                if isinstance(context_generator, CachedContext)]
+
+    def invalidate_contexts(self, filename):
+        """Clear the cached contexts using the data file *filename*.
+
+        Returns the number of cleared caches.
+
+        :param filename: the path of the changed file, relative to
+        searchpath.
+        """
+        return sum(1 for _, context_generator in self._contexts
+                   if isinstance(context_generator, CachedContext) and
+                   context_generator.invalidate(filename))
+
+    def data_path(self, filename):
+        """Return the absolute path of a data file.
+
+        When called by a context generator, the data file is recorded as a
+        dependency of the template being rendered, so that the
+        :class:`Reloader <Reloader>` renders it again when the data file
+        changes.
+
+        :param filename: the path of the data file, relative to searchpath.
+        """
+        if isinstance(self._env, TrackingEnvironment):
+            self._env.record(filename)
+        return os.path.join(self.searchpath, filename)
+
+    def load_data(self, filename):
+        """Return the parsed content of a data file.
+
+        The file is parsed according to its extension, see
+        :class:`DataCache <staticjinja.data.DataCache>`, and only parsed again
+        once it changes. Templates can call it as ``load_data(filename)``.
+        As with :meth:`data_path`, the data file is recorded as a dependency
+        of the template being rendered.
+
+        :param filename: the path of the data file, relative to searchpath.
+        """
+        self.data_path(filename)
+        return self.data.load(filename)
+
+    def record_index(self, filename, key=None):
+        """Return a :class:`RecordIndex <staticjinja.records.RecordIndex>`
+        giving the records of a JSON Lines or CSV data file one at a time,
+        by key or by position, without loading the whole file.
+
+        The index is built on first use and kept until the file changes.
+        With ``cachepath``, it is saved there and reused by later builds and
+        by the worker processes. Templates can call it as
+        ``record_index(filename, key)``. As with :meth:`data_path`, the data
+        file is recorded as a dependency of the template being rendered.
+
+        :param filename: the path of the data file, relative to searchpath.
+
+        :param key: Optional. The field identifying each record.
+        """
+        self.data_path(filename)
+        return self.data.index(filename, key)
+
+    def open_data(self, filename, mode='r'):
+        """Open a data file, recording it as a dependency of the template
+        being rendered (see :meth:`data_path`).
+
+        Text files are decoded using ``self.encoding``.
+
+        :param filename: the path of the data file, relative to searchpath.
+
+        :param mode: the mode to open the file with. Defaults to ``'r'``.
+        """
+        path = self.data_path(filename)
+        if 'b' in mode:
+            return io.open(path, mode)
+        return io.open(path, mode, encoding=self.encoding)
+
+    def record_deps(self, template_name, used):
+        """Record the templates used while rendering a template, and add
+        them to the dependency graph if there is one.
+
+        :param template_name: the name of the rendered template.
+
+        :param used: the names of the templates loaded during rendering.
+        """
+        used = set(used)
+        used.discard(template_name)
+        self.recorded_deps[template_name] = used
+        if self.dep_graph is not None and used:
+            self.dep_graph.add_parents(template_name, used)
+
+    def get_file_dep(self, filename, jinja_deps=None):
+        """Return a list of path of files which filename depends on.
+
+        :param filename: the name of the file.
+
+        :param jinja_deps: Optional. The templates referenced by *filename*,
+        if they are already known.
+        """
+        if jinja_deps is None:
+            jinja_deps = self.find_jinja_deps(filename)
         if self.extra_deps:
             extra_deps = self.extra_deps.get(filename, [])
         else:
             extra_deps = []
+        if self.is_template(filename):
+            context_deps = [datafile
+                            for _, context_generator
+                            in self._dispatch(filename)[0]
+                            if isinstance(context_generator,
+                                          (CachedContext, DataContext))
+                            for datafile in context_generator.datafiles]
+        else:
+            context_deps = []
+        recorded_deps = self.recorded_deps.get(filename, ())
 
-        return set(chain(jinja_deps, extra_deps))
+        return set(chain(jinja_deps, extra_deps, context_deps, recorded_deps))
 
     def __repr__(self):
         return "Site('%s', '%s')" % (self.searchpath, self.outpath)
@@ -412,6 +1427,17 @@ class Renderer(Site):
         return self.render(use_reloader)
 
 
+def _project_path():
+    """Return the directory of the main script, or the current directory if
+    there is none."""
+    # Much cheaper than walking the stack with inspect, which reads the
+    # source of every frame.
+    main_file = getattr(sys.modules.get('__main__'), '__file__', None)
+    if main_file is None:
+        return os.getcwd()
+    return os.path.realpath(os.path.dirname(main_file))
+
+
 def make_site(searchpath="templates",
               outpath=".",
               contexts=None,
@@ -423,7 +1449,15 @@ def make_site(searchpath="templates",
               extra_deps=None,
               filters=None,
               env_kwargs=None,
-              mergecontexts=False):
+              mergecontexts=False,
+              jobs=1,
+              incremental=False,
+              cachepath=None,
+              cache_size=None,
+              write_if_changed=False,
+              sink=None,
+              data_loaders=None,
+              data_cache_size=None):
     """Create a :class:`Site <Site>` object.
 
     :param searchpath:
@@ -431,9 +1465,11 @@ def make_site(searchpath="templates",
         should search to discover templates. Defaults to ``'templates'``.
 
         If a relative path is provided, it will be coerced to an absolute path
-        by prepending the directory name of the calling module. For example, if
+        by prepending the directory name of the main script. For example, if
         you invoke staticjinja using ``python build.py`` in directory ``/foo``,
-        then *searchpath* will be ``/foo/templates``.
+        then *searchpath* will be ``/foo/templates``. Without a main script,
+        for instance in an interactive session, the current directory is
+        used.
 
     :param outpath:
         A string representing the name of the directory that the Site
@@ -489,22 +1525,66 @@ def make_site(searchpath="templates",
         contexts list will be merged (in order) to get the final context.
         Otherwise, only the first matching regex is used. Defaults to
         ``False``.
+
+    :param jobs:
+        Number of processes used to render templates. Each worker is forked
+        from the building process and renders with its own copy of the
+        environment, contexts and rules. Defaults to ``1``.
+
+    :param incremental:
+        A boolean value. If set to ``True``, a build manifest is stored in
+        *outpath* and only templates whose source, dependencies or context
+        changed since the last build are rendered. Defaults to ``False``.
+
+    :param cachepath:
+        A string representing the directory used to persist compiled
+        templates and template dependencies between builds. Defaults to
+        ``None``, meaning templates are parsed and compiled again on each
+        run.
+
+    :param cache_size:
+        Maximal size of the compiled-template cache in bytes. The least
+        recently used templates are evicted first. Defaults to ``None``,
+        meaning no limit.
+
+    :param write_if_changed:
+        A boolean value. If set to ``True``, templates are rendered in memory
+        and their output file is only replaced, atomically, if its content
+        changed. Unchanged outputs keep their modification time. Defaults to
+        ``False``.
+
+    :param sink:
+        A :class:`Sink <staticjinja.sinks.Sink>` receiving the rendered
+        templates and static files, for instance a
+        :class:`TarSink <staticjinja.sinks.TarSink>` to write the site
+        directly into an archive. Defaults to writing into *outpath*.
+
+    :param data_loaders:
+        A dictionary mapping file extensions (such as ``'.ini'``) to
+        functions taking the path of a data file and an encoding and
+        returning its parsed content. They are added to the default JSON,
+        JSON Lines, CSV, YAML and TOML loaders used by
+        :meth:`Site.load_data`. Defaults to ``None``.
+
+    :param data_cache_size:
+        Maximal total size in bytes of the data files whose parsed content is
+        cached. The least recently used files are dropped first. Defaults to
+        ``None``, meaning no limit.
     """
     # Coerce search to an absolute path if it is not already
     if not os.path.isabs(searchpath):
-        # TODO: Determine if there is a better way to write do this
-        calling_module = inspect.getmodule(inspect.stack()[-1][0])
-        # Absolute path to project
-        project_path = os.path.realpath(os.path.dirname(
-            calling_module.__file__))
-        searchpath = os.path.join(project_path, searchpath)
+        searchpath = os.path.join(_project_path(), searchpath)
 
     if env_kwargs is None:
         env_kwargs = {}
     env_kwargs['loader'] = FileSystemLoader(searchpath=searchpath,
                                             encoding=encoding)
     env_kwargs.setdefault('extensions', extensions or [])
-    environment = Environment(**env_kwargs)
+    if cachepath is not None:
+        env_kwargs.setdefault(
+            'bytecode_cache',
+            TemplateCache(os.path.join(cachepath, 'templates'), cache_size))
+    environment = TrackingEnvironment(**env_kwargs)
     if filters:
         for k, v in filters.items():
             environment.filters[k] = v
@@ -523,6 +1603,13 @@ def make_site(searchpath="templates",
                 datapaths=datapaths,
                 extra_deps=extra_deps,
                 mergecontexts=mergecontexts,
+                jobs=jobs,
+                incremental=incremental,
+                write_if_changed=write_if_changed,
+                cachepath=cachepath,
+                sink=sink,
+                data_loaders=data_loaders,
+                data_cache_size=data_cache_size,
                 )
 
 
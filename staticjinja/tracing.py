@@ -0,0 +1,145 @@
+# -*- coding:utf-8 -*-
+
+"""
+Timeline of a build in the Chrome trace event format
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import threading
+
+from contextlib import contextmanager
+
+from .profiling import _clock
+
+
+class TraceRecorder(object):
+    """
+    Records a timeline of a build as spans, which can be opened in
+    ``chrome://tracing`` or `Perfetto <https://ui.perfetto.dev>`_ to see
+    where time goes: scanning sources, building the dependency graph,
+    generating contexts, loading, rendering and writing each template, and
+    copying each static file. Each thread and each worker process gets its
+    own lane.
+
+    Pass it to :meth:`Site.render <staticjinja.Site.render>` or to the
+    :class:`Reloader <staticjinja.Reloader>`.
+
+    :param path:
+        Optional. The path of the JSON trace file, written when the build
+        ends or, in watch mode, after each batch of changes.
+
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.pid = os.getpid()
+        self.events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Forget the recorded spans."""
+        with self._lock:
+            self.events = []
+
+    def add(self, name, category, start, duration, args=None):
+        """Record a span of the current thread.
+
+        :param name: the name of the span.
+
+        :param category: its category, for instance ``'template'``.
+
+        :param start: its start, in seconds, as given by the profiling clock.
+
+        :param duration: its duration, in seconds.
+
+        :param args: Optional. A dictionary of details shown with the span.
+        """
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': duration * 1e6,
+            'pid': os.getpid(),
+            'tid': thread.ident,
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+            self._threads[(event['pid'], event['tid'])] = thread.name
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """Context manager recording its block as a span, see :meth:`add`."""
+        start = _clock()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, _clock() - start, args)
+
+    def timed(self, phase, template_name=None, generator=None):
+        """Context manager recording a phase of the build, with the same
+        arguments as :meth:`BuildProfile.timed
+        <staticjinja.profiling.BuildProfile.timed>`."""
+        if template_name is None:
+            return self.span(phase, 'build')
+        args = {'template': template_name}
+        if generator is not None:
+            args['generator'] = generator
+        return self.span('%s %s' % (phase, template_name), phase, **args)
+
+    def timings(self):
+        """Return the recorded spans, in a form :meth:`merge` accepts."""
+        with self._lock:
+            return list(self.events), dict(self._threads)
+
+    def merge(self, data):
+        """Add the spans recorded by another recorder, for instance in a
+        worker process.
+
+        :param data: the result of :meth:`timings` of the other recorder.
+        """
+        events, threads = data
+        with self._lock:
+            self.events.extend(events)
+            self._threads.update(threads)
+
+    def start(self):
+        """Start recording a build."""
+
+    def stop(self):
+        """Stop recording a build, and write the trace if :attr:`path` is
+        set."""
+        if self.path:
+            self.save(self.path)
+
+    def as_dict(self):
+        """Return the trace as a dictionary which can be dumped to JSON."""
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        metadata = []
+        for pid in sorted(set(pid for pid, _ in threads)):
+            name = ('staticjinja' if pid == self.pid
+                    else 'staticjinja worker %d' % pid)
+            metadata.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                             'tid': 0, 'args': {'name': name}})
+        for (pid, tid), name in sorted(threads.items()):
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                             'tid': tid, 'args': {'name': name}})
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        """Write the trace to a JSON file.
+
+        :param path: the path of the file.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.as_dict(), f)
+        os.rename(tmp_path, path)
@@ -0,0 +1,62 @@
+# -*- coding:utf-8 -*-
+
+"""
+Record which templates are used while rendering
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+from contextlib import contextmanager
+
+from jinja2 import Environment
+
+
+class TrackingEnvironment(Environment):
+    """
+    A :class:`jinja2.Environment` which can record the names of the templates
+    it loads, including the ones loaded through dynamic includes such as
+    ``{% include page.layout %}`` which can't be found by parsing templates.
+
+    Recording is per thread, and also sees templates which are already in the
+    environment cache.
+    """
+    def __init__(self, *args, **kwargs):
+        super(TrackingEnvironment, self).__init__(*args, **kwargs)
+        self._tracking = threading.local()
+
+    def _load_template(self, name, globals):
+        recording = getattr(self._tracking, 'stack', None)
+        if recording and isinstance(name, str):
+            recording[-1].add(name)
+        return super(TrackingEnvironment, self)._load_template(name, globals)
+
+    def record(self, name):
+        """Record that *name* (a template or data file) is used by the
+        current recording, if any.
+
+        :param name: the name of the file, relative to the searchpath.
+        """
+        recording = getattr(self._tracking, 'stack', None)
+        if recording:
+            recording[-1].add(name)
+
+    @contextmanager
+    def track(self):
+        """Context manager giving the set of names of the templates loaded
+        in the current thread until it exits.
+        """
+        stack = getattr(self._tracking, 'stack', None)
+        if stack is None:
+            stack = self._tracking.stack = []
+        used = set()
+        stack.append(used)
+        try:
+            yield used
+        finally:
+            stack.pop()
+            if stack:
+                # Templates used by a nested recording are used by the outer
+                # one as well.
+                stack[-1].update(used)
@@ -0,0 +1,558 @@
+# -*- coding:utf-8 -*-
+
+"""
+Filesystem watchers for the reloader
+"""
+
+from __future__ import absolute_import
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+
+class Watcher(object):
+    """
+    Base class for the filesystem watchers used by the
+    :class:`Reloader <Reloader>`.
+
+    A watcher calls *callback* with the type of each event (``'created'``,
+    ``'modified'``, ``'deleted'`` or ``'moved'``) and the absolute path of the
+    file. For ``'moved'`` events, the new path of the file is passed as a
+    third argument. Events on directories are not reported.
+
+    :param path:
+        The directory to watch, recursively.
+
+    :param callback:
+        The function to call on each event.
+
+    """
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        self._stopped = False
+
+    @classmethod
+    def is_available(cls):
+        """Check whether this watcher can be used on this platform."""
+        return True
+
+    def run(self):
+        """Watch the directory until :meth:`stop` is called or the user
+        presses Ctrl+C."""
+        raise NotImplementedError
+
+    def stop(self):
+        """Stop watching."""
+        self._stopped = True
+
+
+class EasywatchWatcher(Watcher):
+    """A watcher using the ``easywatch`` package, based on ``watchdog``."""
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import easywatch  # noqa
+        except ImportError:
+            return False
+        return True
+
+    def run(self):
+        import easywatch
+        easywatch.watch(self.path, self.callback)
+
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+_EVENT_HEADER = struct.Struct('iIII')
+_libc = None
+
+
+def _load_libc():
+    """Return the C library if it provides inotify, or ``None``."""
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or
+                                   'libc.so.6', use_errno=True)
+                libc.inotify_init1
+            except (OSError, AttributeError):
+                pass
+            else:
+                libc.inotify_add_watch.argtypes = [
+                    ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                _libc = libc
+    return _libc or None
+
+
+class InotifyWatcher(Watcher):
+    """
+    A watcher using the Linux inotify API directly through :mod:`ctypes`.
+
+    Every directory of the tree gets a single watch, added by one
+    ``os.scandir`` walk. Directories created or moved into the tree later
+    are watched as they appear. Renames inside the tree are reported as
+    ``'moved'`` events, files moved out of the tree as ``'deleted'`` events
+    and files moved into it as ``'created'`` events. The names of the files
+    of each directory are kept, so that moving a directory reports an event
+    for each of its files.
+
+    If the kernel event queue overflows, the tree is scanned again: files
+    which appeared or disappeared are reported as created or deleted, and
+    the other files as modified, since their changes may have been lost.
+
+    The number of watches is limited by
+    ``/proc/sys/fs/inotify/max_user_watches``.
+    """
+    mask = (IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_DONT_FOLLOW | IN_ONLYDIR)
+
+    def __init__(self, path, callback):
+        super(InotifyWatcher, self).__init__(path, callback)
+        self._fd = None
+        # Watch descriptor -> directory path, and the reverse.
+        self._paths = {}
+        self._wds = {}
+        # Directory path -> names of the files in it.
+        self._files = {}
+
+    @classmethod
+    def is_available(cls):
+        return scandir is not None and _load_libc() is not None
+
+    def _add_watch(self, path):
+        """Watch a single directory."""
+        wd = _load_libc().inotify_add_watch(
+            self._fd, os.fsencode(path), self.mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "Too many directories to watch, raise "
+                              "/proc/sys/fs/inotify/max_user_watches")
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                # Removed in the meantime.
+                return
+            raise OSError(err, os.strerror(err), path)
+        self._paths[wd] = path
+        self._wds[path] = wd
+        self._files.setdefault(path, set())
+
+    def _add_tree(self, top, report=False):
+        """Watch *top* and all the directories below it.
+
+        :param top: the directory to watch.
+
+        :param report: if ``True``, report the files found as created. This
+        catches files created before the watch on their directory was added.
+        """
+        self._add_watch(top)
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    self._add_watch(entry.path)
+                    stack.append(entry.path)
+                else:
+                    self._files.setdefault(directory, set()).add(entry.name)
+                    if report:
+                        self.callback('created', entry.path)
+
+    def _subtree(self, top):
+        """Return the sorted known directories of the tree below *top*."""
+        prefix = top + os.sep
+        return sorted(path for path in self._files
+                      if path == top or path.startswith(prefix))
+
+    def _forget_tree(self, top):
+        """Forget the watches of a directory which was moved or removed,
+        reporting its files as deleted."""
+        for path in self._subtree(top):
+            wd = self._wds.pop(path, None)
+            if wd is not None:
+                self._paths.pop(wd, None)
+            for name in sorted(self._files.pop(path)):
+                self.callback('deleted', os.path.join(path, name))
+
+    def _rename_tree(self, src, dest):
+        """Update the paths of the watches of a directory moved inside the
+        tree, reporting its files as moved."""
+        for path in self._subtree(src):
+            new_path = dest + path[len(src):]
+            wd = self._wds.pop(path, None)
+            if wd is not None:
+                self._wds[new_path] = wd
+                self._paths[wd] = new_path
+            files = self._files[new_path] = self._files.pop(path)
+            for name in sorted(files):
+                self.callback('moved', os.path.join(path, name),
+                              os.path.join(new_path, name))
+
+    def _file_added(self, path):
+        directory, name = os.path.split(path)
+        self._files.setdefault(directory, set()).add(name)
+
+    def _file_removed(self, path):
+        directory, name = os.path.split(path)
+        self._files.get(directory, set()).discard(name)
+
+    def _read_events(self):
+        """Yield ``(mask, cookie, path)`` for the events available."""
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            directory = self._paths.get(wd)
+            if directory is None:
+                continue
+            path = directory
+            if name:
+                path = os.path.join(directory, os.fsdecode(name))
+            yield mask, cookie, path
+
+    def _handle(self, events):
+        """Translate a list of raw inotify events into callbacks."""
+        moved_from = {}
+        for mask, cookie, path in events:
+            is_dir = mask & IN_ISDIR
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost: rescan everything.
+                self._rescan()
+            elif mask & IN_MOVED_FROM:
+                moved_from[cookie] = (path, is_dir)
+            elif mask & IN_MOVED_TO:
+                src = moved_from.pop(cookie, None)
+                if src is None:
+                    # Moved into the tree.
+                    if is_dir:
+                        self._add_tree(path, report=True)
+                    else:
+                        self._file_added(path)
+                        self.callback('created', path)
+                elif is_dir:
+                    self._rename_tree(src[0], path)
+                else:
+                    self._file_removed(src[0])
+                    self._file_added(path)
+                    self.callback('moved', src[0], path)
+            elif mask & IN_CREATE:
+                if is_dir:
+                    self._add_tree(path, report=True)
+                else:
+                    self._file_added(path)
+                    self.callback('created', path)
+            elif mask & IN_DELETE:
+                if is_dir:
+                    self._forget_tree(path)
+                else:
+                    self._file_removed(path)
+                    self.callback('deleted', path)
+            elif mask & IN_CLOSE_WRITE:
+                self._file_added(path)
+                self.callback('modified', path)
+        # Moved out of the tree.
+        for path, is_dir in moved_from.values():
+            if is_dir:
+                self._forget_tree(path)
+            else:
+                self._file_removed(path)
+                self.callback('deleted', path)
+
+    def _known_files(self):
+        """Return the set of the paths of the known files."""
+        return set(os.path.join(directory, name)
+                   for directory, names in self._files.items()
+                   for name in names)
+
+    def _rescan(self):
+        """Scan the tree again after events were lost, and report the
+        differences."""
+        old = self._known_files()
+        self._paths.clear()
+        self._wds.clear()
+        self._files.clear()
+        self._add_tree(self.path)
+        new = self._known_files()
+        for path in sorted(new - old):
+            self.callback('created', path)
+        for path in sorted(old - new):
+            self.callback('deleted', path)
+        for path in sorted(old & new):
+            self.callback('modified', path)
+
+    def run(self):
+        libc = _load_libc()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        try:
+            self._add_tree(self.path)
+            poller = select.poll()
+            poller.register(self._fd, select.POLLIN)
+            while not self._stopped:
+                if poller.poll(500):
+                    self._handle(list(self._read_events()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class PollingWatcher(Watcher):
+    """
+    A watcher comparing snapshots of the tree every *interval* seconds, for
+    filesystems which don't report events, such as NFS or some container bind
+    mounts.
+
+    The snapshot only keeps the inode, modification time and size of each
+    file. A directory is only listed again when its own modification time
+    changed, which happens when entries are added, removed or renamed in it.
+    Otherwise only the files already known in it are checked, so no
+    ``os.scandir`` call is made on unchanged directories.
+
+    :param path:
+        The directory to watch, recursively.
+
+    :param callback:
+        The function to call on each event.
+
+    :param interval:
+        Number of seconds between two snapshots. Defaults to ``1``.
+
+    :param full_scan_interval:
+        Optional. If given, files in unchanged directories are only checked
+        every *full_scan_interval* seconds, and the other snapshots only
+        check directories. This makes polling very large trees cheap, but
+        files modified in place (not replaced by a rename) are only noticed
+        at the next full scan. Defaults to ``None``, checking every file at
+        each snapshot.
+
+    """
+    def __init__(self, path, callback, interval=1, full_scan_interval=None):
+        super(PollingWatcher, self).__init__(path, callback)
+        self.interval = interval
+        self.full_scan_interval = full_scan_interval
+        # Directory path -> (mtime, {file name: (inode, mtime, size)},
+        #                    set of subdirectory names)
+        self.snapshot = {}
+        self._last_full_scan = 0
+
+    @classmethod
+    def is_available(cls):
+        return scandir is not None
+
+    @staticmethod
+    def _stat_key(st):
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _list(self, directory):
+        """Snapshot the entries of a single directory."""
+        st = os.stat(directory)
+        files = {}
+        subdirs = set()
+        for entry in scandir(directory):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.add(entry.name)
+                else:
+                    files[entry.name] = self._stat_key(entry.stat())
+            except OSError:
+                # Removed in the meantime.
+                pass
+        return st.st_mtime_ns, files, subdirs
+
+    def _add_tree(self, top, created):
+        """Snapshot *top* and its subdirectories.
+
+        :param top: the directory to snapshot.
+
+        :param created: a list collecting ``(path, key)`` for the files
+        found, or ``None``.
+        """
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            try:
+                entry = self.snapshot[directory] = self._list(directory)
+            except OSError:
+                continue
+            if created is not None:
+                created.extend((os.path.join(directory, name), key)
+                               for name, key in entry[1].items())
+            stack.extend(os.path.join(directory, name) for name in entry[2])
+
+    def _remove_tree(self, top, deleted):
+        """Forget *top* and its subdirectories, collecting ``(path, key)``
+        for their files in *deleted*."""
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            entry = self.snapshot.pop(directory, None)
+            if entry is None:
+                continue
+            deleted.extend((os.path.join(directory, name), key)
+                           for name, key in entry[1].items())
+            stack.extend(os.path.join(directory, name) for name in entry[2])
+
+    def scan(self):
+        """Take the initial snapshot."""
+        self.snapshot = {}
+        self._add_tree(self.path, None)
+        self._last_full_scan = time.time()
+
+    def poll(self):
+        """Compare the tree with the snapshot, report the differences and
+        update the snapshot."""
+        now = time.time()
+        check_files = (self.full_scan_interval is None or
+                       now - self._last_full_scan >= self.full_scan_interval)
+        if check_files:
+            self._last_full_scan = now
+        created = []
+        deleted = []
+        modified = []
+        for directory in sorted(self.snapshot):
+            old = self.snapshot.get(directory)
+            if old is None:
+                # Removed with its parent during this poll.
+                continue
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                self._remove_tree(directory, deleted)
+                continue
+            if mtime == old[0]:
+                if check_files:
+                    self._check_files(directory, old[1], deleted, modified)
+                continue
+            try:
+                new = self._list(directory)
+            except OSError:
+                self._remove_tree(directory, deleted)
+                continue
+            self.snapshot[directory] = new
+            for name, key in old[1].items():
+                path = os.path.join(directory, name)
+                if name not in new[1]:
+                    deleted.append((path, key))
+                elif new[1][name] != key:
+                    modified.append(path)
+            created.extend((os.path.join(directory, name), new[1][name])
+                           for name in new[1] if name not in old[1])
+            for name in old[2] - new[2]:
+                self._remove_tree(os.path.join(directory, name), deleted)
+            for name in new[2] - old[2]:
+                self._add_tree(os.path.join(directory, name), created)
+        self._report(created, deleted, modified)
+
+    def _check_files(self, directory, files, deleted, modified):
+        """Check the known files of an unchanged directory."""
+        for name, key in list(files.items()):
+            path = os.path.join(directory, name)
+            try:
+                new_key = self._stat_key(os.stat(path))
+            except OSError:
+                # Can't happen without changing the directory mtime, but
+                # some filesystems have a coarse mtime.
+                del files[name]
+                deleted.append((path, key))
+                continue
+            if new_key != key:
+                files[name] = new_key
+                modified.append(path)
+
+    def _report(self, created, deleted, modified):
+        """Call the callback, pairing deleted and created files with the
+        same inode into moves."""
+        deleted_inodes = dict((key[0], path) for path, key in deleted)
+        moved = set()
+        for path, key in created:
+            src = deleted_inodes.pop(key[0], None)
+            if src is not None:
+                moved.add(src)
+                self.callback('moved', src, path)
+            else:
+                self.callback('created', path)
+        for path, _ in deleted:
+            if path not in moved:
+                self.callback('deleted', path)
+        for path in modified:
+            self.callback('modified', path)
+
+    def run(self):
+        self.scan()
+        try:
+            while not self._stopped:
+                time.sleep(self.interval)
+                self.poll()
+        except KeyboardInterrupt:
+            pass
+
+
+#: Watchers by name, in order of preference.
+WATCHERS = [
+    ('inotify', InotifyWatcher),
+    ('easywatch', EasywatchWatcher),
+    ('poll', PollingWatcher),
+]
+
+
+def get_watcher(name=None):
+    """Return a watcher class.
+
+    :param name: Optional. The name of the watcher (see :data:`WATCHERS`).
+    Defaults to the first watcher available on this platform.
+    """
+    if name is None:
+        for _, watcher in WATCHERS:
+            if watcher.is_available():
+                return watcher
+        raise ValueError("no available watcher")
+    for watcher_name, watcher in WATCHERS:
+        if watcher_name == name:
+            return watcher
+    raise ValueError("unknown watcher: %s" % name)
@@ -2,12 +2,31 @@ try:
     import unittest.mock as mock
 except ImportError:
     import mock
-from pytest import fixture, raises
+from pytest import fixture, mark, raises
+
+import os
+import sys
+import threading
+import time
 
 from copy import deepcopy
 
-from staticjinja import cli, make_site, Reloader, DepGraph
+from jinja2 import TemplateSyntaxError
+
+from staticjinja import cli, make_site, CachedContext, Reloader, DepGraph
+from staticjinja import DataContext
+from staticjinja.cache import TemplateCache
+from staticjinja.data import DataCache
+from staticjinja.records import RecordIndex
+from staticjinja.reloader import RenderWorker
+import staticjinja.sources
 import staticjinja.staticjinja
+from staticjinja.manifest import Manifest
+from staticjinja.profiling import BuildProfile
+from staticjinja.server import DevServer
+from staticjinja.sinks import MemorySink, TarSink, ZipSink
+from staticjinja.tracing import TraceRecorder
+from staticjinja.watchers import InotifyWatcher, PollingWatcher, get_watcher
 
 
 @fixture
@@ -198,6 +217,57 @@ def test_template_names(site):
     assert set(site.template_names) == expected_templates
 
 
+def test_source_tree_matches_jinja(site):
+    for kind, names in [('template', site.template_names),
+                        ('static', site.static_names),
+                        ('data', site.data_names),
+                        ('jinja', site.jinja_names)]:
+        predicate = getattr(site, 'is_' + kind)
+        assert names == site._env.list_templates(filter_func=predicate)
+
+
+def test_source_tree_scanned_once(site, monkeypatch):
+    mock_walk = mock.Mock(wraps=staticjinja.sources._walk)
+    monkeypatch.setattr(staticjinja.sources, '_walk', mock_walk)
+    site.sources.scan()
+    site.template_names
+    site.static_names
+    DepGraph(site)
+    top_calls = [c for c in mock_walk.call_args_list
+                 if c[0][0] == site.searchpath]
+    assert len(top_calls) == 1
+
+
+def test_source_tree_copies(site):
+    site.template_names.append('nope.html')
+    site.static_names.remove('favicon.ico')
+    assert 'nope.html' not in site.template_names
+    assert 'favicon.ico' in site.static_names
+
+
+def test_source_tree_other_loader(tmpdir):
+    from jinja2 import DictLoader
+    env = staticjinja.staticjinja.TrackingEnvironment(loader=DictLoader({
+        'index.html': 'Index', '_base.html': 'Base'}))
+    site = staticjinja.staticjinja.Site(env, str(tmpdir), str(tmpdir),
+                                        'utf8', mock.Mock())
+    assert site.template_names == ['index.html']
+    assert site.jinja_names == ['_base.html', 'index.html']
+
+
+def test_source_tree_events(reloader, template_path):
+    site = reloader.site
+    template_path.join('template6.html').write('Template 6')
+    reloader.event_handler("created",
+                           str(template_path.join('template6.html')))
+    assert 'template6.html' in site.template_names
+    template_path.join('template6.html').remove()
+    reloader.event_handler("deleted",
+                           str(template_path.join('template6.html')))
+    assert 'template6.html' not in site.template_names
+    assert 'template6.html' not in site.jinja_names
+
+
 def test_templates(site):
     expected = list(site.template_names)
     assert [t.name for t in site.templates] == expected
@@ -220,6 +290,216 @@ def test_get_context(site):
     ) == {'b': 4, 'c': 6}
 
 
+def test_get_context_after_contexts_change(site):
+    template4 = site.get_template("template4.html")
+    assert site.get_context(template4) == {'b': 4, 'c': 5}
+    site.contexts = [('.*4.html', lambda: {'d': 7})]
+    assert site.get_context(template4) == {'d': 7}
+    site.rules = [('.*4.html', lambda env, t: None)]
+    assert site.get_rule("template4.html")
+    # Changes made in place are picked up too.
+    site.contexts.insert(0, ('.*4.html', {'e': 8}))
+    assert site.get_context(template4) == {'e': 8}
+    site.contexts[0] = ('.*4.html', {'f': 9})
+    assert site.get_context(template4) == {'f': 9}
+    site.rules.pop()
+    with raises(ValueError):
+        site.get_rule("template4.html")
+
+
+def test_cached_context(site):
+    calls = []
+    loads = []
+
+    def load():
+        calls.append(None)
+        loads.append(None)
+        return {'d': len(loads)}
+
+    def per_template(template):
+        calls.append(template.name)
+        return {'name': template.name}
+
+    site.contexts = [('template1.html', CachedContext(per_template)),
+                     ('.*', CachedContext(load, ['data/data3']))]
+    site.mergecontexts = True
+    template1 = site.get_template("template1.html")
+    template4 = site.get_template("template4.html")
+    assert site.get_context(template1) == {'name': 'template1.html', 'd': 1}
+    assert site.get_context(template1) == {'name': 'template1.html', 'd': 1}
+    assert site.get_context(template4) == {'d': 1}
+    assert calls == ['template1.html', None]
+
+    assert site.invalidate_contexts('data1') == 0
+    assert site.invalidate_contexts('data/data3') == 1
+    assert site.get_context(template4) == {'d': 2}
+
+    # A result generated while the data changed is not cached.
+    def load_during_change():
+        loads.append(None)
+        if len(loads) == 3:
+            site.invalidate_contexts('data/data3')
+        return {'d': len(loads)}
+
+    site.contexts = [('.*', CachedContext(load_during_change,
+                                          ['data/data3']))]
+    assert site.get_context(template4) == {'d': 3}
+    assert site.get_context(template4) == {'d': 4}
+    assert site.get_context(template4) == {'d': 4}
+
+
+def test_cached_context_deps(site, template_path):
+    site.contexts = [('template1.html',
+                      CachedContext(lambda: {}, ['data/data3']))]
+    assert 'data/data3' in site.get_file_dep('template1.html')
+
+    reloader = Reloader(site)
+    mock_render_templates = mock.Mock()
+    site.render_templates = mock_render_templates
+    cached = site.contexts[0][1]
+    cached(site.get_template('template1.html'))
+    reloader.event_handler("modified",
+                           str(template_path.join('data', 'data3')))
+    assert cached._cache == {}
+    assert 'template1.html' in set(mock_render_templates.call_args[0][0])
+
+
+def test_data_cache(tmpdir):
+    tmpdir.join('a.json').write('{"a": [1, 2]}')
+    tmpdir.join('b.csv').write('name,price\nfoo,1\nbar,2\n')
+    tmpdir.join('c.toml').write('title = "C"\n')
+    tmpdir.join('d.yml').write('- d\n')
+    tmpdir.join('e.jsonl').write('{"e": 1}\n\n{"e": 2}\n')
+    tmpdir.join('f.txt').write('F')
+    cache = DataCache(str(tmpdir), loaders={'.txt': lambda path, enc:
+                                            open(path).read()})
+    a = cache.load('a.json')
+    assert a == {'a': [1, 2]}
+    assert cache.load('a.json') is a
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.load('b.csv') == [{'name': 'foo', 'price': '1'},
+                                   {'name': 'bar', 'price': '2'}]
+    assert cache.load('c.toml') == {'title': 'C'}
+    assert cache.load('d.yml') == ['d']
+    assert cache.load('e.jsonl') == [{'e': 1}, {'e': 2}]
+    assert cache.load('f.txt') == 'F'
+    with raises(ValueError):
+        cache.load('data1')
+
+    # A modified file is parsed again.
+    tmpdir.join('a.json').write('{"a": [3]}')
+    os.utime(str(tmpdir.join('a.json')), (0, 0))
+    assert cache.load('a.json') == {'a': [3]}
+    assert cache.invalidate('a.json')
+    assert not cache.invalidate('a.json')
+
+    # The least recently used files are dropped to stay under max_size.
+    cache = DataCache(str(tmpdir), max_size=50)
+    cache.load('a.json')
+    cache.load('b.csv')
+    cache.load('a.json')
+    cache.load('e.jsonl')
+    assert 'a.json' in cache and 'e.jsonl' in cache
+    assert 'b.csv' not in cache
+    assert cache.size <= 50
+
+
+def test_data_context(site, template_path):
+    template_path.join('data', 'items.json').write('["x", "y"]')
+    template_path.join('template5.html').write(
+        '{{ load_data("data/items.json")|join(",") }}')
+    site.contexts = [('template4.html', DataContext(b='data/items.json'))]
+    assert 'data/items.json' in site.get_file_dep('template4.html')
+    site.render_templates(['template4.html', 'template5.html'])
+    assert site.recorded_deps['template5.html'] == set(['data/items.json'])
+    assert 'data/items.json' in site.data
+
+    reloader = Reloader(site)
+    mock_render_templates = mock.Mock()
+    site.render_templates = mock_render_templates
+    reloader.event_handler("modified",
+                           str(template_path.join('data', 'items.json')))
+    assert 'data/items.json' not in site.data
+    assert set(mock_render_templates.call_args[0][0]) >= set(
+        ['template4.html', 'template5.html'])
+
+
+def test_record_index(tmpdir):
+    path = str(tmpdir.join('items.jsonl'))
+    tmpdir.join('items.jsonl').write(
+        '{"sku": "a", "n": 1}\n\n{"sku": 2, "n": 2}\n{"sku": "a", "n": 3}')
+    index = RecordIndex(path, key='sku')
+    assert len(index) == 3
+    assert index.at(1) == {'sku': 2, 'n': 2}
+    assert index[2] == {'sku': 2, 'n': 2}
+    assert index['a'] == {'sku': 'a', 'n': 3}
+    assert index.get('b') is None
+    assert sorted(index.keys(), key=str) == [2, 'a']
+    index.close()
+
+    path = str(tmpdir.join('items.csv'))
+    tmpdir.join('items.csv').write(
+        'id,text\n1,"two\nlines"\n2,"with ""quotes"""\n')
+    indexpath = str(tmpdir.join('idx'))
+    index = RecordIndex(path, key='id', indexpath=indexpath)
+    assert index['1'] == {'id': '1', 'text': 'two\nlines'}
+    assert index['2'] == {'id': '2', 'text': 'with "quotes"'}
+    with raises(TypeError):
+        RecordIndex(path)['1']
+
+    # The saved index is reused while the file is unchanged.
+    with mock.patch.object(RecordIndex, '_build') as mock_build:
+        index = RecordIndex(path, key='id', indexpath=indexpath)
+        assert not mock_build.called
+    assert index['2']['text'] == 'with "quotes"'
+    tmpdir.join('items.csv').write('3,three\n', mode='a')
+    index = RecordIndex(path, key='id', indexpath=indexpath)
+    assert index['3'] == {'id': '3', 'text': 'three'}
+
+    # A quote inside an unquoted field doesn't open a quoted field.
+    tmpdir.join('items.csv').write('id,text\n1,12" pipe\n2,"a, b"\n')
+    index = RecordIndex(path, key='id')
+    assert len(index) == 2
+    assert index['1'] == {'id': '1', 'text': '12" pipe'}
+    assert index['2'] == {'id': '2', 'text': 'a, b'}
+
+    tmpdir.join('items.csv').write('text\nnone\n')
+    with raises(ValueError) as excinfo:
+        RecordIndex(path, key='id')
+    assert 'line 2' in str(excinfo.value)
+
+
+def test_record_index_duplicate_keys(tmpdir):
+    path = str(tmpdir.join('items.jsonl'))
+    tmpdir.join('items.jsonl').write(
+        '{"id": 1, "n": 1}\n{"id": 2, "n": 2}\n'
+        '{"id": 1, "n": 3}\n{"id": 3, "n": 4}\n')
+    indexpath = str(tmpdir.join('idx'))
+    RecordIndex(path, key='id', indexpath=indexpath)
+    with mock.patch.object(RecordIndex, '_build') as mock_build:
+        index = RecordIndex(path, key='id', indexpath=indexpath)
+        assert not mock_build.called
+    assert index[1] == {'id': 1, 'n': 3}
+    assert index[2] == {'id': 2, 'n': 2}
+    assert index[3] == {'id': 3, 'n': 4}
+
+
+def test_site_record_index(site, template_path):
+    template_path.join('data', 'items.jsonl').write('{"id": 1, "t": "x"}\n')
+    template_path.join('template5.html').write(
+        '{{ record_index("data/items.jsonl", "id")[1].t }}')
+    site.render_templates(['template5.html'])
+    assert site.recorded_deps['template5.html'] == set(['data/items.jsonl'])
+    index = site.record_index('data/items.jsonl', 'id')
+    assert site.record_index('data/items.jsonl', 'id') is index
+
+    reloader = Reloader(site)
+    site.render_templates = mock.Mock()
+    reloader.event_handler("modified",
+                           str(template_path.join('data', 'items.jsonl')))
+    assert site.record_index('data/items.jsonl', 'id') is not index
+
+
 def test_get_rule(site):
     with raises(ValueError):
         assert site.get_rule('template1.html')
@@ -231,6 +511,34 @@ def test_childrens(site, expected_children):
     assert site.dep_graph.children == expected_children
 
 
+def test_childrens_parallel(site, expected_children):
+    site.jobs = 2
+    assert DepGraph(site).children == expected_children
+
+
+def test_dep_graph_cache(site, template_path, tmpdir, expected_children,
+                         monkeypatch):
+    site.cachepath = str(tmpdir.join('cache'))
+    assert DepGraph(site).children == expected_children
+
+    parsed = []
+    real_find_jinja_deps = staticjinja.Site.find_jinja_deps
+
+    def find_jinja_deps(self, filename):
+        parsed.append(filename)
+        return real_find_jinja_deps(self, filename)
+
+    monkeypatch.setattr(staticjinja.Site, 'find_jinja_deps', find_jinja_deps)
+    assert DepGraph(site).children == expected_children
+    assert parsed == []
+
+    template_path.join('template4.html').write(
+        '{% include "_partial2.html" %}')
+    dep_graph = DepGraph(site)
+    assert parsed == ['template4.html']
+    assert 'template4.html' in dep_graph.children['_partial2.html']
+
+
 def test_get_dependencies(
         site,
         mock_dep_graph_init,
@@ -364,12 +672,48 @@ def test_update_dependencies_create_file(
     assert site.dep_graph.parents == new_expected_parents
 
     new_expected_children = deepcopy(expected_children)
-    new_expected_children.update(
-            {'data1': set(['_partial1.html', 'template5.html'])}
-            )
+    new_expected_children.update({
+            'data1': set(['_partial1.html', 'template5.html']),
+            'template5.html': set(),
+            })
     assert site.dep_graph.children == new_expected_children
 
 
+def test_dep_graph_from_parents(expected_parents, expected_children):
+    dep_graph = DepGraph.from_parents(expected_parents)
+    assert dep_graph.parents == expected_parents
+    assert dep_graph.children == expected_children
+    assert sorted(dep_graph.get_ancestors('template1.html')) == [
+        '_partial1.html', '_partial2.html', 'data/data3', 'data1', 'data2',
+    ]
+
+
+def test_descendants_memoized_and_updated(
+        site, expected_parents, monkeypatch
+        ):
+    site.dep_graph = DepGraph.from_parents(expected_parents, site)
+    descendants = site.dep_graph.get_descendants('data1')
+    assert descendants == ('_partial1.html', 'template1.html',
+                           'template2.html')
+    assert site.dep_graph.get_descendants('data1') is descendants
+
+    # template4.html now includes _partial1.html, which depends on data1
+    def update_file_dep(s, f):
+        if f == 'template4.html':
+            return set(['_partial1.html', 'data/data3'])
+        else:
+            return expected_parents[f]
+
+    monkeypatch.setattr(staticjinja.Site, 'get_file_dep', update_file_dep)
+    sub_descendants = site.dep_graph.get_descendants('sub/template3.html')
+    site.dep_graph.update('template4.html')
+    assert site.dep_graph.get_descendants('data1') == (
+        '_partial1.html', 'template1.html', 'template2.html',
+        'template4.html')
+    assert site.dep_graph.get_descendants(
+        'sub/template3.html') is sub_descendants
+
+
 def test_render_template(site, build_path):
     site.render_template(site.get_template('template1.html'))
     template1 = build_path.join("template1.html")
@@ -394,6 +738,219 @@ def test_render_templates(site, build_path):
     assert template3.read() == "Test 3\nPartial 2"
 
 
+def test_render_templates_parallel(site, build_path, tmpdir):
+    site.render_templates(site.template_names, jobs=2)
+    parallel = dict((f, build_path.join(f).read_binary())
+                    for f in site.template_names if f != 'template2.html')
+
+    serial_path = tmpdir.mkdir("serial")
+    site.outpath = str(serial_path)
+    site.render_templates(site.template_names)
+    for f, content in parallel.items():
+        assert serial_path.join(f).read_binary() == content
+
+
+def test_render_templates_parallel_error(site, template_path):
+    template_path.join('broken.html').write('{% if %}')
+    with raises(TemplateSyntaxError):
+        site.render_templates(['template1.html', 'broken.html'], jobs=2)
+
+
+def test_render_write_if_changed(site, template_path, build_path):
+    site.write_if_changed = True
+    site.render_templates(['template1.html', 'template4.html'])
+    assert site.output_stats == {'changed': 2, 'unchanged': 0}
+    template1 = build_path.join("template1.html")
+    assert template1.read() == "Partial 1\nTemplate 1"
+    template1.setmtime(0)
+
+    site.reset_output_stats()
+    site.render_templates(['template1.html', 'template4.html'], jobs=2)
+    assert site.output_stats == {'changed': 0, 'unchanged': 2}
+    assert template1.mtime() == 0
+
+    template_path.join('template1.html').write('New template 1')
+    site.reset_output_stats()
+    site.render_templates(['template1.html', 'template4.html'])
+    assert site.output_stats == {'changed': 1, 'unchanged': 1}
+    assert template1.read() == "New template 1"
+    assert [p.basename for p in build_path.listdir()
+            if p.basename.startswith('.staticjinja-')] == []
+
+
+def test_copy_static(site, template_path, build_path):
+    site.logger = mock.Mock()
+    site.copy_static(site.static_names, threads=2)
+    assert build_path.join('static_css', 'hello.css').read() == (
+        'a { color: blue; }')
+    assert build_path.join('favicon.ico').check()
+    site.logger.info.assert_called_with(
+        "Copied 3 static files (64 bytes), skipped 0 unchanged files "
+        "(0 bytes).")
+
+    with mock.patch('multiprocessing.pool.ThreadPool') as mock_pool:
+        mock_pool.return_value.map.side_effect = (
+            lambda func, items: [func(item) for item in items])
+        site.copy_static(site.static_names)
+    assert mock_pool.call_args[0][0] == 3
+    site.logger.info.assert_called_with(
+        "Copied 0 static files (0 bytes), skipped 3 unchanged files "
+        "(64 bytes).")
+
+    template_path.join('favicon.ico').write('New favicon!')
+    site.copy_static(site.static_names, compare='hash')
+    assert build_path.join('favicon.ico').read() == 'New favicon!'
+    site.logger.info.assert_called_with(
+        "Copied 1 static files (12 bytes), skipped 2 unchanged files "
+        "(52 bytes).")
+
+
+def test_memory_sink(site, build_path):
+    site.sink = MemorySink()
+    site.render(jobs=2)
+    assert sorted(site.sink.files) == [
+        'favicon.ico', 'static_css/hello.css', 'static_js/hello.js',
+        'sub/template3.html', 'template1.html', 'template4.html']
+    assert site.sink.files['template4.html'] == b'Template 4 and 5'
+    assert build_path.listdir() == []
+
+
+def test_archive_sinks(site, build_path, tmpdir):
+    import tarfile
+    import zipfile
+
+    with TarSink(str(tmpdir.join('site.tar.gz')), 'gz') as site.sink:
+        site.render()
+    with tarfile.open(str(tmpdir.join('site.tar.gz'))) as tar:
+        assert tar.extractfile('sub/template3.html').read() == (
+            b'Test 3\nPartial 2')
+        assert len(tar.getnames()) == 6
+
+    with ZipSink(str(tmpdir.join('site.zip'))) as site.sink:
+        site.render(jobs=2)
+    with zipfile.ZipFile(str(tmpdir.join('site.zip'))) as archive:
+        assert archive.read('static_css/hello.css') == b'a { color: blue; }'
+        assert len(archive.namelist()) == 6
+    assert build_path.listdir() == []
+
+
+def test_render_profile(site, tmpdir):
+    import json
+
+    report = str(tmpdir.join('profile.json'))
+    profile = BuildProfile(report, cprofile=True)
+    site.render(profile=profile)
+    assert site.profile is None
+    assert sorted(profile.templates) == sorted(site.template_names)
+    assert set(profile.templates['template4.html']) == set(
+        ['load', 'render', 'write'])
+    assert set(profile.templates['template2.html']) == set(
+        ['load', 'context', 'rule'])
+    contexts = sorted(name for name, _, _ in profile.slowest_contexts())
+    assert len(contexts) == 2
+    assert contexts[0].startswith('test_staticjinja.site.<locals>.<lambda>:')
+    assert set(profile.build) == set(['scan', 'render', 'static'])
+    with open(report) as f:
+        data = json.load(f)
+    assert set(data['templates']) == set(site.template_names)
+    assert data['functions']
+    assert tmpdir.join('profile.prof').check()
+
+    profile = BuildProfile()
+    site.render(jobs=2, profile=profile)
+    assert sorted(profile.templates) == sorted(site.template_names)
+    assert sorted(profile.contexts) == contexts
+
+
+def test_render_trace(site, tmpdir, template_path):
+    import json
+
+    path = str(tmpdir.join('trace.json'))
+    trace = TraceRecorder(path)
+    site.render(jobs=2, trace=trace)
+    assert site.trace is None
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    spans = [event for event in events if event['ph'] == 'X']
+    names = set(event['name'] for event in spans)
+    assert set(['scan', 'render', 'static']) <= names
+    for name in site.template_names:
+        assert 'load %s' % name in names
+    assert 'render template4.html' in names
+    assert 'write template4.html' in names
+    assert 'context template2.html' in names
+    assert 'copy static_css/hello.css' in names
+    # The workers have their own lanes, and every lane is named.
+    assert len(set(event['pid'] for event in spans)) > 1
+    lanes = set((event['pid'], event['tid']) for event in events
+                if event['name'] == 'thread_name')
+    assert lanes == set((event['pid'], event['tid']) for event in spans)
+
+    trace = TraceRecorder()
+    reloader = Reloader(site, trace=trace)
+    reloader.event_handler("modified",
+                           str(template_path.join('template1.html')))
+    assert site.trace is trace
+    names = [event['name'] for event in trace.events]
+    assert 'batch' in names
+    assert 'render template1.html' in names
+
+
+def test_render_records_dynamic_deps(site, template_path, build_path):
+    template_path.join('dynamic.html').write('{% include layout %}')
+    site.contexts = [('dynamic.html', {'layout': '_partial2.html'})]
+    site.render_templates(['dynamic.html'])
+    assert build_path.join('dynamic.html').read() == 'Partial 2'
+    assert site.recorded_deps['dynamic.html'] == set(['_partial2.html'])
+
+    reloader = Reloader(site)
+    assert 'dynamic.html' in site.dep_graph.get_descendants('_partial2.html')
+    mock_render_templates = mock.Mock()
+    site.render_templates = mock_render_templates
+    reloader.event_handler("modified",
+                           str(template_path.join('_partial2.html')))
+    assert 'dynamic.html' in set(mock_render_templates.call_args[0][0])
+
+
+def test_render_records_deps_parallel(site, template_path):
+    template_path.join('dynamic.html').write('{% include layout %}')
+    site.contexts = [('dynamic.html', {'layout': '_partial2.html'})]
+    site.dep_graph = DepGraph(site)
+    assert 'dynamic.html' not in site.dep_graph.get_descendants(
+        '_partial2.html')
+    site.render_templates(['dynamic.html', 'template1.html'], jobs=2)
+    assert site.recorded_deps['dynamic.html'] == set(['_partial2.html'])
+    assert 'dynamic.html' in site.dep_graph.get_descendants('_partial2.html')
+
+
+def test_render_records_data_files(site, template_path):
+    def data(template):
+        with site.open_data('data1') as f:
+            return {'b': f.read()}
+
+    def cached_data():
+        with open(site.data_path('data2')) as f:
+            return {'c': f.read()}
+
+    site.datapaths = ['data', 'data1', 'data2']
+    site.contexts = [('template4.html', data),
+                     ('sub/.*', CachedContext(cached_data))]
+    site.render_templates(['template4.html', 'sub/template3.html'])
+    assert site.recorded_deps['template4.html'] == set(['data1'])
+    assert site.recorded_deps['sub/template3.html'] == set(
+        ['data2', '_partial2.html'])
+
+    # The cached context is reused, its data file is still recorded
+    site.render_templates(['sub/template3.html'])
+    assert 'data2' in site.recorded_deps['sub/template3.html']
+
+    reloader = Reloader(site)
+    mock_render_templates = mock.Mock()
+    site.render_templates = mock_render_templates
+    reloader.event_handler("modified", str(template_path.join('data1')))
+    assert 'template4.html' in set(mock_render_templates.call_args[0][0])
+
+
 def test_build(site):
     templates = []
 
@@ -405,6 +962,225 @@ def test_build(site):
     assert templates == list(site.templates)
 
 
+def test_incremental_render_skips_unchanged(site, template_path):
+    site.incremental = True
+    rendered = []
+    real_render_templates = site.render_templates
+
+    def render_templates(filenames, outpath=None, jobs=1):
+        rendered.append(sorted(filenames))
+        real_render_templates(filenames, outpath, jobs)
+
+    site.render_templates = render_templates
+    site.render()
+    assert rendered[-1] == sorted(site.template_names)
+    assert template_path.join('..', 'build', Manifest.filename).check()
+
+    site.render()
+    assert rendered[-1] == []
+
+    template_path.join('data', 'data3').write('New data 3')
+    site.render()
+    assert rendered[-1] == [
+        'sub/template3.html', 'template1.html', 'template2.html',
+        'template4.html',
+    ]
+
+    site.render(force=True)
+    assert rendered[-1] == sorted(site.template_names)
+
+
+@mark.parametrize('jobs', [1, 2])
+def test_incremental_render_contexts_computed_once(site, jobs, tmpdir):
+    site.incremental = True
+    calls = tmpdir.join('calls')
+
+    def context():
+        # Workers can't append to a list of the main process.
+        calls.write('x', mode='a')
+        return {'b': 3}
+
+    site.contexts = [('template2.html', {'a': 1}),
+                     ('.*template[34].html', context)]
+    site.render(jobs=jobs)
+    assert len(calls.read()) == 2
+    assert site._pending_contexts == {}
+
+
+def test_incremental_render_records_context_data(site, template_path,
+                                                 build_path):
+    site.incremental = True
+    template_path.join('data', 'x.jsonl').write('{"id": 1, "t": "old"}\n')
+    template_path.join('data', 'y.json').write('{"t": "old"}')
+    template_path.join('template5.html').write('{{ x }} {{ y }}')
+    site.contexts = [
+        ('template2.html', {'a': 1}),
+        ('template5.html', lambda: {
+            'x': site.record_index('data/x.jsonl', 'id')[1]['t'],
+            'y': site.load_data('data/y.json')['t'],
+        }),
+    ]
+    site.sources.scan()
+    site.render()
+    assert site.recorded_deps['template5.html'] == set(
+        ['data/x.jsonl', 'data/y.json'])
+
+    template_path.join('data', 'x.jsonl').write('{"id": 1, "t": "new"}\n')
+    site.render()
+    assert build_path.join('template5.html').read() == 'new old'
+
+    reloader = Reloader(site)
+    template_path.join('data', 'y.json').write('{"t": "new"}')
+    reloader.event_handler("modified",
+                           str(template_path.join('data', 'y.json')))
+    assert build_path.join('template5.html').read() == 'new new'
+
+
+def test_incremental_render_missing_output(site, build_path):
+    site.incremental = True
+    site.render()
+    build_path.join('template1.html').remove()
+    assert site.outdated_templates(
+        list(site.template_names), Manifest.load(site.manifest_path)
+    ) == ['template1.html']
+
+
+def test_incremental_render_unparsable_partial(site, template_path,
+                                               build_path):
+    site.incremental = True
+    template_path.join('_unused.html').write('{% if %}')
+    template_path.join('_broken.html').write('{% for %}')
+    template_path.join('template5.html').write('{% include "_broken.html" %}')
+    site.sources.scan()
+    with raises(TemplateSyntaxError):
+        site.render()
+    assert build_path.join('template1.html').check()
+    assert site.unparsed_templates == set(['_unused.html', '_broken.html'])
+
+    template_path.join('template5.html').write('Fixed')
+    site.sources.scan()
+    site.render()
+    assert build_path.join('template5.html').read() == 'Fixed'
+    template_path.join('_broken.html').write('Fixed partial')
+    site.sources.scan()
+    site.render()
+    assert site.unparsed_templates == set(['_unused.html'])
+
+
+def test_context_hash_memo():
+    import json
+    from staticjinja.manifest import context_hash
+    shared = {'items': list(range(10))}
+    memo = {}
+    with mock.patch('json.dumps', wraps=json.dumps) as mock_dumps:
+        hashes = [context_hash({'a': shared, 'b': n}, memo)
+                  for n in range(3)]
+    assert len([c for c in mock_dumps.call_args_list
+                if c[0][0] is shared]) == 1
+    assert hashes[0] == context_hash({'b': 0, 'a': shared})
+    assert len(set(hashes)) == 3
+
+
+def test_render_prune(site, template_path, build_path):
+    site.incremental = True
+    site.render()
+    assert build_path.join('sub', 'template3.html').check()
+    assert build_path.join('static_css', 'hello.css').check()
+
+    template_path.join('sub', 'template3.html').remove()
+    template_path.join('static_css', 'hello.css').remove()
+    site.sources.scan()
+    site.render()
+    assert build_path.join('sub', 'template3.html').check()
+
+    site.render(prune=True)
+    assert not build_path.join('sub').check()
+    assert not build_path.join('static_css').check()
+    assert build_path.join('template1.html').check()
+    assert build_path.join('static_js', 'hello.js').check()
+
+
+def test_template_cache(site, template_path, build_path, tmpdir):
+    cachepath = str(tmpdir.join('cache'))
+
+    def cached_site():
+        return make_site(searchpath=str(template_path),
+                         outpath=str(build_path),
+                         cachepath=cachepath)
+
+    cold = cached_site()
+    cold.render()
+    assert cold.template_cache.hits == 0
+    assert cold.template_cache.misses > 0
+
+    warm = cached_site()
+    warm.render()
+    assert warm.template_cache.misses == 0
+    assert warm.template_cache.hits == cold.template_cache.misses
+
+    warm.template_cache.invalidate(['template1.html'])
+    warm._env.cache.clear()
+    warm.render_template(warm.get_template('template1.html'))
+    assert warm.template_cache.misses == 1
+
+    # Templates extending a changed partial keep their compiled version.
+    reloader = Reloader(cached_site())
+    reloader.site.render()
+    reloader.site.render_templates = mock.Mock()
+    template_path.join('_partial1.html').write(
+        'New partial\n{% block content %}{% endblock -%}')
+    reloader.event_handler("modified",
+                           str(template_path.join('_partial1.html')))
+    assert reloader.site.render_templates.call_count == 1
+    after_edit = cached_site()
+    after_edit.render()
+    assert after_edit.template_cache.misses == 1
+
+    # Workers report their hits and misses to the main process.
+    parallel = cached_site()
+    parallel.render(jobs=2, force=True)
+    assert parallel.template_cache.misses == 0
+    assert parallel.template_cache.hits >= cold.template_cache.misses
+
+
+def test_template_cache_eviction(site, template_path, build_path, tmpdir,
+                                 monkeypatch):
+    cachepath = tmpdir.join('cache')
+    site = make_site(searchpath=str(template_path),
+                     outpath=str(build_path),
+                     cachepath=str(cachepath))
+    site.render()
+    cache = site.template_cache
+    entries = sorted(cache._entries())
+    assert len(entries) > 1
+
+    cache.evict(entries[-1][1])
+    assert [path for _, _, path in cache._entries()] == [entries[-1][2]]
+
+    # The cache is only scanned when it goes over cache_size.
+    scans = []
+    entries_func = TemplateCache._entries
+    monkeypatch.setattr(TemplateCache, '_entries',
+                        lambda self: scans.append(1) or entries_func(self))
+    site = make_site(searchpath=str(template_path),
+                     outpath=str(build_path),
+                     cachepath=str(tmpdir.join('cache2')),
+                     cache_size=10 ** 6)
+    site.render()
+    assert len(scans) == 1
+
+    cap = entries[-1][1] * 2
+    site = make_site(searchpath=str(template_path),
+                     outpath=str(build_path),
+                     cachepath=str(tmpdir.join('cache3')),
+                     cache_size=cap)
+    site.render()
+    assert 1 < len(scans) < 1 + len(entries)
+    cache = site.template_cache
+    assert cache._size == sum(size for _, size, _ in cache._entries())
+    assert cache._size <= cap
+
+
 def test_use_reloader_calls_watch(reloader, site, monkeypatch):
     mock_watch = mock.Mock()
     monkeypatch.setattr(Reloader, 'watch', mock_watch)
@@ -420,7 +1196,9 @@ def test_should_handle(reloader, template_path):
     assert reloader.should_handle("modified", str(template1_path))
     assert reloader.should_handle("modified", str(test4_path))
     assert reloader.should_handle("created", str(template1_path))
-    assert not reloader.should_handle("deleted", str(template1_path))
+    assert reloader.should_handle("deleted", str(template1_path))
+    assert not reloader.should_handle("deleted", "/elsewhere/template1.html")
+    assert not reloader.should_handle("deleted", str(template_path))
 
 
 def test_event_handler_ignored_files(reloader, template_path):
@@ -468,6 +1246,239 @@ def test_event_handler_create_template(reloader, template_path):
     mock_render_templates.assert_called_once_with(["template6.html"])
 
 
+def test_event_handler_moved_template(reloader, template_path):
+    mock_render_templates = mock.Mock()
+    reloader.site.render_templates = mock_render_templates
+
+    template_path.join('template1.html').rename(
+        template_path.join('template6.html'))
+    reloader.event_handler("moved", str(template_path.join("template1.html")),
+                           str(template_path.join("template6.html")))
+    mock_render_templates.assert_called_once_with(["template6.html"])
+    assert "template1.html" not in reloader.site.template_names
+    assert "template6.html" in reloader.site.template_names
+
+
+def test_event_handler_delete_template(reloader, template_path, build_path):
+    reloader.site.render()
+    mock_render_templates = mock.Mock()
+    reloader.site.render_templates = mock_render_templates
+
+    template_path.join('sub', 'template3.html').remove()
+    reloader.event_handler("deleted",
+                           str(template_path.join('sub', 'template3.html')))
+    assert mock_render_templates.call_count == 0
+    assert not build_path.join('sub').check()
+    assert 'sub/template3.html' not in reloader.site.dep_graph
+    assert 'sub/template3.html' not in reloader.site.template_names
+
+
+def test_event_handler_delete_partial(reloader, template_path):
+    mock_render_templates = mock.Mock()
+    reloader.site.render_templates = mock_render_templates
+
+    template_path.join('_partial1.html').remove()
+    reloader.event_handler("deleted",
+                           str(template_path.join('_partial1.html')))
+    mock_render_templates.assert_called_once_with(
+        ['template1.html', 'template2.html'])
+    parents = reloader.site.dep_graph.parents
+    assert parents['_partial1.html'] == set()
+    assert '_partial1.html' in parents['template1.html']
+
+
+def test_event_handler_move_template_output(reloader, template_path,
+                                            build_path):
+    reloader.site.render()
+    mock_render_templates = mock.Mock()
+    reloader.site.render_templates = mock_render_templates
+    output = build_path.join('template1.html').read()
+
+    template_path.join('template1.html').rename(
+        template_path.join('sub', 'template6.html'))
+    reloader.event_handler("moved", str(template_path.join("template1.html")),
+                           str(template_path.join('sub', "template6.html")))
+    mock_render_templates.assert_called_once_with(["sub/template6.html"])
+    assert not build_path.join('template1.html').check()
+    assert build_path.join('sub', 'template6.html').read() == output
+
+
+def test_dep_graph_remove():
+    graph = DepGraph.from_parents({'a': set(), 'b': set(['a']),
+                                   'c': set(['b'])})
+    assert graph.get_descendants('a') == ('b', 'c')
+    graph.remove('c')
+    assert 'c' not in graph
+    assert graph.get_descendants('a') == ('b',)
+    graph.remove('a')
+    assert 'a' in graph
+    assert graph.parents == {'a': set(), 'b': set(['a'])}
+    assert len(graph) == 2
+
+
+def test_get_watcher():
+    assert get_watcher('inotify') is InotifyWatcher
+    assert get_watcher().is_available()
+    with raises(ValueError):
+        get_watcher('nope')
+
+
+@mark.skipif(not InotifyWatcher.is_available(),
+             reason="inotify is not available")
+def test_inotify_watcher(tmpdir):
+    events = []
+    watcher = InotifyWatcher(str(tmpdir), lambda *args: events.append(args))
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        while watcher._fd is None or not watcher._wds:
+            time.sleep(0.01)
+        tmpdir.join('a.html').write('a')
+        tmpdir.join('a.html').rename(tmpdir.join('b.html'))
+        tmpdir.mkdir('sub').join('c.html').write('c')
+        tmpdir.join('b.html').remove()
+        time.sleep(0.3)
+    finally:
+        watcher.stop()
+        thread.join(5)
+    a, b, c = (str(tmpdir.join(name)) for name in
+               ['a.html', 'b.html', 'sub/c.html'])
+    assert ('created', a) in events
+    assert ('modified', a) in events
+    assert ('moved', a, b) in events
+    assert ('deleted', b) in events
+    assert ('created', c) in events or ('modified', c) in events
+    assert str(tmpdir.join('sub')) in watcher._wds
+
+
+@mark.skipif(not InotifyWatcher.is_available(),
+             reason="inotify is not available")
+def test_inotify_watcher_directories(tmpdir):
+    root = tmpdir.mkdir('root')
+    root.mkdir('sub').join('a.html').write('a')
+    root.mkdir('gone').join('b.html').write('b')
+    events = []
+    watcher = InotifyWatcher(str(root), lambda *args: events.append(args))
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        while watcher._fd is None or len(watcher._wds) < 3:
+            time.sleep(0.01)
+        root.join('sub').rename(root.join('sub2'))
+        root.join('gone').rename(tmpdir.join('gone'))
+        time.sleep(0.3)
+    finally:
+        watcher.stop()
+        thread.join(5)
+    a, a2, b = (str(root.join(name)) for name in
+                ['sub/a.html', 'sub2/a.html', 'gone/b.html'])
+    assert sorted(events) == [('deleted', b), ('moved', a, a2)]
+
+    # Lost events are recovered by scanning the tree again.
+    del events[:]
+    watcher._fd = staticjinja.watchers._load_libc().inotify_init1(0)
+    try:
+        watcher._rescan()
+        assert events == [('modified', a2)]
+        del events[:]
+        root.join('c.html').write('c')
+        root.join('sub2').remove()
+        watcher._handle([(staticjinja.watchers.IN_Q_OVERFLOW, 0, str(root))])
+    finally:
+        os.close(watcher._fd)
+    assert events == [('created', str(root.join('c.html'))),
+                      ('deleted', a2)]
+
+
+def test_polling_watcher(tmpdir):
+    events = []
+    tmpdir.mkdir('sub').join('a.html').write('a')
+    tmpdir.join('b.html').write('b')
+    watcher = PollingWatcher(str(tmpdir), lambda *args: events.append(args),
+                             full_scan_interval=3600)
+    watcher.scan()
+    watcher.poll()
+    assert events == []
+
+    tmpdir.join('sub', 'a.html').rename(tmpdir.join('c.html'))
+    tmpdir.join('b.html').write('bb')
+    tmpdir.mkdir('new').join('d.html').write('d')
+    watcher.poll()
+    a, b, c, d = (str(tmpdir.join(name)) for name in
+                  ['sub/a.html', 'b.html', 'c.html', 'new/d.html'])
+    assert sorted(events) == [('created', d), ('modified', b),
+                              ('moved', a, c)]
+
+    # Modified in place, in an unchanged directory: only seen by full scans.
+    del events[:]
+    tmpdir.join('new', 'd.html').write('dd')
+    watcher.poll()
+    assert events == []
+    watcher.full_scan_interval = 0
+    watcher.poll()
+    assert events == [('modified', d)]
+
+    del events[:]
+    tmpdir.join('new').remove()
+    watcher.poll()
+    assert events == [('deleted', d)]
+    assert str(tmpdir.join('new')) not in watcher.snapshot
+
+
+def test_event_handler_debounce(site, template_path):
+    reloader = Reloader(site, debounce=0.05)
+    mock_render_templates = mock.Mock()
+    reloader.site.render_templates = mock_render_templates
+
+    for name in ['_partial1.html', '_partial2.html', 'template1.html',
+                 '_partial2.html']:
+        reloader.event_handler("modified", str(template_path.join(name)))
+    assert mock_render_templates.call_count == 0
+    time.sleep(0.3)
+    mock_render_templates.assert_called_once_with(
+        ['sub/template3.html', 'template1.html', 'template2.html'])
+
+
+def test_render_worker_prioritizes_new_changes():
+    rendered = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def render_templates(names):
+        started.set()
+        release.wait(5)
+        rendered.extend(names)
+
+    site = mock.Mock()
+    site.render_templates = render_templates
+    worker = RenderWorker(site)
+    worker.start()
+    worker.submit(['a.html', 'b.html', 'c.html'])
+    started.wait(5)
+    worker.submit(['c.html', 'd.html'])
+    assert worker.pending == ['c.html', 'd.html', 'b.html']
+    release.set()
+    assert worker.wait(5)
+    worker.stop()
+    assert rendered == ['a.html', 'c.html', 'd.html', 'b.html']
+
+
+def test_event_handler_background(site, template_path):
+    reloader = Reloader(site, debounce=0.05, background=True)
+    mock_render_templates = mock.Mock()
+    reloader.site.render_templates = mock_render_templates
+    reloader.event_handler("modified",
+                           str(template_path.join('_partial2.html')))
+    reloader.event_handler("modified",
+                           str(template_path.join('template2.html')))
+    time.sleep(0.3)
+    assert reloader.worker.wait(5)
+    reloader.worker.stop()
+    rendered = [c[0][0][0] for c in mock_render_templates.call_args_list]
+    assert rendered == [
+        'template2.html', 'sub/template3.html', 'template1.html']
+
+
 def test_event_handler_static(reloader, template_path):
     found_files = []
 
@@ -481,6 +1492,157 @@ def test_event_handler_static(reloader, template_path):
     assert found_files == list(reloader.site.static_names)
 
 
+@fixture
+def devserver(site):
+    server = DevServer(site, port=0, debounce=0)
+    server.make_httpd()
+    thread = threading.Thread(target=server.httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.worker.start()
+    yield server
+    server.httpd.shutdown()
+    server.stop()
+
+
+def fetch(server, path, headers=None):
+    try:
+        from urllib.request import Request, urlopen
+        from urllib.error import HTTPError
+    except ImportError:
+        from urllib2 import Request, urlopen, HTTPError
+    request = Request('http://127.0.0.1:%d%s' % (server.port, path),
+                      headers=headers or {})
+    try:
+        response = urlopen(request, timeout=5)
+    except HTTPError as e:
+        return e.code, e.headers, e.read()
+    return response.getcode(), response.headers, response.read()
+
+
+def test_devserver_renders_in_memory(devserver, build_path):
+    status, headers, body = fetch(devserver, '/template1.html')
+    assert status == 200
+    assert body.startswith(b'Partial 1\nTemplate 1')
+    assert b'EventSource' in body
+    assert headers['Content-Type'] == 'text/html; charset=utf8'
+    assert not build_path.join('template1.html').check()
+
+    status, _, _ = fetch(devserver, '/template1.html',
+                         {'If-None-Match': headers['ETag']})
+    assert status == 304
+
+    assert fetch(devserver, '/static_css/hello.css')[2] == (
+        b'a { color: blue; }')
+    assert fetch(devserver, '/_partial1.html')[0] == 404
+    assert fetch(devserver, '/../build/template1.html')[0] == 404
+    assert fetch(devserver, '/sub')[0] == 404
+
+
+def test_devserver_reload(devserver, template_path):
+    devserver.get_page('template1.html')
+    devserver.worker.render = mock.Mock()
+    generation = devserver.generation
+
+    template_path.join('_partial1.html').write(
+        'New partial\n{% block content %}{% endblock -%}')
+    devserver.reloader.event_handler(
+        "modified", str(template_path.join('_partial1.html')))
+    assert devserver.wait_for_change(generation, 5) == generation + 1
+    assert 'template1.html' not in devserver.pages
+    # Requested before the worker renders it.
+    body = fetch(devserver, '/template1.html')[2]
+    assert body.startswith(b'New partial\nTemplate 1')
+
+
+def test_devserver_leaves_outpath_alone(devserver, template_path,
+                                        build_path):
+    devserver.site.render()
+    devserver.get_page('template4.html')
+    devserver.worker.render = mock.Mock()
+
+    template_path.join('template1.html').rename(
+        template_path.join('template5.html'))
+    template_path.join('template4.html').remove()
+    reloader = devserver.reloader
+    reloader.event_handler("moved", str(template_path.join('template1.html')),
+                           str(template_path.join('template5.html')))
+    reloader.event_handler("deleted",
+                           str(template_path.join('template4.html')))
+    assert build_path.join('template1.html').check()
+    assert not build_path.join('template5.html').check()
+    assert build_path.join('template4.html').check()
+    assert 'template4.html' not in devserver.pages
+
+
+@mock.patch('os.path.isdir')
+@mock.patch('os.getcwd')
+@mock.patch('staticjinja.cli.staticjinja.make_site')
+def test_cli_profile(mock_make_site, mock_getcwd, mock_isdir):
+    mock_isdir.return_value = True
+    mock_getcwd.return_value = '/'
+    cli.render({
+        '--srcpath': None,
+        '--outpath': None,
+        '--static': None,
+        '--cprofile': True,
+        'watch': False,
+    })
+
+    profile = mock_make_site.return_value.render.call_args[1]['profile']
+    assert profile.path == 'staticjinja-profile.json'
+    assert profile.cprofile
+
+
+def test_cli_imports_are_lazy():
+    import subprocess
+
+    # Modules only needed to watch, serve, profile, run in parallel or parse
+    # the command line must not slow down the startup of small builds.
+    code = ("import sys, staticjinja.cli; "
+            "print(' '.join(sorted(sys.modules)))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(cli.__file__)))
+    modules = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+    modules = set(modules.decode('ascii').split())
+    lazy = set(['staticjinja.watchers', 'staticjinja.server',
+                'staticjinja.reloader', 'staticjinja.profiling',
+                'staticjinja.tracing', 'ctypes', 'multiprocessing',
+                'tarfile', 'zipfile', 'docopt'])
+    assert not modules & lazy
+
+
+def test_make_site_relative_searchpath(monkeypatch, tmpdir):
+    main = mock.Mock(__file__=str(tmpdir.join('build.py')))
+    monkeypatch.setitem(sys.modules, '__main__', main)
+    site = make_site(searchpath='templates')
+    assert site.searchpath == os.path.join(os.path.realpath(str(tmpdir)),
+                                           'templates')
+
+    monkeypatch.setitem(sys.modules, '__main__', mock.Mock(spec=[]))
+    monkeypatch.chdir(tmpdir)
+    site = make_site(searchpath='templates')
+    assert site.searchpath == os.path.join(os.getcwd(), 'templates')
+
+
+def test_benchmarks(tmpdir):
+    from benchmarks.sitegen import SiteSpec
+    from benchmarks.suite import BenchmarkSuite, compare, run_suite
+
+    spec = SiteSpec(pages=6, depth=2, fanout=2, sharing=3, static=2,
+                    data_files=2, data_size=200)
+    data = run_suite(spec, repeat=1)
+    assert set(data['results']) == set(BenchmarkSuite.benchmarks)
+    assert data['spec'] == spec.as_dict()
+    assert len(compare(data, data)) == len(data['results']) + 1
+
+    suite = BenchmarkSuite(spec, workdir=str(tmpdir))
+    site = suite.make_site()
+    site.render()
+    assert len(site.template_names) == 6
+    assert tmpdir.join('build', 'pages', 'd1', 'page00005.html').check()
+    assert tmpdir.join('build', 'static', 'file1.css').check()
+
+
 def test_ignored_file_is_ignored(site):
     assert site.is_ignored('.index.html')
 
@@ -530,7 +1692,8 @@ def test_cli_srcpath(mock_make_site, mock_getcwd, mock_isdir):
     mock_make_site.assert_called_once_with(
         searchpath='/templates',
         outpath='/',
-        staticpaths=None
+        staticpaths=None,
+        incremental=False
     )
 
 
@@ -551,7 +1714,8 @@ def test_cli_srcpath_default(mock_make_site, mock_getcwd, mock_isdir):
     mock_make_site.assert_called_once_with(
         searchpath='/templates',
         outpath='/',
-        staticpaths=None
+        staticpaths=None,
+        incremental=False
     )
 
 
@@ -571,5 +1735,57 @@ def test_cli_srcpath_absolute(mock_make_site, mock_getcwd, mock_isdir):
     mock_make_site.assert_called_once_with(
         searchpath='/foo/templates',
         outpath='/',
-        staticpaths=None
+        staticpaths=None,
+        incremental=False
     )
+
+
+@mock.patch('os.path.isdir')
+@mock.patch('os.getcwd')
+@mock.patch('staticjinja.cli.staticjinja.make_site')
+def test_cli_jobs(mock_make_site, mock_getcwd, mock_isdir):
+    mock_isdir.return_value = True
+    mock_getcwd.return_value = '/'
+    cli.render({
+        '--srcpath': None,
+        '--outpath': None,
+        '--static': None,
+        '--jobs': '4',
+        'watch': False,
+    })
+
+    mock_make_site.return_value.render.assert_called_once_with(
+        use_reloader=False,
+        jobs=4,
+        force=False,
+        watcher=None,
+        prune=False,
+        profile=None,
+        trace=None
+    )
+
+
+@mock.patch('os.path.isdir')
+@mock.patch('os.getcwd')
+@mock.patch('staticjinja.cli.staticjinja.make_site')
+def test_cli_poll_intervals(mock_make_site, mock_getcwd, mock_isdir):
+    mock_isdir.return_value = True
+    mock_getcwd.return_value = '/'
+    args = {
+        '--srcpath': None,
+        '--outpath': None,
+        '--static': None,
+        '--poll-interval': '2',
+        '--full-scan-interval': '30',
+        'watch': True,
+    }
+    cli.render(args)
+
+    watcher = mock_make_site.return_value.render.call_args[1]['watcher']
+    assert watcher.func is PollingWatcher
+    assert watcher.keywords == {'interval': 2.0, 'full_scan_interval': 30.0}
+
+    with raises(SystemExit):
+        cli.render(dict(args, **{'--watcher': 'inotify'}))
+    with raises(SystemExit):
+        cli.render(dict(args, **{'--poll-interval': 'often'}))